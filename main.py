@@ -1,8 +1,9 @@
 """!
 This is the main thread from which the program is started/runs.
-This thread will periodically call the sensor worker processes to 
-poll for their data. This data is returned here, so it can be analysed
+The control engine receives the data of the sensor worker processes, so it can be analysed
 and control signals can be generated.
+The control engine does not depend on tkinter: it runs headless (e.g, on a box without a screen),
+or in its own process with the GUI attached to it as a client, through a pair of queues.
 """
 
 import sys
@@ -11,59 +12,138 @@ import datetime
 import atexit
 import argparse
 import os
-from tkinter import Tk
-from multiprocessing import Queue, Process, active_children, set_start_method
-from src.GUI.GUI import GrowSpaceGUI
+import copy
+import math
+import signal
+from multiprocessing import Queue, Process, Pipe, active_children, set_start_method
+from multiprocessing.connection import wait
+from queue import Empty
 from datetime import datetime, timedelta
-from src.utilities.pickle_utilities import export_object
-from src.utilities.json_utilities import save_as_json, load_from_json
+from src.utilities.json_utilities import save_as_json
+from src.utilities.state_utilities import Configuration, LiveState, STATUS_FIELDS, OVERRIDE_FIELDS
+from src.utilities.wal_utilities import WriteAheadLog
+from src.utilities.timeseries_utilities import TimeSeriesStore
+from src.utilities.sqlite_utilities import SQLiteStorage
+from src.utilities.flusher_utilities import BackgroundFlusher
+from src.utilities.retention_utilities import RetentionPolicy, HOUR
+from src.utilities.sensor_hub import SensorHub
+from src.utilities.sensor_template import exit_on_signal
+from src.utilities.shared_ring_utilities import SharedRingBuffer
+from src.utilities.adaptive_utilities import AdaptivePolling
+from src.utilities.i2c_bus_utilities import I2CBusManager
+from src.utilities.delivery_utilities import DeliveryMonitor
 from src.utilities.logger_utilities import get_logger
 from src.utilities.file_utilities import generate_unique_filename
-from src.utilities.algorithms import watering_algorithm, environment_algorithm, time_keeper
-from src.utilities.control_processes import watering_process, fan_process, lighting_process, fan_hourly_process
+from src.utilities.algorithms import watering_algorithm, environment_algorithm
+from src.utilities.control_processes import pump_time, lighting_process, fan_hourly_process
+from src.utilities.actuator_utilities import ActuatorService, RUN, DONE, CANCELLED
+from src.utilities.timer_utilities import TimerHeap, next_hour
 
 
-class ThreadedClient:
+# Field tracked by the adaptive polling policy of each kind of sensor, and the rate of change (units/s) that speeds it up
+ADAPTIVE_POLLING = {'soil_moisture_sensor': ('value', 0.05), 'environment_sensor': ('temperature', 0.01)}
+
+# Kind of sensor that is sped up when each control element turns on
+ACTUATED_SENSORS = {"Pump Status": 'soil_moisture_sensor', "Fan Status": 'environment_sensor'}
+
+# Time (s) a pump run may take beyond its duration to report back, before main stops the pump itself
+PUMP_STOP_ALLOWANCE = 5.0
+
+# Time (s) between two checks of the wall clock, so events tied to the time of day notice it being stepped forward
+CLOCK_CHECK_INTERVAL = 60.0
+
+
+class ControlEngine:
     """!
-    This is the main thread class.
+    This is the control engine class. It runs its own main loop (see run), and never touches the GUI directly:
+    everything meant for the GUI is sent through main_to_gui_queue, if a GUI is attached.
     In the future, when more boxes are implemented, there would be multiple
     instances of this class used, where each instance is for 1 box.
     @param configuration_file: Path to the current active system configuration file.
     @param controls: A dictionary containing access to control objects (e.g, relays).
-    @param control_processes: A dictionary containing access to control processes.
+    @param actuator: The actuator service, which owns the pump and the fan. Their entries in controls send it commands.
     @param control_statuses: A dictionary containing information about the status of control elements.
-    @param db_master: The master database of the system.
-    @param gui: This is the main GUI window.
+    @param config: The active configuration (environment parameters) of the system.
+    @param state: The live state of the system (control element statuses, manual overrides, watering timing).
+    @param history: Time-series store holding the reading history of every sensor.
+    @param history_overwritten: Number of raw readings overwritten in the history before being rolled up, as of the last roll-up
     @param main_running: Flag to show if the main loop is running/called to exit.
-    @param main_to_gui_queue: Uni-directional queue going FROM this thread TO the gui
+    @param main_to_gui_queue: Uni-directional queue going FROM this thread TO the gui. None if no GUI is attached.
     @param gui_to_main_queue: Uni-directional queue going FROM the gui TO this thread
     @param sensors: A dictionary mapping all Sensor class instances to a unique name. These are the sensors of the system.
     @param sensor_processes: A dictionary mapping all Sensor worker processes to a unique name. These are the sensor processes of the system.
     @param simulated: Flag to show if the environment is a simulation
+    @param use_sensor_hub: Flag to show if all sensors run in a single sensor hub process, rather than one process each
+    @param use_shared_memory: Flag to show if sensors relay their readings through shared memory ring buffers, rather than queues
+    @param use_bus_manager: Flag to show if the sensors share the I2C bus through a bus manager process, rather than each opening it
+    @param bus_manager: The I2C bus manager, if it is used
+    @param delivery: Tracks the sequence numbers of the readings of each sensor (gaps, duplicates), and their latency
+    @param tick_budget: Time (s) each iteration of the main loop may spend on handling the messages that have built up
+    @param queue_depths: Dictionary mapping each inbound queue to its (current, peak) depth
+    @param doorbell: Connection that becomes readable when end_application is called, which wakes the main loop up
+    @param timers: Every timed event of the system (lighting and fan schedule changes, hourly housekeeping, soak-in, pump stop, clock check)
+    @param wal: Write-ahead log that persists changes to the live state and the sensor history
+    @param sqlite: Optional SQLite storage engine that records readings, status changes and manual overrides
+    @param flusher: Background thread that writes everything that is persisted, so the main loop never waits on the disk
+    @param changes_since_checkpoint: Number of changes persisted since the last database snapshot
+    @param retention: Retention policy that rolls up aging sensor history into 1-minute and 1-hour aggregates
     """
 
     configuration_file: str = None
     controls: dict = dict()
-    control_processes: dict = dict()
+    actuator: ActuatorService = None
     control_statuses: dict = dict()
-    db_master: dict = dict()
-    gui: GrowSpaceGUI = None
+    config: Configuration = None
+    state: LiveState = None
+    history: TimeSeriesStore = None
+    history_overwritten: int = 0
     main_running: bool = True
-    main_to_gui_queue: Queue = Queue()
-    gui_to_main_queue: Queue = Queue()
+    main_to_gui_queue: Queue = None
+    gui_to_main_queue: Queue = None
     sensors: dict = dict()
     sensor_processes: dict = dict()
     simulated: bool = False
-
-    def __init__(self, master, configuration_file="basil", gui_refresh_interval=200, polling_interval=2, simulate_environment=False):
+    use_sensor_hub: bool = False
+    use_shared_memory: bool = False
+    use_bus_manager: bool = False
+    bus_manager: I2CBusManager = None
+    delivery: DeliveryMonitor = None
+    tick_budget: float = 0.1
+    queue_depths: dict = None
+    doorbell = None
+    timers: TimerHeap = None
+    wal: WriteAheadLog = None
+    sqlite: SQLiteStorage = None
+    flusher: BackgroundFlusher = None
+    changes_since_checkpoint: int = 0
+    retention: RetentionPolicy = None
+
+    def __init__(self, configuration_file="basil", polling_interval=2, simulate_environment=False, checkpoint_interval=1000, history_capacity=None, use_sqlite=False, flush_window=5.0, max_dirty_age=30.0, raw_retention_hours=48, use_sensor_hub=False, use_shared_memory=False, soil_burst_size=1, fast_polling_interval=0, soil_channels=(0,), use_bus_manager=False, gas_interval=0, tick_budget=0.1, main_to_gui_queue=None, gui_to_main_queue=None):
         """!
-        Launches the GUI and the asynchronous worker processes (1 for each sensor).
-        @param master: The root (instance) of a Tkinter top-level widget.
+        Launches the asynchronous worker processes (1 for each sensor). Call run to start the main loop.
         @param configuration_file: The path to the configuration file that is to be loaded.
         @param simulate_environment: Flag for if the environment is to be simulated (for development).
+        @param checkpoint_interval: Number of database changes between full database snapshots.
+        @param history_capacity: Number of readings kept in the history of each sensor field. None sizes it to hold the raw retention window at the fastest polling interval.
+        @param use_sqlite: Flag for if readings, status changes and manual overrides should also be stored in SQLite.
+        @param flush_window: Time (s) without new changes after which pending changes are written to disk.
+        @param max_dirty_age: Maximum time (s) a change can wait before it is written to disk.
+        @param raw_retention_hours: Time (h) that raw sensor readings are kept for before being rolled up.
+        @param use_sensor_hub: Flag for if all sensors should run in a single sensor hub process.
+        @param use_shared_memory: Flag for if sensors should relay their readings through shared memory ring buffers.
+        @param soil_burst_size: Number of conversions each soil moisture sensor takes (and aggregates) per poll.
+        @param fast_polling_interval: Polling interval (s) of sensors whose readings are changing quickly. 0 disables adaptive polling.
+        @param soil_channels: Converter channels that soil moisture probes are connected to. All of them are scanned by one sensor.
+        @param use_bus_manager: Flag for if the sensors should share the I2C bus through a bus manager process.
+        @param gas_interval: Minimum time (s) between gas measurements of the environment sensor. 0 measures gas on every poll.
+        @param tick_budget: Time (s) each iteration of the main loop may spend on handling the messages that have built up.
+        @param main_to_gui_queue: Queue to the GUI, if one is attached. None runs headless.
+        @param gui_to_main_queue: Queue from the GUI, if one is attached.
         """
 
         # Before doing anything else, register a safe shutdown method for if the program crashes
+        # (along with the doorbell it rings)
+        self.doorbell, self._bell = Pipe(duplex=False)
         atexit.register(self.end_application)
 
         # Ensure that there is a directory for log files to go to.
@@ -77,28 +157,29 @@ class ThreadedClient:
         # Ensure that there is a directory for databases to be stored.
         if not os.path.exists('database'):
             os.mkdir('database')
-        self.db_master['latest'] = {}
-
-        # Set initial database entries of control element status
-        self.db_master["Pump Status"] = "OFF"
-        self.db_master["Fan Status"] = "OFF"
-        self.db_master["RGB LED Status"] = [0, 0, 0]
-        self.db_master["UV LED Status"] = "OFF"
-
-        # Set initial database entries for manual override conditions
-        self.db_master['Manual Overrides'] = {}
-        self.db_master['Manual Overrides']['Pump'] = False
-        self.db_master['Manual Overrides']['Fan'] = False
-        self.db_master['Manual Overrides']['RGB LED'] = False
-        self.db_master['Manual Overrides']['UV LED'] = False
-
-        # Initialize the storage for the algorithm processes and their corresponding queues
-        self.control_processes['watering'] = {}
-        self.control_processes['watering']['Process'] = None
-        self.control_processes['watering']['Queue'] = Queue()
-        self.control_processes['fan'] = {}
-        self.control_processes['fan']['Process'] = list()
-        self.control_processes['fan']['Queue'] = Queue()
+        self.wal = WriteAheadLog("./database/master", checkpoint_interval)
+        self.retention = RetentionPolicy(raw_window=raw_retention_hours * HOUR)
+        required_capacity = self.retention.raw_capacity(min(filter(None, (polling_interval, fast_polling_interval))))
+        if history_capacity is None:
+            history_capacity = required_capacity
+        elif history_capacity < required_capacity:
+            self.logger.warning("A history capacity of " + str(history_capacity) + " readings does not hold the raw retention window ("
+                                + str(required_capacity) + " readings). The oldest raw readings will be lost before being rolled up.")
+        self.history = TimeSeriesStore(history_capacity)
+        self.history_overwritten = 0
+        if use_sqlite:
+            self.sqlite = SQLiteStorage("./database/master.sqlite")
+        self.flusher = BackgroundFlusher(self.write_batch, flush_window, max_dirty_age)
+        self.delivery = DeliveryMonitor()
+        self.tick_budget = tick_budget
+        self.queue_depths = {}
+        self.main_to_gui_queue = main_to_gui_queue
+        self.gui_to_main_queue = Queue() if gui_to_main_queue is None else gui_to_main_queue
+        self.timers = TimerHeap()
+
+        # Pick up where the previous run left off (history, soak timing, moisture filter window)
+        # Control element statuses and manual overrides always start up OFF
+        self.restore()
 
         # Initialize control statuses
         # Status is either "Free" or "Busy"
@@ -108,25 +189,25 @@ class ThreadedClient:
         self.control_statuses['RGB LED'] = "Free"
 
         self.simulated = simulate_environment
+        self.use_sensor_hub = use_sensor_hub
+        self.use_shared_memory = use_shared_memory
+        self.use_bus_manager = use_bus_manager
         self.configuration_file = configuration_file
 
-        # Spawn the GUI
-        self.gui = GrowSpaceGUI(master, self.main_to_gui_queue, self.gui_to_main_queue, self.end_application)
-
         # Load the configuration file
         self.load_configuration()
 
         # Spawn all sensor processes
-        self.spawn_sensor_processes(polling_interval)
+        self.spawn_sensor_processes(polling_interval, soil_burst_size, fast_polling_interval, soil_channels, gas_interval)
 
         # Add control elements
         self.add_controllers()
 
-        # Start the periodic call (main loop)
-        self.periodic_call(gui_refresh_interval)
-
-        # Initialize list of previous 10 moisture sensor readings
-        self.water_list = [None] * 10
+        # The lighting and the fan are set to the schedule right away, and then again at the top of every hour
+        self.timers.schedule("lighting", 0, self.update_lighting)
+        self.timers.schedule("fan_schedule", 0, self.update_fan_schedule)
+        self.timers.schedule_at("hourly_housekeeping", next_hour(), self.hourly_housekeeping)
+        self.timers.schedule("clock_check", CLOCK_CHECK_INTERVAL, self.check_clock)
 
     def load_configuration(self):
         """!
@@ -134,25 +215,15 @@ class ThreadedClient:
         """
         # Load configuration file
         self.logger.debug("Loading configuration file: "+self.configuration_file)
-        configuration_dict = load_from_json("./configuration_files/"+self.configuration_file)
-
-        # Transfer configuration file data into master database
-        self.logger.debug("Transferring configuration data into the master database...")
-        for item, value in configuration_dict.items():
-            self.logger.debug("Transferring: "+str(item)+" : "+str(value))
-            self.db_master[item] = value
-        self.logger.debug("Transfer complete.")
-
-        # Set configuration parameters in GUI
-        self.logger.debug("Updating control parameters in GUI...")
-        self.gui.SoilMoistureRange_value.\
-            configure(text=str(self.db_master["Moisture_Low"])+"% - "+str(self.db_master["Moisture_High"])+"%")
-        self.gui.TemperatureRange_value.\
-            configure(text=str(self.db_master["Temperature_Low"])+"°C - "+str(self.db_master["Temperature_High"])+"°C")
-        self.gui.HumidityRange_value.\
-            configure(text=str(self.db_master["Humidity_Low"])+"% - "+str(self.db_master["Humidity_High"])+"%")
-        self.gui.VOCRange_value.\
-            configure(text=str(self.db_master["VOC_Low"])+"kΩ - "+str(self.db_master["VOC_High"])+"kΩ")
+        self.config = Configuration.load(self.configuration_file)
+        self.logger.debug("Loaded: "+str(self.config))
+
+        # Send the configuration parameters to the GUI, for display
+        self.logger.debug("Sending control parameters to GUI...")
+        self.notify_gui(["Configuration", {'moisture': [self.config.moisture_low, self.config.moisture_high],
+                                           'temperature': [self.config.temperature_low, self.config.temperature_high],
+                                           'humidity': [self.config.humidity_low, self.config.humidity_high],
+                                           'voc': [self.config.voc_low, self.config.voc_high]}])
 
         self.logger.debug("Configuration file loaded. System is now running on new environment parameters.")
     
@@ -181,274 +252,620 @@ class ThreadedClient:
         self.controls['UV LED'].turn_off()
         self.controls['RGB LED'].adjust_color(red_content=0, green_content=0, blue_content=0)
 
+        # The pump and the fan are handed over to the actuator service, which runs for as long as the system does
+        self.actuator = ActuatorService({name: self.controls[name] for name in ['pump', 'fan']})
+        self.actuator.start()
+        for name in self.actuator.controls:
+            self.controls[name] = self.actuator.client(name)
+
         # Send initial status to GUI
-        self.main_to_gui_queue.put(["Pump Status", self.db_master["Pump Status"]])
-        self.main_to_gui_queue.put(["Fan Status", self.db_master["Fan Status"]])
-        self.main_to_gui_queue.put(["UV LED Status", self.db_master["UV LED Status"]])
-        self.main_to_gui_queue.put(["RGB LED Status", self.db_master["RGB LED Status"]])
+        for status in STATUS_FIELDS:
+            self.notify_gui([status, self.state.status(status)])
 
-    def spawn_sensor_processes(self, polling_interval):
+    def spawn_sensor_processes(self, polling_interval, soil_burst_size=1, fast_polling_interval=0, soil_channels=(0,), gas_interval=0):
         """!
         This method is used to spawn all the sensor processes.
         Based on whether the system is to be simulated or not, it will chose which processes to use
         as the sensor processes.
+        In sensor hub mode, all sensors run in one process instead (see SensorHub). Either way, each sensor
+        reports through its own queue, or its own shared memory ring buffer if enabled.
+        All soil moisture probes are scanned by a single sensor, so adding a probe does not add a process.
+        If enabled, the sensors share the I2C bus through a bus manager process, which serializes their transactions.
+
+        @param polling_interval: The time between sensor measurements in seconds.
+        @param soil_burst_size: Number of conversions each soil moisture sensor takes (and aggregates) per poll.
+        @param fast_polling_interval: Polling interval (s) of sensors whose readings are changing quickly. 0 disables adaptive polling.
+        @param soil_channels: Converter channels that soil moisture probes are connected to.
+        @param gas_interval: Minimum time (s) between gas measurements of the environment sensor.
         """
         if self.simulated:
             self.logger.debug("Running simulation...")
             from src.simulations import sim_env_sensor, sim_soil_sensor
-            self.sensors['environment_sensor'] = sim_env_sensor.EnvironmentSensor(name="sim_environment_sensor", queue=Queue(), polling_interval=polling_interval)
-            self.sensors['soil_moisture_sensor_1'] = sim_soil_sensor.SoilMoistureSensor(name="sim_soil_moisture_sensor_1", queue=Queue(), polling_interval=polling_interval)
-            # self.sensors['soil_moisture_sensor_2'] = sim_soil_sensor.SoilMoistureSensor(name="sim_soil_moisture_sensor_2", queue=Queue(), polling_interval=polling_interval)
+            self.sensors['environment_sensor'] = sim_env_sensor.EnvironmentSensor(name="sim_environment_sensor", queue=Queue(), polling_interval=polling_interval, gas_interval=gas_interval)
+            self.sensors['soil_moisture_sensor_1'] = sim_soil_sensor.SoilMoistureSensor(name="sim_soil_moisture_sensor_1", queue=Queue(), polling_interval=polling_interval, burst_size=soil_burst_size, channels=soil_channels)
+            if self.use_bus_manager:
+                self.logger.debug("Simulated sensors do not use the I2C bus, so there is no bus manager.")
         else:
             self.logger.debug("Running system...")
             from src.sensors.soil_moisture_sensor import SoilMoistureSensor
             from src.sensors.env_sensor import EnvironmentSensor
-            self.sensors['soil_moisture_sensor_1'] = SoilMoistureSensor(name="soil_moisture_sensor_1", queue=Queue(), polling_interval=polling_interval, channel=0)
-            #self.sensors['soil_moisture_sensor_2'] = SoilMoistureSensor(name="soil_moisture_sensor_2", queue=Queue(), polling_interval=polling_interval, channel=2)
-            self.sensors['environment_sensor'] = EnvironmentSensor(name="environment_sensor", queue=Queue(), polling_interval=polling_interval)
+            soil_bus, environment_bus = None, None
+            if self.use_bus_manager:
+                # The drivers talk to their devices while being set up, so the bus manager has to be running first
+                # The soil moisture conversions are time critical (they happen while the probes are powered), so they go first
+                self.bus_manager = I2CBusManager()
+                soil_bus = self.bus_manager.device("soil_moisture_sensor_1", priority=0)
+                environment_bus = self.bus_manager.device("environment_sensor", priority=1)
+                self.bus_manager.start()
+            self.sensors['soil_moisture_sensor_1'] = SoilMoistureSensor(name="soil_moisture_sensor_1", queue=Queue(), polling_interval=polling_interval, burst_size=soil_burst_size, channels=soil_channels, i2c=soil_bus)
+            self.sensors['environment_sensor'] = EnvironmentSensor(name="environment_sensor", queue=Queue(), polling_interval=polling_interval, i2c=environment_bus, gas_interval=gas_interval)
+
+        # Poll slowly while the readings are stable, and speed up while they change quickly
+        if fast_polling_interval:
+            for sensor_name, sensor in self.sensors.items():
+                for kind, (field, threshold) in ADAPTIVE_POLLING.items():
+                    if kind in sensor_name:
+                        sensor.adaptive = AdaptivePolling(polling_interval, fast_polling_interval, threshold, field)
+
+        # Spread the polls of the sensors evenly over the polling interval, so their reads don't collide on the bus
+        for index, sensor in enumerate(self.sensors.values()):
+            sensor.phase_offset = index * polling_interval / len(self.sensors)
+
+        # Give each sensor its own ring buffer, with room for one value per field it reports
+        if self.use_shared_memory:
+            for sensor_id, sensor in enumerate(self.sensors.values()):
+                sensor.sensor_id = sensor_id
+                sensor.ring = SharedRingBuffer(capacity=1024, field_count=len(sensor.fields))
 
         # Add all processes to dict
-        for name, value in self.sensors.items():
-            self.sensor_processes[name] = Process(target=value.run)
-            self.sensor_processes[name].start()
+        if self.use_sensor_hub:
+            self.sensor_processes['sensor_hub'] = Process(target=SensorHub(list(self.sensors.values())).run)
+        else:
+            for name, value in self.sensors.items():
+                self.sensor_processes[name] = Process(target=value.run)
+        for process in self.sensor_processes.values():
+            process.start()
         # Flag start
         self.main_running = True
 
-    def periodic_call(self, gui_refresh_interval=200):
+    def run(self):
         """!
-        This is the "main loop" of the main thread.
-        In order to conserve processing power, this loop has a delay between iterations equal to the
-        gui_refresh_interval.
+        This is the "main loop" of the control engine. Runs until end_application is called, the GUI asks
+        for a shutdown, or the process is terminated.
+        In order to conserve processing power, the loop sleeps until a message arrives on one of the inbound queues
+        (readings, manual overrides, completions from the actuator service), until the next timed event is due
+        (see timers), or until end_application rings the doorbell, so it reacts to each right away, and does nothing
+        while nothing happens.
         The process is as follows:
         1. Check if the user has signalled for the application to shutdown. If so, shutdown everything.
-        2. Check if the user is trying to do any manual overrides using the "control" window of the GUI.
-        For each control element that is manually overriden, it will add a corresponding flag into the master database.
+        2. Run the timed events that are due (e.g, the lighting and fan schedules change at the top of every hour).
+        3. Handle the messages that have arrived (see handle_messages). For each control element that is manually
+        overriden, a corresponding flag is set in the live state.
         This flag is checked by the control algorithms, and if it is present, it will prevent the algorithms from
         controlling that control element.
         These flags are cleared and automaticity is regained when the user closes the "control" window. 
-        3. Check if there is new data coming in from a sensor. If there is, run an algorithm on the data to generate a
-        control message.
-        This control message is then passed to a control_process (if necessary and not blocked)
+        For new sensor data, an algorithm is run on the data to generate a control message.
+        This control message is then turned into a command for the actuator service (if necessary and not blocked)
+        """
 
-        @param gui_refresh_interval: How often (in miliseconds) the GUI will get check its inbound queue for new data
-        to display
+        signal.signal(signal.SIGTERM, exit_on_signal)
+        try:
+            while self.main_running:
+                ready = self.wait_for_messages(self.timers.next_delay())
+                self.timers.run_due()
+                if ready:
+                    self.handle_messages()
+        except KeyboardInterrupt:
+            self.logger.info("Interrupted.")
+        finally:
+            self.shutdown()
+
+    def wait_for_messages(self, timeout):
+        """!
+        Sleeps until one of the inbound queues has a message, or a timeout elapses, and returns the queues that are ready.
+        Sensors that relay their readings through shared memory wake it up with the doorbell of their ring buffer.
+        end_application wakes it up with the engine's own doorbell.
+        @param timeout: Longest time (s) to sleep for. None sleeps until something is ready.
         """
+        queues = [self.gui_to_main_queue, self.actuator.results]
+        connections = [self.doorbell] + [queue._reader for queue in queues]
+        connections += [sensor.queue._reader if sensor.ring is None else sensor.ring.doorbell
+                        for sensor in self.sensors.values()]
+        return wait(connections, timeout)
 
-        self.gui.process_incoming()
+    def update_lighting(self):
+        """!
+        Sets the RGB and UV LEDs to the schedule of the current hour, and does so again at the top of the next hour.
+        """
+        try:
+            lighting_process(self.config, self.state, self.controls)
+            for status in ["RGB LED Status", "UV LED Status"]:
+                self.update_status(status, self.state.status(status))
+        finally:
+            self.timers.schedule_at("lighting", next_hour(), self.update_lighting)
 
-        # Check if the user has signaled to shutdown the application
-        if not self.main_running:
-            self.gui.master.destroy()  # Close the GUI
-            for process in active_children():  # Terminate each process
-                process.terminate()
-                process.join()
-            # Save database
-            export_object("./database/master", self.db_master)
-            save_as_json("./database/master", self.db_master)
-            return 0
-
-        # Check if the GUI is sending anything to main (manual override commands)
-        if not self.gui_to_main_queue.empty():
-            msg = self.gui_to_main_queue.get()
-            self.manual_override(msg) # Execute the manual override command
+    def update_fan_schedule(self):
+        """!
+        Sets the fan to the schedule of the current hour, and does so again at the top of the next hour.
+        """
+        try:
+            fan_hourly_process(self.config, self.state, self.controls)
+            self.update_status("Fan Status", self.state.status("Fan Status"))
+        finally:
+            self.timers.schedule_at("fan_schedule", next_hour(), self.update_fan_schedule)
 
-        # Get the current time and send it to the lighting algorithm
-        self.current_time = datetime.now()
+    def hourly_housekeeping(self):
+        """!
+        Rolls up the aging history and logs the statistics, every hour.
+        """
         try:
-            time_response = time_keeper(self.current_time, self.previous_time)
-            if time_response:
-                lighting_process(self.db_master, self.controls)
-                fan_hourly_process(self.db_master, self.controls)
+            self.apply_retention()
+            self.report_delivery_statistics()
+            self.report_queue_statistics()
+            self.report_bus_statistics()
+        finally:
+            self.timers.schedule_at("hourly_housekeeping", next_hour(), self.hourly_housekeeping)
+
+    def check_clock(self):
+        """!
+        Wakes the main loop up every CLOCK_CHECK_INTERVAL. That is all it does: waking up is what gives the timed events
+        tied to the time of day the chance to notice that the wall clock was stepped past them (see TimerHeap.run_due).
+        """
+        self.timers.schedule("clock_check", CLOCK_CHECK_INTERVAL, self.check_clock)
 
-        except AttributeError:
-            self.logger.debug("Main loop is running its first iteration...")
-        self.previous_time = self.current_time
+    def start_soak(self, soak_end_time):
+        """!
+        Blocks the watering algorithm from running the pump until the previous watering has soaked into the soil.
+        @param soak_end_time: Time (datetime) at which the soak-in is over
+        """
+        self.save_state('soak_end_time', soak_end_time)
+        self.timers.schedule_at("soak", soak_end_time, self.end_soak)
 
-        # For each sensor, check if there is any data in its queue
+    def end_soak(self):
+        self.logger.info("Soak-in finished.")
+        self.save_state('soak_end_time', None)
+
+    def stop_pump(self):
+        """!
+        Stops the pump if its run has not reported back by its stop time (plus an allowance).
+        The actuator service times the run itself, so this only happens if the run got lost along the way.
+        """
+        self.logger.warning("Pump run did not report back by its stop time. Stopping the pump.")
+        self.controls['pump'].cancel()
+
+    def shutdown(self):
+        """!
+        Stops every worker process, frees the shared memory, and saves everything to disk.
+        """
+        self.main_running = False
+        self.report_delivery_statistics()
+        self.report_queue_statistics()
+        self.report_bus_statistics()
+        for process in active_children():  # Terminate each process
+            process.terminate()
+            process.join()
+        for sensor in self.sensors.values():  # Free the shared memory
+            if sensor.ring is not None:
+                sensor.ring.close()
+                sensor.ring.unlink()
+        # Save database
+        self.checkpoint()
+        self.flusher.close()
+        self.wal.close()
+        if self.sqlite is not None:
+            self.sqlite.close()
+        self.logger.debug("System shut down.")
+
+    def handle_messages(self):
+        """!
+        Handles every message waiting in the inbound queues: manual override commands from the GUI,
+        sensor readings, and completions from the actuator service.
+        This runs as soon as a message arrives (see wait_for_messages).
+        Each queue is drained of everything that has built up, within a time budget, so backlogs clear instead of
+        growing. All new readings of a sensor are stored, and then its algorithm runs once, on the newest data.
+        """
+
+        if not self.main_running:
+            return
+
+        # Everything that has built up since the last iteration is handled now, within the time budget
+        deadline = time.monotonic() + self.tick_budget
+        self.measure_queue_depths()
+
+        # Check if the GUI is sending anything to main (manual override commands, or a shutdown)
+        for msg in self.drain(self.gui_to_main_queue, deadline):
+            if msg == "SHUTDOWN":
+                self.end_application()
+                return
+            if msg == "PLOT":
+                self.send_plot_data()
+                continue
+            self.manual_override(msg) # Execute the manual override command
+
+        # For each sensor, check if there is any new data
         for sensor_name, sensor in self.sensors.items():
-            if not sensor.queue.empty():
-
-                # If there is data, get it, save it to the master database, then save the master database
-                sensor_data = sensor.queue.get()
-                current_time = datetime.now().strftime("%m-%d-%y %H:%M:%S")
-                if current_time not in self.db_master:
-                    self.db_master[current_time] = {}
-                self.db_master[current_time][sensor_name] = sensor_data
-                self.db_master['latest'][sensor_name] = sensor_data
-                export_object("./database/master", self.db_master)
-                save_as_json("./database/master", self.db_master)
-
-                if 'soil_moisture_sensor' in sensor_name:
-                    # First, run the watering algorithm to generate the control message.
-                    msg = watering_algorithm(self.db_master, self.water_list)
-                    self.water_list.append(float(msg[1]))
-                    self.water_list.pop(0)
-
-                    # Relay the message to the GUI so the values can be updated
-                    self.main_to_gui_queue.put(msg)
-
-                    # If the flag is not None, that means that the moisture level is outside of accepted range. So...
-                    flag = msg[2]
-                    if flag is not None:
-                        try:
-                            current_time = datetime.now()
-                            do_process = True
-
-                            # Check if the pump is currently being manually overridden
-                            if self.db_master['Manual Overrides']['Pump']:
-                                self.logger.debug("Soil Moisture flagged, but pump is in manual override")
-                                do_process = False
-
-                            # Check if the pump is already running from a previous algorithm check
-                            elif self.control_statuses['pump'] == "Busy":
-                                self.logger.debug("Soil Moisture flagged, but pump is already running")
-                                do_process = False
-
-                            # Check if the system is still waiting for the previous watering to soak into the soil
-                            if "soak_end_time" in self.db_master:
-                                if current_time <= self.db_master['soak_end_time']:
-                                    self.logger.info("Waiting for soak-in to finish. Time remaining: "
-                                                     + str(self.db_master['soak_end_time'] - current_time))
-                                    do_process = False
-
-                            # If there is no condition blocking the control_process from running, execute it 
-                            if do_process:
-                                if flag == "LOW":  # Water level is low, need to pump
-                                    self.db_master["Pump Status"] = "ON"  # Explicitly declare that the pump is now ON
-                                    self.controls['pump'].is_off = False
-                                    self.logger.info("Pump has turned on.")
-                                    self.main_to_gui_queue.put(["Pump Status", self.db_master["Pump Status"]])
-                                    self.control_statuses['pump'] = "Busy"
-                                    self.control_processes['watering']['Process'] = \
-                                        Process(target=watering_process,
-                                                args=(msg, self.controls, self.control_processes['watering']['Queue'],
-                                                      self.db_master))
-                                    self.control_processes['watering']['Process'].start()
-                                elif flag == "HIGH":  # NOTE: Are we going to do anything in these circumstances?
-                                    pass
-                                else:  # Water level is good, so no need to do anything
-                                    pass
-
-                        except Exception as err:
-                            self.logger.error("Exception thrown in main: "+str(err))
-
-                elif 'environment_sensor' in sensor_name:
-                    # First, run the environment algorithm to generate the control message.
-                    msg = environment_algorithm(self.db_master)
-
-                    # Relay the message to the GUI so the values can be updated
-                    self.main_to_gui_queue.put(msg)
-
-                    temperature_flag = msg[1]['temperature']['flag']
-                    if temperature_flag is not None:
-                        current_time = datetime.now()
+            received = False
+            for timestamp, sequence, duration, sensor_data in self.receive(sensor, deadline):
+
+                # Check that no readings went missing on the way, and skip readings that arrived twice
+                missed = self.delivery.observe(sensor_name, timestamp, sequence, duration)
+                if missed is None:
+                    self.logger.warning("Duplicate reading " + str(sequence) + " from " + sensor_name + " ignored.")
+                    continue
+                if missed:
+                    self.logger.warning(str(missed) + " reading(s) from " + sensor_name + " went missing before reading "
+                                        + str(sequence) + ".")
+
+                # If there is data, save it to the sensor history (stamped when it was acquired)
+                self.save_reading(sensor_name, timestamp, sensor_data)
+                received = True
+
+            # The algorithms only look at the newest readings, so they run once, however many readings came in
+            if not received:
+                continue
+
+            if 'soil_moisture_sensor' in sensor_name:
+                # First, run the watering algorithm to generate the control message.
+                msg = watering_algorithm(self.config, self.history, self.state.water_list)
+                self.state.water_list.append(float(msg[1]))
+                self.state.water_list.pop(0)
+                self.save_state('water_list', list(self.state.water_list))
+
+                # Relay the message to the GUI so the values can be updated
+                self.notify_gui(msg)
+
+                # If the flag is not None, that means that the moisture level is outside of accepted range. So...
+                flag = msg[2]
+                if flag is not None:
+                    try:
                         do_process = True
 
-                        # Check if the fan is currently being manually overridden
-                        if self.db_master['Manual Overrides']['Fan']:
-                            self.logger.info("Fan is in manual override")
+                        # Check if the pump is currently being manually overridden
+                        if self.state.pump_override:
+                            self.logger.debug("Soil Moisture flagged, but pump is in manual override")
                             do_process = False
 
-                        # Check if the fan is already running from a previous algorithm check
-                        elif self.control_statuses['fan'] == "Busy":
-                            self.logger.info("Fan is already running")
+                        # Check if the pump is already running from a previous algorithm check
+                        elif self.control_statuses['pump'] == "Busy":
+                            self.logger.debug("Soil Moisture flagged, but pump is already running")
                             do_process = False
-                        
-                        # If there is no condition blocking the control_process from running, execute it 
+
+                        # Check if the system is still waiting for the previous watering to soak into the soil
+                        if "soak" in self.timers:
+                            self.logger.info("Waiting for soak-in to finish. Time remaining: "
+                                             + str(timedelta(seconds=round(self.timers.remaining("soak")))))
+                            do_process = False
+
+                        # If there is no condition blocking the pump from running, run it
                         if do_process:
-                            self.control_statuses['fan'] = "Busy"  # Explicitly declare that the fan is now busy
-                            if temperature_flag == "HIGH":
-                                self.db_master["Fan Status"] = "ON"
-                            elif temperature_flag == "LOW":
-                                self.db_master["Fan Status"] = "OFF"
-                            else:
-                                self.logger.warning("Unexpected temperature flag: "+str(temperature_flag))
-                            self.main_to_gui_queue.put(["Fan Status", self.db_master["Fan Status"]])
-                            self.control_statuses['fan'] = "Busy"
-                            self.control_processes['fan']['Process'] = \
-                                Process(target=fan_process,
-                                        args=(msg, self.controls, self.control_processes['fan']['Queue']))
-                            self.control_processes['fan']['Process'].start()
-
-        for control_process_name, control_process in self.control_processes.items():
-            if not control_process['Queue'].empty():
-                msg = control_process['Queue'].get()
-                self.logger.debug("Message from "+str(control_process_name) + ": " + msg)
-                if control_process_name == "watering":
-                    self.db_master['last_watering'] = datetime.now()
-                    self.db_master['soak_end_time'] = \
-                        self.db_master['last_watering'] + timedelta(minutes=self.db_master['Soak_Minutes'])
-                    self.control_statuses['pump'] = "Free"
+                            if flag == "LOW":  # Water level is low, need to pump
+                                self.update_status("Pump Status", "ON")  # Explicitly declare that the pump is now ON
+                                self.controls['pump'].is_off = False
+                                self.logger.info("Pump has turned on.")
+                                self.control_statuses['pump'] = "Busy"
+                                duration = pump_time(msg[3], self.config.moisture_low)
+                                self.controls['pump'].run(duration)
+                                self.timers.schedule("pump_stop", duration + PUMP_STOP_ALLOWANCE, self.stop_pump)
+                            elif flag == "HIGH":  # NOTE: Are we going to do anything in these circumstances?
+                                pass
+                            else:  # Water level is good, so no need to do anything
+                                pass
+
+                    except Exception as err:
+                        self.logger.error("Exception thrown in main: "+str(err))
+
+            elif 'environment_sensor' in sensor_name:
+                # First, run the environment algorithm to generate the control message.
+                msg = environment_algorithm(self.config, self.history)
+
+                # Relay the message to the GUI so the values can be updated
+                self.notify_gui(msg)
+
+                temperature_flag = msg[1]['temperature']['flag']
+                if temperature_flag is not None:
+                    do_process = True
+
+                    # Check if the fan is currently being manually overridden
+                    if self.state.fan_override:
+                        self.logger.info("Fan is in manual override")
+                        do_process = False
+
+                    # Check if the fan is already running from a previous algorithm check
+                    elif self.control_statuses['fan'] == "Busy":
+                        self.logger.info("Fan is already running")
+                        do_process = False
+                    
+                    # If there is no condition blocking the fan from being switched, switch it 
+                    if do_process:
+                        self.control_statuses['fan'] = "Busy"  # Explicitly declare that the fan is now busy
+                        if temperature_flag == "HIGH":
+                            self.update_status("Fan Status", "ON")
+                        elif temperature_flag == "LOW":
+                            self.update_status("Fan Status", "OFF")
+                        else:
+                            self.logger.warning("Unexpected temperature flag: "+str(temperature_flag))
+                        self.control_statuses['fan'] = "Busy"
+                        if temperature_flag == "HIGH":
+                            self.controls['fan'].turn_on()
+                        elif temperature_flag == "LOW":
+                            self.controls['fan'].turn_off()
+                        else:
+                            self.control_statuses['fan'] = "Free"
+
+        # Check if the actuator service has finished carrying out any commands
+        for result in self.drain(self.actuator.results, deadline):
+            self.logger.debug("Message from actuator service: " + str(result))
+            if result.outcome not in (DONE, CANCELLED):
+                self.logger.error(result.element + " failed to " + result.action + ": " + result.detail)
+            if result.element == "pump" and result.action == RUN:
+                self.timers.cancel("pump_stop")
+                last_watering = datetime.now()
+                self.save_state('last_watering', last_watering)
+                self.start_soak(last_watering + timedelta(minutes=self.config.soak_minutes))
+                self.control_statuses['pump'] = "Free"
+                if result.outcome == DONE:
                     self.controls['pump'].is_off = True
-                    self.db_master["Pump Status"] = "OFF"
-                    self.logger.info("Pump has turned off.")
-                    self.main_to_gui_queue.put(["Pump Status", self.db_master["Pump Status"]])
-                if control_process_name == "fan":
-                    self.control_statuses['fan'] = "Free"
-                    if msg == "Fan turned ON":
-                        self.db_master["Fan Status"] = "ON"
-                    elif msg == "Fan turned OFF":
-                        self.db_master["Fan Status"] = "OFF"
-                    else:
-                        self.logger.warning("Unexpected msg from fan process" + str(msg))
-                    self.main_to_gui_queue.put(["Fan Status", self.db_master["Fan Status"]])
-                control_process['Process'].terminate()
-                control_process['Process'].join()
-    
-        # Wait for a refresh interval to elapse, then call itself to execute again
-        self.gui.master.after(gui_refresh_interval, self.periodic_call)
+                # A run cancelled by a manual override leaves the pump however the override set it
+                self.update_status("Pump Status", "OFF" if self.controls['pump'].is_off else "ON")
+                self.logger.info("Pump run ended after " + str(round(result.elapsed, 3)) + "s"
+                                 + (" (cancelled)." if result.outcome == CANCELLED else "."))
+            elif result.element == "fan" and self.control_statuses['fan'] == "Busy":
+                # Only the fan commands of the environment algorithm mark the fan as busy
+                self.control_statuses['fan'] = "Free"
+                self.update_status("Fan Status", "OFF" if self.controls['fan'].is_off else "ON")
+
+    def drain(self, queue, deadline):
+        """!
+        Generator that yields the messages waiting in a queue, until it is empty or the time budget of the
+        iteration runs out. At least one message is always taken, so no source is starved by the others.
+
+        @param queue: The queue to take messages from
+        @param deadline: Monotonic time (s) at which the time budget of the iteration runs out
+        """
+        taken = 0
+        while not taken or time.monotonic() < deadline:
+            try:
+                msg = queue.get_nowait()
+            except Empty:
+                return
+            taken += 1
+            yield msg
+
+    def receive(self, sensor, deadline):
+        """!
+        Returns the list of (timestamp, sequence, duration, data) readings that a sensor has relayed since the last call.
+        Readings in a shared memory ring buffer are all taken in one pass, read straight out of the shared memory.
+        Readings in a queue are taken until it is empty, or the time budget of the iteration runs out.
+
+        @param sensor: The Sensor to receive readings from
+        @param deadline: Monotonic time (s) at which the time budget of the iteration runs out
+        """
+        if sensor.ring is None:
+            return list(self.drain(sensor.queue, deadline))
+
+        readings = []
+        for records in sensor.ring.drain():
+            for timestamp, sequence, duration, values in zip(records['timestamp'].tolist(), records['sequence'].tolist(),
+                                                             records['duration'].tolist(), records['values'].tolist()):
+                readings.append((timestamp, sequence, duration, {field: value for field, value in zip(sensor.fields, values)
+                                                                 if not math.isnan(value)}))
+        return readings
+
+    def restore(self):
+        """!
+        Restores the state saved by the previous run: the latest snapshot of the live state and the
+        sensor history, plus every change logged after that snapshot was taken.
+        Only the watering timing and the moisture filter window are carried over. Statuses and manual overrides
+        start from scratch, since the control elements always start up OFF.
+        """
+        start = time.monotonic()
+        snapshot, records = self.wal.restore()
+        restored = LiveState()
+        if snapshot is not None:
+            restored = snapshot.get('state', restored)
+            capacity = self.history.capacity
+            self.history = snapshot['history']
+            self.history.reserve(capacity)
+            self.history_overwritten = self.history.overwritten()
+        for record in records:
+            if record[0] == "set" and record[1] in LiveState.__slots__:
+                setattr(restored, record[1], record[2])
+            elif record[0] == "reading":
+                self.history.append(record[1], record[2], record[3])
+        self.state = LiveState()
+        for field in ['last_watering', 'soak_end_time', 'water_list']:
+            setattr(self.state, field, getattr(restored, field))
+        if self.state.soak_end_time is not None:  # A soak-in that is already over ends right away
+            self.timers.schedule_at("soak", self.state.soak_end_time, self.end_soak)
+        self.changes_since_checkpoint = len(records)
+        self.apply_retention()
+        self.logger.info("Restored snapshot and " + str(len(records)) + " logged changes in "
+                         + str(round(time.monotonic() - start, 3)) + "s.")
+
+    def persist(self, record):
+        """!
+        Hands a change to the background flusher to be written to the write-ahead log.
+        Whenever enough changes have built up, a full snapshot (checkpoint) is taken.
+
+        @param record: Tuple describing the change, e.g. ("set", field, value)
+        """
+        self.flusher.submit(record)
+        self.changes_since_checkpoint += 1
+        if self.changes_since_checkpoint >= self.wal.checkpoint_interval:
+            self.checkpoint()
+
+    def save_state(self, field, value):
+        """!
+        Stores a value in the live state and persists the change.
+
+        @param field: Name of the live state field, e.g. 'pump_override'
+        @param value: The value to store
+        """
+        setattr(self.state, field, value)
+        self.persist(("set", field, value))
+
+    def save_reading(self, sensor_name, timestamp, sensor_data):
+        """!
+        Stores a sensor reading in the history and persists it.
+
+        @param sensor_name: Name of the sensor that took the reading
+        @param timestamp: Epoch timestamp of the reading, in nanoseconds
+        @param sensor_data: The reading, as reported by the sensor
+        """
+        self.history.append(sensor_name, timestamp, sensor_data)
+        self.persist(("reading", sensor_name, timestamp, sensor_data))
+
+    def apply_retention(self):
+        """!
+        Rolls up the sensor history that has aged out of the raw retention window, in memory and (if enabled) in SQLite.
+        """
+        overwritten = self.history.overwritten()
+        if overwritten > self.history_overwritten:
+            self.logger.warning(str(overwritten - self.history_overwritten) + " raw readings were overwritten before being rolled up ("
+                                + str(overwritten) + " in total). Raise the history capacity.")
+            self.history_overwritten = overwritten
+        raw_cutoff, minute_cutoff = self.retention.apply(self.history)
+        if self.sqlite is not None:
+            self.flusher.submit(("retention", raw_cutoff, minute_cutoff))
+
+    def measure_queue_depths(self):
+        """!
+        Updates the queue depth gauges: the number of messages waiting in each inbound queue (or ring buffer),
+        and the most that have ever been waiting at once.
+        Platforms that cannot tell the size of a queue (e.g, macOS) report it as None.
+        """
+        sources = {'gui': self.gui_to_main_queue}
+        sources['actuator'] = self.actuator.results
+        sources.update({name: (sensor.queue if sensor.ring is None else sensor.ring) for name, sensor in self.sensors.items()})
+        for name, source in sources.items():
+            try:
+                depth = len(source) if isinstance(source, SharedRingBuffer) else source.qsize()
+            except NotImplementedError:
+                depth = None
+            peak = self.queue_depths.get(name, (None, None))[1]
+            if depth is not None and (peak is None or depth > peak):
+                peak = depth
+            self.queue_depths[name] = (depth, peak)
+
+    def report_queue_statistics(self):
+        """!
+        Logs the queue depth gauges of the inbound queues.
+        """
+        self.logger.info("Queue depths (current/peak): " + ", ".join(name + " " + str(depth) + "/" + str(peak)
+                                                                    for name, (depth, peak) in self.queue_depths.items()))
+
+    def report_delivery_statistics(self):
+        """!
+        Logs how the readings of each sensor have reached main: missing and duplicate readings, the latency from
+        acquisition to being handled here, and how long the polls took.
+        """
+        for sensor_name, statistics in self.delivery.summary().items():
+            self.logger.info("Readings from " + sensor_name + ": " + str(statistics['received']) + " received, "
+                             + str(statistics['missed']) + " missing, " + str(statistics['duplicates']) + " duplicates, "
+                             + "latency " + str(round(1000 * statistics['latency_mean'], 2)) + "ms mean / "
+                             + str(round(1000 * statistics['latency_max'], 2)) + "ms max, poll duration "
+                             + str(round(1000 * statistics['duration_mean'], 2)) + "ms mean / "
+                             + str(round(1000 * statistics['duration_max'], 2)) + "ms max")
+
+    def report_bus_statistics(self):
+        """!
+        Logs how busy the I2C bus has been, along with the transaction latency and error counters of each device on it.
+        """
+        if self.bus_manager is None:
+            return
+        self.logger.info("I2C bus utilization: " + str(round(100 * self.bus_manager.utilization(), 3)) + "%")
+        for device, statistics in self.bus_manager.statistics().items():
+            self.logger.info("I2C device " + device + ": " + str(int(statistics['transactions'])) + " transactions, "
+                             + str(int(statistics['errors'])) + " errors, " + str(int(statistics['timeouts'])) + " timeouts, "
+                             + "latency " + str(round(1000 * statistics['latency_mean'], 2)) + "ms mean / "
+                             + str(round(1000 * statistics['latency_max'], 2)) + "ms max")
+
+    def update_status(self, status, value):
+        """!
+        Updates the status of a control element in the live state, records the change,
+        and relays the new status to the GUI.
+
+        @param status: Name of the status, e.g. "Pump Status"
+        @param value: The new status
+        """
+        self.save_state(STATUS_FIELDS[status], value)
+        if value == "ON" and status in ACTUATED_SENSORS:
+            # The readings affected by the control element are about to change, so have those sensors speed up
+            for sensor_name, sensor in self.sensors.items():
+                if ACTUATED_SENSORS[status] in sensor_name and sensor.adaptive is not None:
+                    sensor.adaptive.boost()
+        if self.sqlite is not None:
+            self.flusher.submit(("actuation", status, value, time.time_ns()))
+        self.notify_gui([status, value])
+
+    def checkpoint(self):
+        """!
+        Takes a full snapshot of the live state and the sensor history, which allows the write-ahead log
+        to start over. Only the copy is made here; the flusher does the (slow) serializing and writing.
+        """
+        snapshot = copy.deepcopy({'state': self.state, 'history': self.history})
+        self.flusher.submit(("checkpoint", snapshot))
+        self.changes_since_checkpoint = 0
+
+    def write_batch(self, records):
+        """!
+        Writes a batch of changes to disk. This runs on the flusher's background thread.
+        A human-readable copy of the live state is saved alongside every snapshot.
+
+        @param records: List of tuples describing the changes, in the order they were made
+        """
+        self.wal.write_batch([record for record in records if record[0] in ["set", "reading", "checkpoint"]])
+        snapshots = [record[1] for record in records if record[0] == "checkpoint"]
+        if snapshots:
+            save_as_json("./database/master", snapshots[-1]['state'].as_dict())
+        if self.sqlite is not None:
+            self.sqlite.write_batch(records)
 
     def manual_override(self, msg):
         """!
         Whenever the main thread receives a manual override command, the command is passed to this function.
-        This function decides what to do with the command, and updates database variables accordingly.
+        This function decides what to do with the command, and updates the live state accordingly.
 
         @param msg: The manual override command.
         """
         self.logger.info("Received manual override: "+str(msg))
+        if self.sqlite is not None:
+            self.flusher.submit(("override", msg, time.time_ns()))
         if msg == "END":
             self.logger.info("Control window has been closed. Manual override disengaged.")
-            self.db_master['Manual Overrides']['Pump'] = False
+            for field in OVERRIDE_FIELDS.values():
+                self.save_state(field, False)
             self.control_statuses['pump'] = "Free"
-            self.db_master['Manual Overrides']['Fan'] = False
-            self.db_master['Manual Overrides']['RGB LED'] = False
-            self.db_master['Manual Overrides']['UV LED'] = False
 
         elif msg == "Pump OFF":
-            self.db_master['Manual Overrides']['Pump'] = True
+            self.save_state('pump_override', True)
             self.controls['pump'].turn_off()
-            self.db_master["Pump Status"] = "OFF"
-            self.main_to_gui_queue.put(["Pump Status", self.db_master["Pump Status"]])
+            self.update_status("Pump Status", "OFF")
 
         elif msg == "Pump ON":
-            self.db_master['Manual Overrides']['Pump'] = True
+            self.save_state('pump_override', True)
             self.controls['pump'].turn_on()
-            self.db_master["Pump Status"] = "ON"
-            self.main_to_gui_queue.put(["Pump Status", self.db_master["Pump Status"]])
+            self.update_status("Pump Status", "ON")
 
         elif msg == "Fan OFF":
-            self.db_master['Manual Overrides']['Fan'] = True
+            self.save_state('fan_override', True)
             self.controls['fan'].turn_off()
-            self.db_master["Fan Status"] = "OFF"
-            self.main_to_gui_queue.put(["Fan Status", self.db_master["Fan Status"]])
+            self.update_status("Fan Status", "OFF")
 
         elif msg == "Fan ON":
-            self.db_master['Manual Overrides']['Fan'] = True
+            self.save_state('fan_override', True)
             self.controls['fan'].turn_on()
-            self.db_master["Fan Status"] = "ON"
-            self.main_to_gui_queue.put(["Fan Status", self.db_master["Fan Status"]])
+            self.update_status("Fan Status", "ON")
 
         elif msg == "UV OFF":
-            self.db_master['Manual Overrides']['UV LED'] = True
+            self.save_state('uv_led_override', True)
             self.controls['UV LED'].turn_off()
-            self.db_master["UV LED Status"] = "OFF"
-            self.main_to_gui_queue.put(["UV LED Status", self.db_master["UV LED Status"]])
+            self.update_status("UV LED Status", "OFF")
 
         elif msg == "UV ON":
-            self.db_master['Manual Overrides']['UV LED'] = True
+            self.save_state('uv_led_override', True)
             self.controls['UV LED'].turn_on()
-            self.db_master["UV LED Status"] = "ON"
-            self.main_to_gui_queue.put(["UV LED Status", self.db_master["UV LED Status"]])
+            self.update_status("UV LED Status", "ON")
 
         elif isinstance(msg, list):
             # It is considered a manual override to load a new configuration file. Hence the code appears here
@@ -456,7 +873,7 @@ class ThreadedClient:
                 self.configuration_file = msg[1]
                 self.load_configuration()
             else: 
-                self.db_master['Manual Overrides']['RGB LED'] = True
+                self.save_state('rgb_led_override', True)
 
                 # Check to ensure all colors are within the accepted range, else default to 0
                 try:
@@ -479,8 +896,8 @@ class ThreadedClient:
                 # Adjust the RGB lights accordingly
                 self.controls['RGB LED'].adjust_color(red_content=red, green_content=green, blue_content=blue)
 
-                # Update the status in the master database
-                self.db_master["RGB LED Status"] = [red, green, blue]
+                # Update the status in the live state
+                self.update_status("RGB LED Status", [red, green, blue])
 
                 # Just for fun!
                 if red == 69 or green == 69 or blue == 69 or (red == 6 and green == 9) or (green == 6 and blue ==9):
@@ -491,8 +908,6 @@ class ThreadedClient:
                         self.controls['RGB LED'].adjust_color(red_content=0, green_content=0, blue_content=0)
                         time.sleep(0.2)
 
-                self.main_to_gui_queue.put(["RGB LED Status", self.db_master["RGB LED Status"]])
-
                 if red == 4 and green == 2 and blue == 0:
                     r = 0
                     g = 150
@@ -504,12 +919,88 @@ class ThreadedClient:
                     time.sleep(5)
                     self.controls['RGB LED'].adjust_color(red_content=0, green_content=0, blue_content=0)
     
+    def send_plot_data(self):
+        """!
+        Sends the GUI the history of the fields it plots (soil moisture, temperature, VOC and humidity),
+        as (timestamps, values) arrays. Periods that have been rolled up are represented by the mean of each bucket.
+        """
+        soil_sensor = next((name for name in self.sensors if 'soil_moisture_sensor' in name), None)
+        environment_sensor = next((name for name in self.sensors if 'environment_sensor' in name), None)
+        series = {}
+        for key, sensor_name, field in [('moisture', soil_sensor, 'value'), ('temperature', environment_sensor, 'temperature'),
+                                        ('gas', environment_sensor, 'gas'), ('humidity', environment_sensor, 'humidity')]:
+            if field in self.history.series.get(sensor_name, {}):
+                series[key] = self.history.combined(sensor_name, field)
+        self.notify_gui(["Plot data", series])
+
+    def notify_gui(self, msg):
+        """!
+        Sends a message to the GUI, if one is attached. Headless, the message is dropped.
+        @param msg: The message, e.g. ["Pump Status", "ON"]
+        """
+        if self.main_to_gui_queue is not None:
+            self.main_to_gui_queue.put(msg)
+
     def end_application(self):
         """!
-        This method simply flags main_running as False.
-        The "main loop" a.k.a periodic_call will notice this and begin shutdown
+        This method simply flags main_running as False, and rings the doorbell.
+        The "main loop" a.k.a run wakes up, notices this and begins shutdown.
+        Anything still waiting to be persisted is flushed to disk right away.
         """
-        self.main_running = False
+        if self.main_running:
+            self.main_running = False
+            self._bell.send_bytes(b"\x01")
+        if self.flusher is not None:
+            self.flusher.flush()
+
+
+def run_engine(**settings):
+    """!
+    Runs a control engine until it is shut down. This is the target of the control engine process when the GUI is used.
+    @param settings: Keyword arguments of the ControlEngine
+    """
+    ControlEngine(**settings).run()
+
+
+def run_with_gui(settings, gui_refresh_interval=200):
+    """!
+    Runs the control engine in its own process, with the GUI attached to it as a client.
+    The GUI and the engine only talk through a pair of queues: the GUI displays what the engine sends it,
+    and sends manual override commands (and the shutdown) back. The GUI is closed once the engine has shut down.
+    @param settings: Keyword arguments of the ControlEngine
+    @param gui_refresh_interval: How often (in miliseconds) the GUI checks its inbound queue for new data to display
+    """
+    from tkinter import Tk
+    from src.GUI.GUI import GrowSpaceGUI
+
+    main_to_gui_queue = Queue()
+    gui_to_main_queue = Queue()
+    engine = Process(target=run_engine, name="control_engine",
+                     kwargs=dict(settings, main_to_gui_queue=main_to_gui_queue, gui_to_main_queue=gui_to_main_queue))
+    engine.start()
+
+    root = Tk()
+    root.geometry("1024x600")
+
+    def end_application():
+        gui_to_main_queue.put("SHUTDOWN")
+
+    gui = GrowSpaceGUI(root, main_to_gui_queue, gui_to_main_queue, end_application)
+
+    def refresh():
+        gui.process_incoming()
+        if engine.is_alive():
+            root.after(gui_refresh_interval, refresh)
+        else:
+            root.destroy()
+
+    refresh()
+    root.mainloop()
+
+    # The window may have been closed without the power button, so make sure the engine shuts down too
+    if engine.is_alive():
+        gui_to_main_queue.put("SHUTDOWN")
+    engine.join()
 
 
 def check_terminate_process(process):
@@ -525,13 +1016,27 @@ if __name__ == "__main__":
     parser.add_argument('-p', '--polling', type=int, default=300, help='Sensor polling interval (s)')
     parser.add_argument('-s', '--simulate', action='store_true', help='Boolean for simulating the environment')
     parser.add_argument('-c', '--config', type=str, default="radishes", help="Name of the environment configuration file")
+    parser.add_argument('-k', '--checkpoint', type=int, default=1000, help="Number of database changes between database snapshots")
+    parser.add_argument('-q', '--sqlite', action='store_true', help="Boolean for also storing the history in an SQLite database")
+    parser.add_argument('-w', '--window', type=float, default=5.0, help="Time (s) without new changes after which they are written to disk")
+    parser.add_argument('-a', '--age', type=float, default=30.0, help="Maximum time (s) a change can wait before it is written to disk")
+    parser.add_argument('-t', '--retention', type=int, default=48, help="Time (h) that raw sensor readings are kept for before being rolled up")
+    parser.add_argument('-b', '--hub', action='store_true', help="Boolean for running all sensors in a single sensor hub process")
+    parser.add_argument('-m', '--shm', action='store_true', help="Boolean for relaying sensor readings through shared memory instead of queues")
+    parser.add_argument('-f', '--fast', type=float, default=0, help="Polling interval (s) of sensors whose readings are changing quickly. 0 disables adaptive polling")
+    parser.add_argument('-n', '--burst', type=int, default=1, help="Number of conversions each soil moisture sensor takes (and aggregates) per poll")
+    parser.add_argument('-g', '--probes', type=str, default="0", help="Comma separated converter channels that soil moisture probes are connected to")
+    parser.add_argument('-i', '--i2c', action='store_true', help="Boolean for sharing the I2C bus between the sensors through a bus manager process")
+    parser.add_argument('-d', '--budget', type=float, default=0.1, help="Time (s) each iteration of the main loop may spend on handling queued messages")
+    parser.add_argument('-e', '--headless', action='store_true', help="Boolean for running the control engine without the GUI (no tkinter needed)")
+    parser.add_argument('-v', '--voc', type=float, default=0, help="Minimum time (s) between gas (VOC) measurements of the environment sensor. 0 measures gas on every poll")
     args = parser.parse_args()
+    soil_channels = [int(channel) for channel in args.probes.split(",")]
 
-    ROOT = Tk()
-    ROOT.geometry("1024x600")
+    SETTINGS = dict(configuration_file=args.config, polling_interval=args.polling, simulate_environment=args.simulate, checkpoint_interval=args.checkpoint, use_sqlite=args.sqlite, flush_window=args.window, max_dirty_age=args.age, raw_retention_hours=args.retention, use_sensor_hub=args.hub, use_shared_memory=args.shm, soil_burst_size=args.burst, fast_polling_interval=args.fast, soil_channels=soil_channels, use_bus_manager=args.i2c, gas_interval=args.voc, tick_budget=args.budget)
 
-    if args.simulate:
-        CLIENT = ThreadedClient(ROOT, configuration_file= args.config, gui_refresh_interval=args.refresh, polling_interval=args.polling, simulate_environment=True)
+    if args.headless:
+        ENGINE = ControlEngine(**SETTINGS)
+        ENGINE.run()
     else:
-        CLIENT = ThreadedClient(ROOT, configuration_file= args.config, gui_refresh_interval=args.refresh, polling_interval=args.polling, simulate_environment=False)
-    ROOT.mainloop()
+        run_with_gui(SETTINGS, gui_refresh_interval=args.refresh)
@@ -19,8 +19,8 @@ import src.utilities.plot_utilities as plot_utilities
 class GrowSpaceGUI:
     """!
     GUI class for any grow space box.
-    @param queue_in: Uni-directional queue going FROM the main process TO this process
-    @param queue_out: Uni-directional queue going FROM this process TO the main process
+    @param queue_in: Uni-directional queue going FROM the control engine TO this process
+    @param queue_out: Uni-directional queue going FROM this process TO the control engine
     @param master: The root (instance) of a Tkinter top-level widget
     """
 
@@ -199,8 +199,8 @@ class GrowSpaceGUI:
                 self.db_GUI[item] = value
 
     def plot_command(self):
-        # NOTE: Could add additional features here
-        plot_utilities.generate_plots()
+        # The history lives in the control engine, so ask it for the data. The plots are made once it arrives.
+        self.queue_out.put("PLOT")
 
 
     def save_file(self):
@@ -1267,6 +1267,19 @@ class GrowSpaceGUI:
                         self.VOCCondition_value.config(fg="Green")
                         self.VOCStatus_value.configure(text="OK")
 
+                elif msg[0] == "Configuration":
+                    # The control parameters of the configuration the system is running on
+                    self.SoilMoistureRange_value.configure(text=str(msg[1]['moisture'][0])+"% - "+str(msg[1]['moisture'][1])+"%")
+                    self.TemperatureRange_value.configure(text=str(msg[1]['temperature'][0])+"°C - "+str(msg[1]['temperature'][1])+"°C")
+                    self.HumidityRange_value.configure(text=str(msg[1]['humidity'][0])+"% - "+str(msg[1]['humidity'][1])+"%")
+                    self.VOCRange_value.configure(text=str(msg[1]['voc'][0])+"kΩ - "+str(msg[1]['voc'][1])+"kΩ")
+
+                elif msg[0] == "Plot data":
+                    if all(len(msg[1].get(key, ((), ()))[0]) for key in ['moisture', 'temperature', 'gas', 'humidity']):
+                        plot_utilities.generate_plots_from_series(msg[1])
+                    else:
+                        self.logger.warning("Not enough sensor history to plot yet")
+
                 elif msg[0] == "Pump Status":
                     self.PumpStatus_value.configure(text=msg[1])
                 elif msg[0] == "Fan Status":
@@ -3,13 +3,18 @@ This code is for the intialization and communicaiton of a BME680 Multifunction E
 """
 
 import time
-import board
-from datetime import datetime
-from busio import I2C
 import adafruit_bme680
 from src.utilities.sensor_template import Sensor
 
 
+# Hot plate temperature (Celcius) and heating time (ms) of the gas measurement (the driver's defaults)
+GAS_HEATER = (320, 150)
+
+# Maximum number of measurements the driver takes per second. Within 1/REFRESH_RATE s of a measurement, reading the
+# properties of the driver does not take a new one, so polls must be at least that far apart.
+REFRESH_RATE = 10
+
+
 class EnvironmentSensor(Sensor):
     """!
     The environment sensor measures:
@@ -18,24 +23,38 @@ class EnvironmentSensor(Sensor):
     3. Humidity
     4. Pressure
     5. Altitude
+    All five are derived from a single forced measurement per poll. The gas measurement (which heats the sensor's
+    hot plate, and takes most of the measurement time) can run on a slower cadence than the rest.
     @param i2c_interface: The sensor communicates to the RPi via I2C. This is the interface.
+    It is either the board's I2C bus, or the sensor's handle on the I2C bus manager (see I2CBusManager).
     @param sensor_board: This is the "board" object of the sensor board.
     @param data_dict: This is the dictionary containing all the sensor readings.
+    @param gas_interval: Minimum time (s) between gas measurements. Polls in between leave out the gas reading.
+    0 measures gas on every poll.
     """
 
     i2c_interface = None
     sensor_board = None
     data_dict: dict = {}
+    fields: list = ['temperature', 'gas', 'humidity', 'pressure', 'altitude']
+    gas_interval: float = 0
 
-    def __init__(self, name="default", queue=None, polling_interval=2, sea_level_pressure=1013.25):
+    def __init__(self, name="default", queue=None, polling_interval=2, sea_level_pressure=1013.25, i2c=None, gas_interval=0):
         super().__init__(name, queue, polling_interval)
 
-        # Create I2C interface library object
-        self.i2c = I2C(board.SCL, board.SDA)
+        # Create I2C interface library object, unless the bus is shared through the I2C bus manager
+        if i2c is None:
+            import board
+            from busio import I2C
+            i2c = I2C(board.SCL, board.SDA)
+        self.i2c = i2c
         # Create our sensor board object
-        self.sensor_board = adafruit_bme680.Adafruit_BME680_I2C(self.i2c, debug=False)
+        self.sensor_board = adafruit_bme680.Adafruit_BME680_I2C(self.i2c, debug=False, refresh_rate=REFRESH_RATE)
         # change this to match the location's pressure (hPa) at sea level
         self.sensor_board.sea_level_pressure = sea_level_pressure
+        self.gas_interval = gas_interval
+        self._gas_enabled = True
+        self._last_gas = None
 
     def poll(self):
         """!
@@ -43,26 +62,41 @@ class EnvironmentSensor(Sensor):
         it back to the main thread.
         """
 
-        # Step 1: Take the readings
+        # Step 1: Take a single measurement (with gas, if it is due), and derive all the readings from it
+        now = time.monotonic()
+        measure_gas = self._last_gas is None or now - self._last_gas >= self.gas_interval
+        self.data_dict = {}
         try:
-            self.data_dict['temperature'] = self.sensor_board.temperature   # [Celcius]
-            self.data_dict['gas'] = self.sensor_board.gas                   # [Ohm]
+            self.data_dict['temperature'] = self.measure(measure_gas)       # [Celcius]
+            if measure_gas:
+                self.data_dict['gas'] = self.sensor_board.gas               # [Ohm]
+                self._last_gas = now
             self.data_dict['humidity'] = self.sensor_board.humidity         # [%]
             self.data_dict['pressure'] = self.sensor_board.pressure         # [hPa]
             self.data_dict['altitude'] = self.sensor_board.altitude         # [m]
         except Exception as err:
             print(err)
+        timestamp = self.timestamp()
 
         # Step 2: Relay the readings
-        self.queue.put(self.data_dict)
+        self.report(timestamp, self.data_dict)
 
         # Step 3: Log the reading
-        current_time = datetime.now()
-        with open(self.log_file_name,"a+") as f:
-            f.write(str(current_time)+": ")
-            for entry, value in self.data_dict.items():
-                f.write(entry + ": " + str(value) + ", ")
-            f.write("\n")
+        self.log(timestamp, self.data_dict)
+
+    def measure(self, gas=True):
+        """!
+        Take one forced mode measurement, and return its temperature (Celcius).
+        Reading the temperature is what has the driver take the measurement. The other properties of the driver,
+        read right after, come from the same measurement (see REFRESH_RATE).
+        @param gas: Flag for if the measurement includes gas. Without it, the gas heater stays off.
+        """
+
+        if gas != self._gas_enabled:
+            if not self.sensor_board.set_gas_heater(*(GAS_HEATER if gas else (None, None))):
+                raise OSError("Could not " + ("enable" if gas else "disable") + " the gas measurement")
+            self._gas_enabled = gas
+        return self.sensor_board.temperature
 
     def shutdown(self):
         """!
@@ -71,6 +105,56 @@ class EnvironmentSensor(Sensor):
         """
         print(self.name, "shutting down.")
 
+def unit_test_gas_cadence():
+    """
+    Checks that the gas heater only runs in the measurements that are meant to include gas,
+    by recording the gas control register of a simulated BME680 each time a forced measurement is triggered.
+    """
+    class FakeBME680:
+        def __init__(self):
+            self.registers = bytearray(256)
+            self.registers[0xD0] = 0x61  # Chip ID
+            self.registers[0x89:0x89 + 25] = bytes([1] * 25)  # Calibration coefficients
+            self.registers[0xE1:0xE1 + 16] = bytes([1] * 16)
+            self.registers[0x1D] = 0x80  # New data is always ready
+            self.pointer = 0
+            self.gas_control = []  # Gas control register (0x71) at each triggered measurement
+
+        def try_lock(self):
+            return True
+
+        def unlock(self):
+            pass
+
+        def writeto(self, address, buffer, *, start=0, end=None):
+            data = bytes(buffer[start:end])
+            if len(data) == 1:
+                self.pointer = data[0]
+            for register, value in zip(data[0::2], data[1::2]):
+                if register == 0x74 and value & 0x03 == 0x01:  # Forced mode: a measurement starts
+                    self.gas_control.append(self.registers[0x71])
+                    value &= 0xFC  # and the sensor is back asleep once it is done
+                self.registers[register] = value
+
+        def readfrom_into(self, address, buffer, *, start=0, end=None):
+            end = len(buffer) if end is None else end
+            buffer[start:end] = self.registers[self.pointer:self.pointer + end - start]
+
+    bus = FakeBME680()
+    sensor = EnvironmentSensor("environment_sensor", i2c=bus, gas_interval=60)
+    sensor.report = sensor.log = lambda timestamp, data: None
+    sensor.poll()
+    assert 'gas' in sensor.data_dict
+    time.sleep(1 / REFRESH_RATE)
+    sensor.poll()
+    assert 'gas' not in sensor.data_dict
+    sensor._last_gas -= 60  # The gas measurement is due again
+    time.sleep(1 / REFRESH_RATE)
+    sensor.poll()
+    assert 'gas' in sensor.data_dict
+    assert [bool(control & 0x30) for control in bus.gas_control] == [True, False, True]  # run_gas bits
+
+
 def unit_test():
     """
     Code from:
@@ -78,6 +162,8 @@ def unit_test():
 
     remember to install both the adafruit_blinka and adafruit-circuitpython-bme680 libraries
     """
+    import board
+    from busio import I2C
     i2c = I2C(board.SCL, board.SDA)
     bme680 = adafruit_bme680.Adafruit_BME680_I2C(i2c, debug=False)
     bme680.sea_level_pressure = 1013.25
@@ -92,4 +178,5 @@ def unit_test():
 
 
 if __name__ == "__main__":
+    unit_test_gas_cadence()
     unit_test()
\ No newline at end of file
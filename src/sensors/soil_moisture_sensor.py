@@ -8,25 +8,66 @@ from busio import I2C
 import adafruit_ads1x15.ads1115 as ADS
 from adafruit_ads1x15.analog_in import AnalogIn 
 from src.utilities.sensor_template import Sensor
-from datetime import datetime
+from src.utilities.sampling_utilities import aggregate_samples, combine_probes, probe_fields
+from src.utilities.json_utilities import load_from_json
 import RPi.GPIO as GPIO
 
 
+# Full scale range (V) of the ADS1115 for each gain of its amplifier. A conversion is a signed 16 bit code over that range.
+PGA_RANGE = {2/3: 6.144, 1: 4.096, 2: 2.048, 4: 1.024, 8: 0.512, 16: 0.256}
+
+
+def load_calibration(name="soil_calibration"):
+    """!
+    Loads the calibration table of the soil moisture probes.
+    Returns a dictionary mapping channel -> (max_v, min_v), where max_v is the voltage a probe reads in
+    completely dry soil (0%), and min_v the voltage it reads in water (100%).
+    @param name: Name of the calibration file, e.g. "soil_calibration"
+    """
+    table = load_from_json("./configuration_files/" + name)
+    return {int(channel): (probe['max_v'], probe['min_v']) for channel, probe in table.items()}
+
+
 class SoilMoistureSensor(Sensor):
+    """!
+    Soil moisture probes read through an ADS1115 converter.
+    One sensor owns the converter, and scans all of its probes (channels P0-P3) in a single cycle,
+    within a single window of the probes' power pin.
+    Each poll can take a burst of conversions per probe, which are reduced to a single robust reading in this process.
+    Each sample is a single conversion: its voltage is derived from the raw code and the gain of the converter,
+    and then normalized with the probe's calibration (see load_calibration).
+    The reading is reported as the moisture percentage ("value") and the spread of the burst ("spread", in %).
+    With several probes, "value" and "spread" are the mean and standard deviation across the probes, and each
+    probe's own reading is reported as "value_<channel>" and "spread_<channel>", all in one record.
+    @param channels: List of the converter channels (0-3) that probes are connected to.
+    @param i2c: The sensor's handle on the I2C bus manager (see I2CBusManager). None opens the board's I2C bus.
+    @param calibration: Dictionary mapping channel -> (max_v, min_v) of the probe connected to it.
+    @param burst_size: Number of conversions taken per probe per poll.
+    @param aggregation: How a burst is reduced to one reading: "median" or "trimmed_mean".
+    """
 
     i2c_interface = None
     ads = None
     sensor_board = None
-    channel = None 
-
-    def __init__(self, name="default", queue=None, polling_interval=2, channel=None, max_v=3.0, min_v=0.8):
+    channels: list = None
+    burst_size: int = 1
+    aggregation: str = "median"
+    fields: list = ['value', 'spread']
+    log_fields: list = ['value', 'spread', 'voltage']
+    calibration: dict = None
+
+    def __init__(self, name="default", queue=None, polling_interval=2, channel=None, burst_size=1,
+                 aggregation="median", data_rate=860, channels=None, i2c=None, calibration_file="soil_calibration"):
         super().__init__(name, queue, polling_interval)
 
-        self.i2c_interface = I2C(board.SCL, board.SDA)
+        self.i2c_interface = I2C(board.SCL, board.SDA) if i2c is None else i2c
         self.ads = ADS.ADS1115(self.i2c_interface)
-        self.max_volt = max_v
-        self.min_volt = min_v
-        self.voltage_list = []
+        self.volts_per_code = PGA_RANGE[self.ads.gain] / 32767
+        self.burst_size = burst_size
+        self.aggregation = aggregation
+        if burst_size > 1:
+            # Convert as fast as the ADS1115 allows (samples/s), so a burst takes barely longer than a single conversion
+            self.ads.data_rate = data_rate
 
         self.pin = 26
         GPIO.setmode(GPIO.BCM)
@@ -34,14 +75,17 @@ class SoilMoistureSensor(Sensor):
         self.is_off = True 
         GPIO.output(self.pin, self.is_off)
 
-        if channel == 0:
-            self.channel = AnalogIn(self.ads, ADS.P0)
-        elif channel == 1:
-            self.channel = AnalogIn(self.ads, ADS.P1)
-        elif channel == 2:
-            self.channel = AnalogIn(self.ads, ADS.P2)
-        elif channel == 3:
-            self.channel = AnalogIn(self.ads, ADS.P3)
+        self.channels = [channel] if channels is None else list(channels)
+        pins = [ADS.P0, ADS.P1, ADS.P2, ADS.P3]
+        self.analog_inputs = {number: AnalogIn(self.ads, pins[number]) for number in self.channels}
+        calibration = load_calibration(calibration_file)
+        missing = [number for number in self.channels if number not in calibration]
+        if missing:
+            raise KeyError("No calibration for the soil moisture probes on channels " + str(missing))
+        self.calibration = {number: calibration[number] for number in self.channels}
+        if len(self.channels) > 1:
+            self.fields = probe_fields(self.channels)
+            self.log_fields = self.fields + ['voltage_' + str(number) for number in self.channels]
 
     def poll(self):
         """!
@@ -49,28 +93,40 @@ class SoilMoistureSensor(Sensor):
         it back to the main thread.
         """
 
-        # Step 1: Take a reading and normalize voltage value
+        # Step 1: Power the probes up once, and take a burst of conversions from each of them
         self._previous_val = self._current_val
         self.turn_off() # Inverted logic???
         time.sleep(0.2)
-        self._current_val = [self.channel.value, self.channel.voltage, 0]
-        print("==================================", self._current_val)
+        bursts = {number: [self.analog_inputs[number].value for _ in range(self.burst_size)] for number in self.channels}
+        timestamp = self.timestamp()
         time.sleep(0.1)
         self.turn_on()
 
-        # Step 2: Relay the reading
-        self._current_val[2] = (-100/(self.max_volt-self.min_volt))*(self._current_val[1]-self.max_volt)
-        if self._current_val[2] > 99.7:
-            self._current_val[2] = 100.00
-        elif self._current_val[2] < 0.3:
-            self._current_val[2] = 0.00
-            
-        self.queue.put(round(self._current_val[2], 2))
-
-        # Step 3: Log the reading
-        current_time = datetime.now()
-        with open(self.log_file_name, "a+") as f:
-            f.write(str(current_time)+": "+str(self._current_val)+"\n")
+        # Step 2: Reduce each burst to a single voltage, normalize it, and relay the readings as one record
+        readings = {}
+        voltages = {}
+        for number, burst in bursts.items():
+            code, code_spread = aggregate_samples(burst, self.aggregation)
+            voltage, voltage_spread = code*self.volts_per_code, code_spread*self.volts_per_code
+            max_volt, min_volt = self.calibration[number]
+            scale = -100/(max_volt-min_volt)
+            value = scale*(voltage-max_volt)
+            if value > 99.7:
+                value = 100.00
+            elif value < 0.3:
+                value = 0.00
+            readings[number] = (round(value, 2), round(abs(scale)*voltage_spread, 3))
+            voltages[number] = voltage
+        data = combine_probes(readings)
+        self._current_val = data['value']
+        self.report(timestamp, data)
+
+        # Step 3: Log the readings, along with the voltages they were derived from
+        if len(self.channels) == 1:
+            data = dict(data, voltage=voltages[self.channels[0]])
+        else:
+            data = dict(data, **{'voltage_' + str(number): voltage for number, voltage in voltages.items()})
+        self.log(timestamp, data)
 
     def toggle(self):
         if self.is_off:
@@ -111,7 +167,8 @@ def unit_test():
     print("{:>5}\t{:>5}".format('raw', 'v'))
 
     while True:
-        print("{:>5}\t{:>5.3f}".format(chan.value, chan.voltage))
+        code = chan.value
+        print("{:>5}\t{:>5.3f}".format(code, code * PGA_RANGE[ads.gain] / 32767))
         time.sleep(0.5)
 
 
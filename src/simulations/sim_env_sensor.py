@@ -3,7 +3,7 @@ This code is for the simulation of a BME680 Multifunction Environment Sensor.
 """
 
 import random
-from datetime import datetime
+import time
 from src.utilities.sensor_template import Sensor
 
 class EnvironmentSensor(Sensor):
@@ -12,12 +12,17 @@ class EnvironmentSensor(Sensor):
     Since this is for a simulated sensor, there is no I2C interface,
     nor board object.
     @param data_dict: Dictionary that stores the simualted sensor readings.
+    @param gas_interval: Minimum time (s) between gas readings, like the real sensor. 0 reads gas on every poll.
     """
 
     data_dict: dict = {}
+    fields: list = ['temperature', 'gas', 'humidity', 'pressure', 'altitude']
+    gas_interval: float = 0
 
-    def __init__(self, name="default", queue=None, polling_interval=2):
+    def __init__(self, name="default", queue=None, polling_interval=2, gas_interval=0):
         super().__init__(name, queue, polling_interval)
+        self.gas_interval = gas_interval
+        self._last_gas = None
 
     def poll(self):
         """!
@@ -26,22 +31,22 @@ class EnvironmentSensor(Sensor):
         """
 
         # Step 1: Generate pseudorandom readings (within a range)
+        now = time.monotonic()
+        self.data_dict = {}
         self.data_dict['temperature'] = random.randrange(10, 40)    # [Celcius]
-        self.data_dict['gas'] = random.randrange(100000, 900000)    # [Ohm]
+        if self._last_gas is None or now - self._last_gas >= self.gas_interval:
+            self.data_dict['gas'] = random.randrange(100000, 900000)    # [Ohm]
+            self._last_gas = now
         self.data_dict['humidity'] = random.randrange(0, 100)       # [%]
         self.data_dict['pressure'] = random.randrange(500, 1500)    # [hPa]
         self.data_dict['altitude'] = random.randrange(0, 2000)      # [m]
-       
+        timestamp = self.timestamp()
+
         # Step 2: Relay the readings
-        self.queue.put(self.data_dict)
+        self.report(timestamp, self.data_dict)
 
         # Step 3: Log the reading
-        current_time = datetime.now()
-        with open(self.log_file_name,"a+") as f:
-            f.write(str(current_time)+": ")
-            for entry, value in self.data_dict.items():
-                f.write(entry + ": " + str(value) + ", ")
-            f.write("\n")
+        self.log(timestamp, self.data_dict)
 
     def shutdown(self):
         """!
@@ -5,16 +5,31 @@ Code for simulating a Soil Moisture Sensor.
 import random
 import time
 from src.utilities.sensor_template import Sensor
-from datetime import datetime
+from src.utilities.sampling_utilities import aggregate_samples, combine_probes, probe_fields
 
 class SoilMoistureSensor(Sensor):
     """!
-    Contains the code for the simulation of a soil moisture sensor
+    Contains the code for the simulation of a soil moisture sensor.
+    Like the real sensor, each poll can take a (noisy) burst of samples that is reduced to a single reading,
+    and several probes (each reading slightly differently) can be scanned in one cycle.
+    @param channels: List of the converter channels that (simulated) probes are connected to.
+    @param burst_size: Number of samples taken per probe per poll.
+    @param aggregation: How a burst is reduced to one reading: "median" or "trimmed_mean".
     """
 
-    def __init__(self, name="default", queue=None, polling_interval=2):
+    channels: list = None
+    burst_size: int = 1
+    aggregation: str = "median"
+    fields: list = ['value', 'spread']
+
+    def __init__(self, name="default", queue=None, polling_interval=2, burst_size=1, aggregation="median", channels=None):
         super().__init__(name, queue, polling_interval)
         self._previous_val = random.randint(40, 90)
+        self.burst_size = burst_size
+        self.aggregation = aggregation
+        self.channels = [0] if channels is None else list(channels)
+        self._offsets = {number: (random.uniform(-5, 5) if len(self.channels) > 1 else 0) for number in self.channels}
+        self.fields = probe_fields(self.channels)
 
         self.is_off = True
     
@@ -53,15 +68,21 @@ class SoilMoistureSensor(Sensor):
                 self._current_val = 0
             self._previous_val = self._current_val
 
+        bursts = {number: [self._current_val + offset + random.gauss(0, 1) for _ in range(self.burst_size)]
+                  for number, offset in self._offsets.items()}
+        timestamp = self.timestamp()
         self.turn_off()
 
-        # Step 2: Relay the reading
-        self.queue.put(self._current_val)
+        # Step 2: Relay the readings as one record
+        readings = {}
+        for number, samples in bursts.items():
+            value, spread = aggregate_samples(samples, self.aggregation)
+            readings[number] = (round(min(max(value, 0), 100), 2), round(spread, 3))
+        data = combine_probes(readings)
+        self.report(timestamp, data)
         
         # Step 3: Log the reading
-        current_time = datetime.now()
-        with open(self.log_file_name,"a+") as f:
-            f.write(str(current_time)+": "+str(self._current_val)+"\n")
+        self.log(timestamp, data)
 
     def toggle(self):
         if self.is_off:
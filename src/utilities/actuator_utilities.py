@@ -0,0 +1,314 @@
+"""!
+Contains the actuator service, which owns the pump and the fan, and carries out every command sent to them.
+
+Without it, main starts a new process every time the watering or environment algorithm fires, and
+pickles the control elements into it, just to flip a relay (or run the pump) and exit. With it, one
+long-lived actuator process owns those control elements, and main hands out an ActuatorClient in place
+of each of them. An ActuatorClient has the same interface as the relay it stands for (turn_on, turn_off),
+plus run and cancel, so main and the control processes use it unchanged, but every command is sent to the
+actuator process through one command queue, and its completion comes back through one result queue.
+
+Commands (see ActuatorCommand):
+- ON / OFF: Turn the control element on or off. This cancels a run of the element that is in progress.
+- RUN: Turn the control element on for a number of seconds, then off again.
+- CANCEL: Stop a run of the control element that is in progress, and turn it off.
+
+Each run is a TimedRun: its own thread turns the control element on, and sleeps on an event until either the
+duration (millisecond resolution) has elapsed, or the run is cancelled. Cancelling sets the event, so the control
+element turns off right away, rather than at the next check. While one control element runs, commands for the
+others are carried out as soon as they arrive. Commands only travel on the command queue, and completions only on
+the result queue, so the two directions never race each other.
+"""
+
+
+import signal
+import threading
+import time
+from typing import NamedTuple
+from multiprocessing import Queue, Process
+from src.utilities.logger_utilities import get_logger
+from src.utilities.sensor_template import exit_on_signal
+
+
+# Actions of the commands
+ON, OFF, RUN, CANCEL = "ON", "OFF", "RUN", "CANCEL"
+
+# Outcomes of the commands
+DONE, CANCELLED, FAILED = "DONE", "CANCELLED", "FAILED"
+
+
+class ActuatorCommand(NamedTuple):
+    """!
+    A command sent to the actuator service.
+    @param action: ON, OFF, RUN or CANCEL
+    @param element: Name of the control element, e.g. "pump"
+    @param duration: Time (s) the control element runs for (RUN only)
+    """
+
+    action: str
+    element: str
+    duration: float = 0
+
+
+class ActuatorResult(NamedTuple):
+    """!
+    The completion of a command, sent back by the actuator service.
+    @param action: Action of the command
+    @param element: Name of the control element
+    @param outcome: DONE, CANCELLED or FAILED
+    @param elapsed: Time (s) the control element ran for (RUN only)
+    @param detail: What went wrong (FAILED only)
+    """
+
+    action: str
+    element: str
+    outcome: str
+    elapsed: float = 0
+    detail: str = ""
+
+
+class ActuatorClient:
+    """!
+    Stand-in for the relay of one control element, used by main. Sends each command to the actuator service.
+    @param name: Name of the control element.
+    @param is_off: The state the control element was last commanded to.
+    """
+
+    name: str = None
+    is_off: bool = True
+
+    def __init__(self, name, commands):
+        """!
+        Standard initialization. Use ActuatorService.client to get one.
+        @param name: Name of the control element.
+        @param commands: Command queue of the actuator service.
+        """
+
+        self.name = name
+        self._commands = commands
+
+    def turn_on(self):
+        self.is_off = False
+        self._commands.put(ActuatorCommand(ON, self.name))
+
+    def turn_off(self):
+        self.is_off = True
+        self._commands.put(ActuatorCommand(OFF, self.name))
+
+    def toggle(self):
+        if self.is_off:
+            self.turn_on()
+        else:
+            self.turn_off()
+
+    def run(self, duration):
+        """!
+        Turns the control element on for a number of seconds, then off again.
+        @param duration: Time (s) to run for, with millisecond resolution
+        """
+        self.is_off = False
+        self._commands.put(ActuatorCommand(RUN, self.name, duration))
+
+    def cancel(self):
+        """!
+        Stops a run of the control element that is in progress, and turns it off.
+        """
+        self.is_off = True
+        self._commands.put(ActuatorCommand(CANCEL, self.name))
+
+
+class TimedRun:
+    """!
+    Runs a control element for a set time, in its own thread, and sends the run's completion back once it is over.
+    @param element: Name of the control element.
+    @param duration: Time (s) to run for.
+    """
+
+    element: str = None
+    duration: float = 0
+
+    def __init__(self, element, relay, duration, results):
+        """!
+        Standard initialization. Call start to begin the run.
+        @param element: Name of the control element.
+        @param relay: Relay of the control element.
+        @param duration: Time (s) to run for.
+        @param results: Queue that the completion of the run is sent to.
+        """
+
+        self.element = element
+        self.duration = max(duration, 0)
+        self._relay = relay
+        self._results = results
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=element + "_run", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        """!
+        Stops the run (if it is still in progress), and waits until the control element is off.
+        """
+        self._cancelled.set()
+        self._thread.join()
+
+    def _run(self):
+        start = time.monotonic()
+        try:
+            self._relay.turn_on()
+            try:
+                cancelled = self._cancelled.wait(self.duration)
+            finally:
+                self._relay.turn_off()
+        except Exception as err:
+            self._results.put(ActuatorResult(RUN, self.element, FAILED, round(time.monotonic() - start, 3), str(err)))
+            return
+        self._results.put(ActuatorResult(RUN, self.element, CANCELLED if cancelled else DONE,
+                                         round(time.monotonic() - start, 3)))
+
+
+class ActuatorService:
+    """!
+    Owns a group of control elements, and carries out the commands sent to them, in its own process.
+    @param controls: Dictionary mapping the name of each control element to its relay.
+    @param commands: Queue that every command is sent to.
+    @param results: Queue that the completion of every command is sent back to.
+    @param process: The actuator process.
+    @param runs: Dictionary mapping each control element to its latest TimedRun (actuator process only).
+    """
+
+    controls: dict = None
+    commands: Queue = None
+    results: Queue = None
+    process: Process = None
+    runs: dict = None
+
+    def __init__(self, controls):
+        """!
+        Standard initialization.
+        @param controls: Dictionary mapping the name of each control element to its relay.
+        """
+
+        self.controls = controls
+        self.commands = Queue()
+        self.results = Queue()
+        self.runs = {}
+
+    def client(self, name):
+        """!
+        Returns the ActuatorClient main should use in place of the relay of a control element.
+        @param name: Name of the control element.
+        """
+
+        if name not in self.controls:
+            raise KeyError("The actuator service does not own " + str(name))
+        return ActuatorClient(name, self.commands)
+
+    def start(self):
+        """!
+        Starts the actuator process. It is stopped along with the process that started it.
+        """
+
+        self.process = Process(target=self.run, name="actuator_service", daemon=True)
+        self.process.start()
+
+    def run(self):
+        """!
+        This is the main loop of the actuator process. Runs until the process is terminated.
+        Any command for a control element that is running ends that run first.
+        Every control element is turned off on the way out.
+        """
+
+        signal.signal(signal.SIGTERM, exit_on_signal)
+        self.logger = get_logger("actuator_service")
+        self.logger.debug("Actuating " + ", ".join(self.controls) + ".")
+        try:
+            while True:
+                command = self.commands.get()
+                run = self.runs.pop(command.element, None)
+                if run is not None:
+                    run.cancel()
+                self.execute(command)
+        finally:
+            for run in self.runs.values():
+                run.cancel()
+            for relay in self.controls.values():
+                relay.turn_off()
+
+    def execute(self, command):
+        """!
+        Carries out a command, and sends its completion back.
+        @param command: The ActuatorCommand
+        """
+
+        relay = self.controls.get(command.element)
+        if relay is None:
+            self.results.put(ActuatorResult(command.action, command.element, FAILED,
+                                            detail="Unknown control element"))
+            return
+        try:
+            if command.action == ON:
+                relay.turn_on()
+            elif command.action in (OFF, CANCEL):
+                relay.turn_off()
+            elif command.action == RUN:
+                self.runs[command.element] = TimedRun(command.element, relay, command.duration, self.results)
+                self.runs[command.element].start()
+                return
+            else:
+                raise ValueError("Unknown action: " + str(command.action))
+        except Exception as err:
+            self.logger.error(command.element + ": " + str(err))
+            self.results.put(ActuatorResult(command.action, command.element, FAILED, detail=str(err)))
+            return
+        self.results.put(ActuatorResult(command.action, command.element, DONE))
+
+
+def unit_test():
+    class FakeRelay:
+        def __init__(self, name, log):
+            self.name = name
+            self.log = log
+
+        def turn_on(self):
+            self.log.put((self.name, "on"))
+
+        def turn_off(self):
+            self.log.put((self.name, "off"))
+
+    log = Queue()
+    service = ActuatorService({'pump': FakeRelay("pump", log), 'fan': FakeRelay("fan", log)})
+    pump = service.client("pump")
+    fan = service.client("fan")
+    service.start()
+
+    fan.turn_on()
+    assert service.results.get(timeout=5) == ActuatorResult(ON, "fan", DONE)
+    pump.run(0.25)
+    result = service.results.get(timeout=5)
+    assert result.outcome == DONE and 0.25 <= result.elapsed < 0.3
+
+    # A command for another element is carried out during a run, and a cancel stops it right away
+    pump.run(10)
+    fan.turn_off()
+    assert service.results.get(timeout=5) == ActuatorResult(OFF, "fan", DONE)
+    time.sleep(0.1)
+    pump.cancel()
+    result = service.results.get(timeout=5)
+    assert result.outcome == CANCELLED and result.elapsed < 0.2
+    assert service.results.get(timeout=5) == ActuatorResult(CANCEL, "pump", DONE)
+
+    service.commands.put(ActuatorCommand(ON, "heater"))
+    assert service.results.get(timeout=5).outcome == FAILED
+    service.process.terminate()
+    service.process.join()
+
+    actions = []
+    while not log.empty():
+        actions.append(log.get())
+    assert actions[:3] == [("fan", "on"), ("pump", "on"), ("pump", "off")]
+
+
+if __name__ == "__main__":
+    unit_test()
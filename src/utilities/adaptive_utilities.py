@@ -0,0 +1,107 @@
+"""!
+Contains the adaptive polling policy of the sensors.
+
+Most of the time, readings barely move (e.g, soil moisture over a few hours), and polling slowly is plenty.
+Around events, they move quickly (e.g, soil moisture while and after the pump runs), and polling slowly misses them.
+With an adaptive policy, a sensor polls at its slow interval while its readings are stable, and switches to
+its fast interval for a while whenever:
+- The rate of change of its readings crosses a threshold, or
+- Main reports that an actuator affecting it (e.g, the pump) has just turned on.
+"""
+
+
+import time
+from multiprocessing import Event, Value
+
+
+class AdaptivePolling:
+    """!
+    Picks the polling interval of a sensor based on how fast its readings are changing.
+    Shared between main (which can boost it) and the sensor process (which follows it).
+    @param slow_interval: Polling interval (s) while readings are stable.
+    @param fast_interval: Polling interval (s) while readings are changing.
+    @param threshold: Rate of change (units/s) of the field, above which the sensor switches to the fast interval.
+    @param field: Name of the field whose rate of change is tracked.
+    @param hold: Time (s) the sensor keeps the fast interval after the last trigger.
+    @param wakeup: Event set by main to wake the sensor up when it boosts the policy.
+    """
+
+    slow_interval: float = None
+    fast_interval: float = None
+    threshold: float = None
+    field: str = 'value'
+    hold: float = 600
+    wakeup: Event = None
+
+    def __init__(self, slow_interval, fast_interval, threshold, field='value', hold=600):
+        """!
+        Standard initialization.
+        @param slow_interval: Polling interval (s) while readings are stable.
+        @param fast_interval: Polling interval (s) while readings are changing.
+        @param threshold: Rate of change (units/s) of the field, above which the sensor switches to the fast interval.
+        @param field: Name of the field whose rate of change is tracked.
+        @param hold: Time (s) the sensor keeps the fast interval after the last trigger.
+        """
+
+        self.slow_interval = slow_interval
+        self.fast_interval = fast_interval
+        self.threshold = threshold
+        self.field = field
+        self.hold = hold
+        self.wakeup = Event()
+        self._boost_until = Value('d', 0.0, lock=False)  # Monotonic time (s), written by main
+        self._fast_until = 0.0  # Monotonic time (s), written by the sensor
+        self._previous = None
+
+    def interval(self):
+        """!
+        Returns the polling interval that applies right now.
+        """
+
+        if time.monotonic() < max(self._fast_until, self._boost_until.value):
+            return self.fast_interval
+        return self.slow_interval
+
+    def observe(self, timestamp, data):
+        """!
+        Tracks a new reading, switching to the fast interval if the field changed faster than the threshold.
+        Called by the sensor for each of its readings.
+        @param timestamp: Epoch timestamp of the reading, in nanoseconds
+        @param data: Either a single number, or a dictionary mapping field name -> number
+        """
+
+        value = data.get(self.field) if isinstance(data, dict) else data
+        if not isinstance(value, (int, float)):
+            return
+        if self._previous is not None and timestamp > self._previous[0]:
+            rate = abs(value - self._previous[1]) / ((timestamp - self._previous[0]) / 1e9)
+            if rate >= self.threshold:
+                self._fast_until = time.monotonic() + self.hold
+        self._previous = (timestamp, value)
+
+    def boost(self, duration=None):
+        """!
+        Switch to the fast interval right away, e.g. because an actuator affecting the sensor has turned on.
+        Called by main. Wakes the sensor up if it is waiting on a slow interval.
+        @param duration: Time (s) to keep the fast interval for. Defaults to the hold time.
+        """
+
+        self._boost_until.value = time.monotonic() + (self.hold if duration is None else duration)
+        self.wakeup.set()
+
+
+def unit_test():
+    policy = AdaptivePolling(slow_interval=300, fast_interval=10, threshold=0.05, hold=60)
+    policy.observe(0, 50.0)
+    policy.observe(60 * 10**9, 50.5)  # 0.5 % in a minute: stable
+    assert policy.interval() == 300
+    policy.observe(120 * 10**9, {'value': 58.0, 'spread': 0.1})  # 7.5 % in a minute: changing
+    assert policy.interval() == 10
+
+    policy = AdaptivePolling(slow_interval=300, fast_interval=10, threshold=0.05)
+    policy.boost(5)
+    assert policy.wakeup.is_set() and policy.interval() == 10
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -2,7 +2,7 @@
 Contains the algorithms (functions) that are needed to translate the sensor readings
 into actionable quantities.
 
-These algorithms analyse the sensor data found within the master database, and use it to generate control messages.
+These algorithms analyse the sensor data found within the sensor history, and use it to generate control messages.
 These message are passed back to the main thread, so that the information can be:
 1. Relayed to the GUI for display
 2. Used to start up control processes.
@@ -12,38 +12,40 @@ These message are passed back to the main thread, so that the information can be
 import statistics
 
 
-def environment_algorithm(db):
+def environment_algorithm(config, history):
     """!
     This algorithm interprets the data obtained from the environment sensors.
-    @param db: The master database
+    @param config: The active configuration
+    @param history: The sensor history
     """
 
     # Check Temperature level
     msg = ["environment_sensor", {}]
-    temperature = int(db['latest']['environment_sensor']['temperature'])
-    if temperature >= db['Temperature_High']:
+    latest = history.latest('environment_sensor')
+    temperature = int(latest['temperature'])
+    if temperature >= config.temperature_high:
         flag = "HIGH"
-    elif temperature <= db['Temperature_Low']:
+    elif temperature <= config.temperature_low:
         flag = "LOW"
     else:
         flag = None
     msg[1]['temperature'] = {'value': temperature, 'flag': flag}
 
     #  Check Humidity level
-    humidity = int(db['latest']['environment_sensor']['humidity'])
-    if humidity >= db['Humidity_High']:
+    humidity = int(latest['humidity'])
+    if humidity >= config.humidity_high:
         flag = "HIGH" # As we are not controlling humidity and only measuring, no action needed
-    elif humidity <= db['Humidity_Low']:
+    elif humidity <= config.humidity_low:
         flag = "LOW" # As we are not controlling humidity and only measuring, no action needed
     else:
         flag = None
     msg[1]['humidity'] = {'value': humidity, 'flag': flag}
 
     # Check VOC/gas level
-    gas = round(int(db['latest']['environment_sensor']['gas'])/1000, 2)
-    if gas >= db['VOC_High']:
+    gas = round(int(latest['gas'])/1000, 2)
+    if gas >= config.voc_high:
         flag = "HIGH" # NOTE: In future iterations, poor VOC readings may result in the fan being turned on
-    elif gas <= db['VOC_Low']:
+    elif gas <= config.voc_low:
         flag = "LOW" # If VOC is acceptable, no need to take any action.
     else:
         flag = None
@@ -51,17 +53,22 @@ def environment_algorithm(db):
     return msg
 
 
-def watering_algorithm(db, water_list):
+def watering_algorithm(config, history, water_list):
     """!
     The watering algorithm takes the raw sensor data and determines
     if the soil moisture within the enclosure is within the acceptable range
     (as provided by the configuraiton file).
-    @param db: The master database
+    @param config: The active configuration
+    @param history: The sensor history
     @param water_list: List of water values recorded over time
     """
     try:
         # Get the most recent soil_moisture_levels
-        measured_level = int(db['latest']['soil_moisture_sensor_1'])
+        # Sensors that take bursts of readings also report their spread
+        latest = history.latest('soil_moisture_sensor_1')
+        if isinstance(latest, dict):
+            latest = latest['value']
+        measured_level = int(latest)
 
         # Will return the average and std. of numbers only, ignoring Nonetype entries
         try:
@@ -96,9 +103,9 @@ def watering_algorithm(db, water_list):
         # Determine the flag from the accepted range & the calculated level
         flag = None
         print("Calculated Level:", calculated_level)
-        if calculated_level < db['Moisture_Low']:
+        if calculated_level < config.moisture_low:
             flag = "LOW"
-        elif calculated_level > db['Moisture_High']:
+        elif calculated_level > config.moisture_high:
             flag = "HIGH"
 
     except KeyError as err:
@@ -110,20 +117,3 @@ def watering_algorithm(db, water_list):
     # Generate & relay the message containing the calculated level for the GUI to display
     msg = ['soil_moisture_sensor', measured_level, flag, calculated_level]
     return msg
-
-
-def time_keeper(curr, prev):
-    """!
-    The purpose of the time_keeper is to determine what state the RGB & UV LEDs and the Fan
-    should be in at any given time.
-    The current algorithm detects when the hour changes.
-
-    @param curr: The current time
-    @param prev: The previous time that the algorithm ran
-    """
-    if not curr.hour == prev.hour:
-        return True
-    else:
-        return False
-
-
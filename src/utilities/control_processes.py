@@ -5,24 +5,17 @@ There should be a minimal amount of computation done in these functions.
 
 
 import datetime
-import time
-import sys
 
 
-def watering_process(msg, controls, queue, db):
+def pump_time(calculated_level, moisture_low):
     """!
-    Based on the calculated level it is provided, the watering_process
-    will determine how long it needs to water for, then it will
-    actuate the pump for the appropriate amount of time.
-    @param msg: The control message generated by the watering algorithm
-    @param controls: Access to the control devices
-    @param queue: Queue to relay to the main process
-    @param db: Copy of the master database
+    Based on the calculated level it is provided, pump_time
+    determines how long (s) the pump needs to run for, to the millisecond.
+    The pump itself is run by the actuator service (see actuator_utilities).
+    @param calculated_level: The soil moisture level calculated by the watering algorithm
+    @param moisture_low: Lower bound of the accepted soil moisture range
     """
 
-    # Determine the required watering time
-    calculated_level = msg[3]
-    moisture_low = db["Moisture_Low"]
     # moisture_high = db["Moisture_High"]
 
     # lh = abs(moisture_low-moisture_high)
@@ -35,127 +28,77 @@ def watering_process(msg, controls, queue, db):
         if flow > max_flow:
             flow = max_flow
     flow_per_second = 0.905  # [mL/s]
-    pump_time = int(flow/flow_per_second)
+    return round(flow/flow_per_second, 3)
 
-    # Operate the pump
-    if flow: # a.k.a flow is not 0
-        controls['pump'].turn_on()
-        print("Beginning pump for", pump_time, "seconds.")
-        for _ in range(pump_time):
-            if not queue.empty():
-                msg = queue.get()
-                print("Pump is being interrupted by manual override.")
-                controls['pump'].turn_off()
-                sys.exit(0)
-            time.sleep(1)
-        controls['pump'].turn_off()
 
-    # Relay that it is finished
-    queue.put("Finished pumping for " + str(pump_time) + "s.")
-
-    # Terminate the process
-    sys.exit(0)
-
-
-def fan_process(msg, controls, queue):
+def fan_hourly_process(config, state, controls):
     """!
-    The fan process reads the control message and controls the fan accordingly.
-    If flag is HIGH --> turn ON the fan
-    If flag is LOW --> turn OFF the fan
+    The fan hourly process sets the fan to whatever is scheduled
+    for the current hour in the config file.
 
-    @param msg: The control message generated by the environment algorithm.
-    @param controls: Access to the control elements.
-    @param queue: Communication channel to the main process.
+    @param config: The active configuration.
+    @param state: The live state of the system. The fan status is updated in it.
+    @param controls: Access to all the control elements.
     """
-
-    # Read the message for the fan flag and respond accordingly
-    if msg[1]['temperature']['flag'] == "HIGH":
-        controls['fan'].turn_on()
-        queue.put("Fan turned ON")
-    elif msg[1]['temperature']['flag'] == "LOW":
-        controls['fan'].turn_off()
-        queue.put("Fan turned OFF")
-
-    # Terminate the process
-    sys.exit(0)
-
-
-def fan_hourly_process(db, controls):
     try:
         # Get the current hour & the corresponding Fan data
         hour = str(datetime.datetime.now().hour)
 
         # Check for manual override on the Fan
-        if not db['Manual Overrides']['Fan']:
-            # Get the UV light data for the current hour
-            if db['Fan_data'][hour]:
+        if not state.fan_override:
+            # Get the fan data for the current hour
+            if config.fan_data[hour]:
                 controls['fan'].turn_on()
-                db['Fan Status'] = "ON"
+                state.fan_status = "ON"
             else:
                 controls['fan'].turn_off()
-                db['Fan Status'] = "OFF"
+                state.fan_status = "OFF"
     except Exception as err:
         return err
     return 0
 
 
-def lighting_process(db, controls):
+def lighting_process(config, state, controls):
     """!
     The lighting process sets the RGB and UV LEDs to whatever
-    light values are specified in the config file (stored in database).
+    light values are specified in the config file.
 
     The lighting process is so lightweight that is does not
     run as a seperate process. Instead it runs in series with the main process.
 
-    @param db: The master database.
+    @param config: The active configuration.
+    @param state: The live state of the system. The LED statuses are updated in it.
     @param controls: Access to all the control elements.
     """
     try:
         # Get the current hour & the corresponding RGB data
         hour = str(datetime.datetime.now().hour)
-        rgb_data = db['RGB_data'][hour]
+        rgb_data = config.rgb_data[hour]
         red = rgb_data['R']
         green = rgb_data['G']
         blue = rgb_data['B']
 
         # Check for manual override on the RGB LED Strip
-        if not db['Manual Overrides']['RGB LED']:
+        if not state.rgb_led_override:
             # Adjust the RGB Accordingly and update the status
             controls['RGB LED'].adjust_color(red_content=red, green_content=green, blue_content=blue)
-            db['RGB LED Status'] = [red, green, blue]
+            state.rgb_led_status = [red, green, blue]
 
         # Check for manual override on the UV LED Strip
-        if not db['Manual Overrides']['UV LED']:
+        if not state.uv_led_override:
             # Get the UV light data for the current hour
-            if db['UV_data'][hour]:
+            if config.uv_data[hour]:
                 controls['UV LED'].turn_on()
-                db['UV LED Status'] = "ON"
+                state.uv_led_status = "ON"
             else:
                 controls['UV LED'].turn_off()
-                db['UV LED Status'] = "OFF"
+                state.uv_led_status = "OFF"
     except Exception as err:
         return err
     return 0
 
 if __name__ == "__main__":
     moisture_low = 80
-    # moisture_high = 95
-
-    def calc_flow(calculated_level):
-        # lh = abs(moisture_low-moisture_high)
-        max_flow = 50  # [mL]
-        if calculated_level >= moisture_low:
-            flow = 0
-        elif calculated_level < moisture_low:
-            flow = (moisture_low - calculated_level) * 5
-            # flow = (max_flow/(2*lh))*(moisture_low-calculated_level) + 50
-            if flow > max_flow:
-                flow = max_flow
-        
-        flow_per_second = 0.905  # [mL/s]
-        pump_time = int(flow/flow_per_second)
-        return pump_time
 
     for i in range(65,100):
-        flow = calc_flow(i)
-        print("Input level:", i, "calculated pump time:",flow)
\ No newline at end of file
+        print("Input level:", i, "calculated pump time:", pump_time(i, moisture_low))
@@ -0,0 +1,101 @@
+"""!
+Contains the delivery monitor, which keeps track of how the readings of each sensor reach the main process.
+
+Every reading carries its acquisition timestamp, a per-sensor sequence number, and how long the poll that
+took it lasted. From those, the monitor can tell:
+- Gaps: readings that never arrived (the sequence number jumps by more than one),
+- Duplicates: readings that arrived twice (the same sequence number is seen again), which are not stored again,
+- Restarts: the sensor process started over (the sequence number goes back down),
+- Latency: how long each reading took from acquisition to being handled by main,
+- Poll durations: how long the sensor took to take each reading.
+"""
+
+
+import time
+
+
+# Counters kept for each sensor
+STATISTICS = ['received', 'missed', 'duplicates', 'restarts', 'latency_total', 'latency_max', 'duration_total',
+              'duration_max']
+
+
+class DeliveryMonitor:
+    """!
+    Tracks the sequence numbers, latency and poll durations of the readings of every sensor.
+    @param statistics: Dictionary mapping sensor name -> counter name (see STATISTICS) -> value
+    """
+
+    statistics: dict = None
+
+    def __init__(self):
+        """!
+        Standard initialization.
+        """
+
+        self.statistics = {}
+        self._last_sequence = {}
+
+    def observe(self, sensor_name, timestamp, sequence, duration, now=None):
+        """!
+        Tracks a reading. Returns the number of readings of the sensor that went missing right before it,
+        or None if the reading is a duplicate (and should be ignored).
+        @param sensor_name: Name of the sensor that took the reading
+        @param timestamp: Acquisition timestamp of the reading (epoch, ns)
+        @param sequence: Sequence number of the reading
+        @param duration: Time (s) the poll that took the reading lasted
+        @param now: Epoch time (ns) the reading is handled at. Defaults to now.
+        """
+
+        counters = self.statistics.setdefault(sensor_name, dict.fromkeys(STATISTICS, 0))
+        last = self._last_sequence.get(sensor_name)
+        if last is not None and sequence == last:
+            counters['duplicates'] += 1
+            return None
+        missed = 0
+        if last is not None and sequence < last:
+            counters['restarts'] += 1
+        elif last is not None:
+            missed = sequence - last - 1
+        self._last_sequence[sensor_name] = sequence
+
+        latency = ((time.time_ns() if now is None else now) - timestamp) / 1e9
+        counters['received'] += 1
+        counters['missed'] += missed
+        counters['latency_total'] += latency
+        counters['latency_max'] = max(counters['latency_max'], latency)
+        counters['duration_total'] += duration
+        counters['duration_max'] = max(counters['duration_max'], duration)
+        return missed
+
+    def summary(self):
+        """!
+        Returns a dictionary mapping each sensor to its counters (see STATISTICS), plus its mean latency (s)
+        and mean poll duration (s).
+        """
+
+        summary = {}
+        for sensor_name, counters in self.statistics.items():
+            received = counters['received']
+            summary[sensor_name] = dict(counters,
+                                        latency_mean=counters['latency_total'] / received if received else 0.0,
+                                        duration_mean=counters['duration_total'] / received if received else 0.0)
+        return summary
+
+
+def unit_test():
+    monitor = DeliveryMonitor()
+    second = 10**9
+    assert monitor.observe("soil", 0, 0, 0.5, now=second) == 0
+    assert monitor.observe("soil", 2 * second, 1, 0.3, now=3 * second) == 0
+    assert monitor.observe("soil", 2 * second, 1, 0.3, now=3 * second) is None  # Duplicate
+    assert monitor.observe("soil", 8 * second, 4, 0.4, now=11 * second) == 2  # Readings 2 and 3 went missing
+    assert monitor.observe("soil", 9 * second, 0, 0.2, now=9 * second) == 0  # The sensor restarted
+    summary = monitor.summary()['soil']
+    assert summary['received'] == 4 and summary['missed'] == 2
+    assert summary['duplicates'] == 1 and summary['restarts'] == 1
+    assert summary['latency_max'] == 3.0 and summary['latency_mean'] == 1.25
+    assert summary['duration_max'] == 0.5 and abs(summary['duration_mean'] - 0.35) < 1e-9
+
+
+if __name__ == "__main__":
+    unit_test()
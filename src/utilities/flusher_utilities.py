@@ -0,0 +1,147 @@
+"""!
+Contains the background flusher that decouples persistence from the main loop.
+
+The main loop hands every change it wants persisted to the flusher, which returns immediately.
+A background thread collects the changes and writes them out together as one batch:
+- A batch is written once no new change has arrived for a "window" of time,
+- but never later than "max_dirty_age" after the oldest change in it arrived.
+This coalesces bursts of changes into a single write, while bounding how long
+any change can sit unwritten in memory.
+"""
+
+
+import threading
+import time
+
+
+class BackgroundFlusher:
+    """!
+    Coalesces submitted items and passes them in batches to a write function, from a background thread.
+    @param write_batch: Function called (from the background thread) with each list of items to write.
+    @param window: Time (s) without new items after which the pending items are written.
+    @param max_dirty_age: Maximum time (s) an item can wait before it is written.
+    @param thread: The background writer thread.
+    """
+
+    write_batch = None
+    window: float = 5.0
+    max_dirty_age: float = 30.0
+    thread: threading.Thread = None
+
+    def __init__(self, write_batch, window=5.0, max_dirty_age=30.0):
+        """!
+        Standard initialization. Starts the background thread.
+        @param write_batch: Function called (from the background thread) with each list of items to write.
+        @param window: Time (s) without new items after which the pending items are written.
+        @param max_dirty_age: Maximum time (s) an item can wait before it is written.
+        """
+
+        self.write_batch = write_batch
+        self.window = window
+        self.max_dirty_age = max_dirty_age
+
+        self._condition = threading.Condition()
+        self._pending = []
+        self._oldest = None
+        self._newest = None
+        self._submitted = 0
+        self._written = 0
+        self._flush_requested = False
+        self._running = True
+
+        self.thread = threading.Thread(target=self._run, name="persistence_flusher", daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """!
+        Queue an item to be written. Never blocks on the disk.
+        @param item: The item to write
+        """
+
+        with self._condition:
+            now = time.monotonic()
+            if not self._pending:
+                self._oldest = now
+            self._newest = now
+            self._pending.append(item)
+            self._submitted += 1
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """!
+        Write everything submitted so far right away, and wait until it has been written.
+        @param timeout: Maximum time (s) to wait for. None waits for as long as it takes.
+        """
+
+        with self._condition:
+            target = self._submitted
+            self._flush_requested = True
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._written >= target or not self.thread.is_alive(), timeout)
+
+    def close(self):
+        """!
+        Write everything that is still pending, then stop the background thread.
+        """
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self.thread.join()
+
+    def _run(self):
+        """!
+        Main loop of the background thread.
+        Sleeps until there is something pending, then until it is due, then writes it.
+        """
+
+        while True:
+            with self._condition:
+                while True:
+                    if not self._pending:
+                        if not self._running:
+                            return
+                        self._flush_requested = False
+                        self._condition.wait()
+                        continue
+                    if self._flush_requested or not self._running:
+                        break
+                    due = min(self._newest + self.window, self._oldest + self.max_dirty_age)
+                    remaining = due - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch, self._pending = self._pending, []
+                self._flush_requested = False
+
+            try:
+                self.write_batch(batch)
+            except Exception as err:
+                print("Unable to write batch of", len(batch), "items:", err)
+
+            with self._condition:
+                self._written += len(batch)
+                self._condition.notify_all()
+
+
+def unit_test():
+    batches = []
+    flusher = BackgroundFlusher(batches.append, window=0.2, max_dirty_age=0.5)
+    for k in range(10):
+        flusher.submit(k)
+    time.sleep(0.4)
+    assert batches == [list(range(10))]
+
+    # A steady trickle is still written once it reaches the max dirty age
+    for k in range(6):
+        flusher.submit(k)
+        time.sleep(0.1)
+    assert len(batches) >= 2
+
+    flusher.submit("last")
+    flusher.close()
+    assert batches[-1][-1] == "last"
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,353 @@
+"""!
+Contains the I2C bus manager, which owns the I2C bus and arbitrates the transactions of every sensor driver.
+
+Without it, each driver opens the bus on its own, from its own process, and their transactions
+interleave unpredictably. With it, one bus manager process opens (and holds) the bus, and each driver
+is handed a ManagedI2C instead of a busio.I2C. A ManagedI2C has the same interface as busio.I2C, so
+the driver libraries (adafruit_bme680, adafruit_ads1x15, ...) use it unchanged, but every transaction
+is sent to the bus manager through one request queue, and carried out there, one at a time.
+
+- Each device has a priority. When several transactions are waiting, the one of the device with the
+lowest priority number goes first (ties go to whichever was submitted first).
+- Each device has a timeout. A transaction that has waited longer than that for the bus is dropped,
+and the driver gets a TimeoutError instead of a late result.
+- Per-device counters (transactions, errors, timeouts, latency, time spent on the bus) are kept in
+shared memory, so main can read them at any time (see I2CBusManager.statistics).
+"""
+
+
+import heapq
+import signal
+import time
+from queue import Empty
+from multiprocessing import Queue, Process, Array
+from src.utilities.logger_utilities import get_logger
+from src.utilities.sensor_template import exit_on_signal
+
+
+# Counters kept for each device, in the order they are stored
+STATISTICS = ['transactions', 'errors', 'timeouts', 'latency_total', 'latency_max', 'bus_time']
+TRANSACTIONS, ERRORS, TIMEOUTS, LATENCY_TOTAL, LATENCY_MAX, BUS_TIME = range(len(STATISTICS))
+
+# Time (s) a driver waits for a transaction to be carried out, on top of the device's timeout
+REPLY_ALLOWANCE = 1.0
+
+
+class ManagedI2C:
+    """!
+    Stand-in for busio.I2C, handed to the driver of one device. Sends each transaction to the bus manager,
+    and waits for its result.
+    @param name: Name of the device.
+    @param device: Number identifying the device to the bus manager.
+    @param priority: Priority of the device's transactions. Lower numbers go first.
+    @param timeout: Maximum time (s) a transaction can wait for the bus before it is dropped.
+    """
+
+    name: str = None
+    device: int = None
+    priority: int = 1
+    timeout: float = 1.0
+
+    def __init__(self, name, device, requests, replies, priority=1, timeout=1.0):
+        """!
+        Standard initialization. Use I2CBusManager.device to get one.
+        @param name: Name of the device.
+        @param device: Number identifying the device to the bus manager.
+        @param requests: Queue of the bus manager that transactions are sent to.
+        @param replies: Queue that the bus manager sends the device's results to.
+        @param priority: Priority of the device's transactions. Lower numbers go first.
+        @param timeout: Maximum time (s) a transaction can wait for the bus before it is dropped.
+        """
+
+        self.name = name
+        self.device = device
+        self.priority = priority
+        self.timeout = timeout
+        self._requests = requests
+        self._replies = replies
+        self._request_id = 0
+        self._locked = False
+
+    def try_lock(self):
+        """!
+        The bus manager already serializes every transaction, so this only guards against a driver
+        nesting its own transactions.
+        """
+        if self._locked:
+            return False
+        self._locked = True
+        return True
+
+    def unlock(self):
+        self._locked = False
+
+    def deinit(self):
+        """!
+        The bus belongs to the bus manager, so there is nothing to release here.
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.deinit()
+
+    def scan(self):
+        return self._transact("scan", None)
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self._transact("writeto", address, bytes(buffer[start:end]))
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        buffer[start:end] = self._transact("readfrom_into", address, length=end - start)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0,
+                              in_end=None):
+        in_end = len(buffer_in) if in_end is None else in_end
+        buffer_in[in_start:in_end] = self._transact("writeto_then_readfrom", address,
+                                                    bytes(buffer_out[out_start:out_end]), in_end - in_start)
+
+    def _transact(self, operation, address, data=b"", length=0):
+        """!
+        Sends a transaction to the bus manager, and waits for its result.
+        Raises whatever the bus raised while carrying it out, or TimeoutError if it did not get the bus in time.
+        @param operation: Name of the busio.I2C method that carries out the transaction
+        @param address: Address of the device on the bus
+        @param data: Bytes to write
+        @param length: Number of bytes to read
+        """
+
+        self._request_id += 1
+        submitted = time.monotonic()
+        self._requests.put((self.device, self._request_id, operation, address, data, length,
+                            submitted, submitted + self.timeout))
+        wait_until = submitted + self.timeout + REPLY_ALLOWANCE
+        while True:
+            try:
+                request_id, result = self._replies.get(timeout=max(wait_until - time.monotonic(), 0))
+            except Empty:
+                raise TimeoutError(self.name + ": No reply from the I2C bus manager") from None
+            if request_id != self._request_id:
+                continue  # Late result of a transaction that was already given up on
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+
+class I2CBusManager:
+    """!
+    Owns the I2C bus, and carries out the transactions of every device on it, one at a time.
+    Register every device (see device) before starting the bus manager.
+    @param bus: The bus. None opens the board's I2C bus (busio.I2C) in the bus manager process.
+    @param devices: Names of the registered devices.
+    @param process: The bus manager process.
+    """
+
+    bus = None
+    devices: list = None
+    process: Process = None
+
+    def __init__(self, bus=None):
+        """!
+        Standard initialization.
+        @param bus: The bus. None opens the board's I2C bus (busio.I2C) in the bus manager process.
+        """
+
+        self.bus = bus
+        self.devices = []
+        self.requests = Queue()
+        self._replies = []
+        self._priorities = []
+        self._statistics = []
+        self._started = None
+
+    def device(self, name, priority=1, timeout=1.0):
+        """!
+        Registers a device, and returns the ManagedI2C its driver should use in place of busio.I2C.
+        @param name: Name of the device.
+        @param priority: Priority of the device's transactions. Lower numbers go first.
+        @param timeout: Maximum time (s) a transaction can wait for the bus before it is dropped.
+        """
+
+        replies = Queue()
+        self.devices.append(name)
+        self._replies.append(replies)
+        self._priorities.append(priority)
+        self._statistics.append(Array('d', len(STATISTICS), lock=False))
+        return ManagedI2C(name, len(self.devices) - 1, self.requests, replies, priority, timeout)
+
+    def start(self):
+        """!
+        Starts the bus manager process. It is stopped along with the process that started it.
+        """
+
+        self._started = time.monotonic()
+        self.process = Process(target=self.run, name="i2c_bus_manager", daemon=True)
+        self.process.start()
+
+    def run(self):
+        """!
+        This is the main loop of the bus manager process. Runs until the process is terminated.
+        Every transaction that has arrived is queued by priority, and the most urgent one is carried out.
+        """
+
+        signal.signal(signal.SIGTERM, exit_on_signal)
+        self.logger = get_logger("i2c_bus_manager")
+        if self.bus is None:
+            import board
+            from busio import I2C
+            self.bus = I2C(board.SCL, board.SDA)
+        while not self.bus.try_lock():  # The bus is held for as long as the bus manager runs
+            pass
+        self.logger.debug("Managing the I2C bus of " + str(len(self.devices)) + " devices.")
+
+        pending = []
+        arrivals = 0
+        while True:
+            try:
+                request = self.requests.get() if not pending else self.requests.get_nowait()
+                while True:
+                    heapq.heappush(pending, (self._priorities[request[0]], arrivals, request))
+                    arrivals += 1
+                    request = self.requests.get_nowait()
+            except Empty:
+                pass
+            self.serve(heapq.heappop(pending)[2])
+
+    def serve(self, request):
+        """!
+        Carries out a transaction (unless it has waited too long for the bus), updates the device's counters,
+        and sends the result back to the device.
+        @param request: Tuple of (device, request id, operation, address, data, length, submitted, deadline)
+        """
+
+        device, request_id, operation, address, data, length, submitted, deadline = request
+        counters = self._statistics[device]
+        start = time.monotonic()
+        if start > deadline:
+            counters[TIMEOUTS] += 1
+            self.logger.warning(self.devices[device] + ": Dropped a transaction that waited "
+                                + str(round(start - submitted, 3)) + "s for the bus")
+            self._replies[device].put((request_id, TimeoutError(self.devices[device] + ": Timed out waiting for the I2C bus")))
+            return
+
+        try:
+            result = self.execute(operation, address, data, length)
+        except Exception as err:
+            counters[ERRORS] += 1
+            result = err
+        end = time.monotonic()
+        counters[TRANSACTIONS] += 1
+        counters[BUS_TIME] += end - start
+        counters[LATENCY_TOTAL] += end - submitted
+        counters[LATENCY_MAX] = max(counters[LATENCY_MAX], end - submitted)
+        self._replies[device].put((request_id, result))
+
+    def execute(self, operation, address, data, length):
+        """!
+        Carries out a transaction on the bus, and returns what was read.
+        @param operation: Name of the busio.I2C method that carries out the transaction
+        @param address: Address of the device on the bus
+        @param data: Bytes to write
+        @param length: Number of bytes to read
+        """
+
+        if operation == "scan":
+            return self.bus.scan()
+        if operation == "writeto":
+            self.bus.writeto(address, data)
+            return None
+        buffer = bytearray(length)
+        if operation == "readfrom_into":
+            self.bus.readfrom_into(address, buffer)
+        elif operation == "writeto_then_readfrom":
+            self.bus.writeto_then_readfrom(address, data, buffer)
+        else:
+            raise ValueError("Unknown I2C operation: " + str(operation))
+        return bytes(buffer)
+
+    def statistics(self):
+        """!
+        Returns a dictionary mapping each device to its counters (see STATISTICS), plus its mean latency (s)
+        and the fraction of the time since the bus manager started that the bus spent on its transactions.
+        """
+
+        elapsed = time.monotonic() - self._started if self._started is not None else 0
+        statistics = {}
+        for name, counters in zip(self.devices, self._statistics):
+            device = dict(zip(STATISTICS, counters[:]))
+            device['latency_mean'] = device['latency_total'] / device['transactions'] if device['transactions'] else 0.0
+            device['utilization'] = device['bus_time'] / elapsed if elapsed else 0.0
+            statistics[name] = device
+        return statistics
+
+    def utilization(self):
+        """!
+        Returns the fraction of the time since the bus manager started that the bus was busy.
+        """
+        return sum(device['utilization'] for device in self.statistics().values())
+
+
+def unit_test():
+    class FakeBus:
+        def __init__(self):
+            self.registers = {}
+            self.served = Queue()
+
+        def try_lock(self):
+            return True
+
+        def scan(self):
+            return [0x48, 0x77]
+
+        def writeto(self, address, data):
+            self.served.put(address)
+            if address == 0x10:
+                raise OSError("No device at address 0x10")
+            self.registers[address] = bytes(data)
+
+        def writeto_then_readfrom(self, address, data, buffer):
+            self.served.put(address)
+            buffer[:] = self.registers.get(address, bytes(len(buffer)))[:len(buffer)]
+
+    bus = FakeBus()
+    manager = I2CBusManager(bus)
+    soil = manager.device("soil", priority=0)
+    environment = manager.device("environment", priority=1)
+    expired = manager.device("expired", timeout=0)
+
+    # With the manager not started yet, transactions pile up, and are carried out by priority once it starts
+    manager.requests.put((1, 0, "writeto", 0x77, b"\x01", 0, time.monotonic(), time.monotonic() + 60))
+    manager.requests.put((0, 0, "writeto", 0x48, b"\x02", 0, time.monotonic(), time.monotonic() + 60))
+    time.sleep(0.2)
+    manager.start()
+    assert [bus.served.get(timeout=5), bus.served.get(timeout=5)] == [0x48, 0x77]
+
+    soil.writeto(0x48, bytearray(b"\x00\x12\x34"), start=1)
+    buffer = bytearray(4)
+    environment.writeto_then_readfrom(0x48, bytearray(b"\x00"), buffer, in_start=2)
+    assert buffer == bytearray(b"\x00\x00\x12\x34")
+    assert soil.scan() == [0x48, 0x77]
+    try:
+        soil.writeto(0x10, b"\x00")
+        assert False
+    except OSError:
+        pass
+    try:
+        expired.scan()
+        assert False
+    except TimeoutError:
+        pass
+
+    statistics = manager.statistics()
+    assert statistics['soil']['transactions'] == 4 and statistics['soil']['errors'] == 1
+    assert statistics['environment']['transactions'] == 2 and statistics['expired']['timeouts'] == 1
+    assert 0 < manager.utilization() < 1
+    manager.process.terminate()
+    manager.process.join()
+
+
+if __name__ == "__main__":
+    unit_test()
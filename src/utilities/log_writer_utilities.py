@@ -0,0 +1,127 @@
+"""!
+Contains the buffered writer used by the sensors for logging their readings.
+
+The log file is kept open for as long as the sensor runs, and readings are buffered in memory
+and written out together, once enough of them have built up or once the oldest one has waited
+long enough. The sensor loop calls flush_if_due while it sleeps between polls, so buffered readings are
+written out on time even if no more readings come (e.g, the sensor stopped responding). Readings are logged as CSV: a header naming the columns, then one row per reading,
+starting with the acquisition timestamp (epoch, ns). Fields missing from a reading are left empty.
+This can be loaded straight into an array or data frame (see plot_utilities.read_sensor_log).
+"""
+
+
+import os
+import time
+
+
+class BufferedLogWriter:
+    """!
+    Appends rows to a CSV log file, in batches.
+    @param filename: Path of the log file.
+    @param columns: Names of the columns, written as the header of a new log file.
+    @param max_buffered: Number of rows buffered before they are written out.
+    @param flush_interval: Maximum time (s) a row is buffered before it is written out.
+    """
+
+    filename: str = None
+    columns: list = None
+    max_buffered: int = 32
+    flush_interval: float = 60.0
+
+    def __init__(self, filename, columns, max_buffered=32, flush_interval=60.0):
+        """!
+        Standard initialization. Opens the log file, and writes the header if the file is new.
+        @param filename: Path of the log file.
+        @param columns: Names of the columns.
+        @param max_buffered: Number of rows buffered before they are written out.
+        @param flush_interval: Maximum time (s) a row is buffered before it is written out.
+        """
+
+        self.filename = filename
+        self.columns = columns
+        self.max_buffered = max_buffered
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._oldest = None
+
+        new_file = not os.path.exists(filename) or not os.path.getsize(filename)
+        self._file = open(filename, 'a')
+        if new_file:
+            self._file.write(",".join(columns) + "\n")
+            self._file.flush()
+
+    def write(self, row):
+        """!
+        Buffer a row, writing out the buffer if it is full or has been held for long enough.
+        @param row: Sequence holding the value of each column. None is logged as an empty field.
+        """
+
+        if not self._rows:
+            self._oldest = time.monotonic()
+        self._rows.append(",".join("" if value is None else str(value) for value in row))
+        if len(self._rows) >= self.max_buffered:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """!
+        Write out the buffered rows if the oldest one has been held for flush_interval.
+        Returns the time (s) until the buffer is next due to be written out, or None if nothing is buffered.
+        """
+
+        if not self._rows:
+            return None
+        remaining = self._oldest + self.flush_interval - time.monotonic()
+        if remaining <= 0:
+            self.flush()
+            return None
+        return remaining
+
+    def flush(self):
+        """!
+        Write out all buffered rows.
+        """
+
+        if self._rows:
+            self._file.write("\n".join(self._rows) + "\n")
+            self._file.flush()
+            self._rows = []
+
+    def close(self):
+        """!
+        Write out all buffered rows, and close the log file.
+        """
+
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+def unit_test():
+    filename = "./logs/test_log_writer.csv"
+    writer = BufferedLogWriter(filename, ['timestamp', 'temperature', 'gas'], max_buffered=3)
+    writer.write([1, 21.5, 1000])
+    writer.write([2, None, 1001])
+    assert os.path.getsize(filename) == len("timestamp,temperature,gas\n")
+    writer.write([3, 22.0, 1002])
+    writer.write([4, 22.5, 1003])
+    writer.close()
+    with open(filename) as f:
+        assert f.read() == "timestamp,temperature,gas\n1,21.5,1000\n2,,1001\n3,22.0,1002\n4,22.5,1003\n"
+    os.remove(filename)
+
+    # Buffered rows are written out once they are due, even if no more rows are written
+    writer = BufferedLogWriter(filename, ['timestamp', 'value'], flush_interval=0.05)
+    writer.write([1, 40])
+    assert 0 < writer.flush_if_due() <= 0.05
+    time.sleep(0.06)
+    assert writer.flush_if_due() is None
+    with open(filename) as f:
+        assert f.read() == "timestamp,value\n1,40\n"
+    writer.close()
+    os.remove(filename)
+
+
+if __name__ == "__main__":
+    unit_test()
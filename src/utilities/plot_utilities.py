@@ -139,7 +139,37 @@ def extract_data_from_log(data, pattern):
         matches.append(re.match(pattern, line))
     return matches
 
-def generate_plots(root="./logs/", soil_sensor_log="soil_moisture_sensor_1.txt", environment_sensor_log="environment_sensor.txt"):
+def read_sensor_log(filename):
+    """!
+    Reads a sensor log file (CSV, see log_writer_utilities) into a data frame with one column per field,
+    indexed by the (local) time each reading was acquired.
+
+    @param filename: Path of the log file.
+    """
+    df = pd.read_csv(filename)
+    timestamps = pd.to_datetime(df.pop('timestamp'), unit='ns', utc=True)
+    df.index = timestamps.dt.tz_convert(datetime.now().astimezone().tzinfo).dt.tz_localize(None)
+    return df
+
+def generate_plots(root="./logs/", soil_sensor_log="soil_moisture_sensor_1.csv", environment_sensor_log="environment_sensor.csv"):
+    """!
+    Generates all plots from the sensor log files.
+    Logs written as text by older versions (.txt) are still parsed with regexes.
+
+    @param root: Folder holding the log files.
+    @param soil_sensor_log: Name of the soil moisture sensor log file.
+    @param environment_sensor_log: Name of the environment sensor log file.
+    """
+    if soil_sensor_log.endswith(".csv") and environment_sensor_log.endswith(".csv"):
+        soil_df = read_sensor_log(root+soil_sensor_log)
+        environment_df = read_sensor_log(root+environment_sensor_log)
+        environment_dict = dict()
+        environment_dict['Temperature'] = environment_df['temperature'].dropna().to_dict()
+        environment_dict['VOC'] = environment_df['gas'].dropna().to_dict()
+        environment_dict['Humidity'] = environment_df['humidity'].dropna().to_dict()
+        plot_all(soil_df['value'].dropna().to_dict(), environment_dict)
+        return
+
     # Plot soil moisture data
     with open(root+soil_sensor_log, "r") as myfile:
         data = myfile.readlines()
@@ -177,19 +207,90 @@ def generate_plots(root="./logs/", soil_sensor_log="soil_moisture_sensor_1.txt",
     df.reset_index(inplace=True)
     boxplot_environment(df)
 
+def series_to_dict(timestamps, values):
+    """!
+    Converts the (timestamps, values) arrays of a sensor field into a dictionary of {datetime: reading},
+    which is the form that the plotting functions take.
+
+    @param timestamps: Array of epoch timestamps (ns).
+    @param values: Array of readings.
+    """
+    return {datetime.fromtimestamp(timestamp/1e9): float(value) for timestamp, value in zip(timestamps, values)}
+
+def plot_all(soil_dict, environment_dict):
+    """!
+    Generates all plots from readings that have already been loaded.
+
+    @param soil_dict: Dictionary of {datetime: soil moisture percentage}.
+    @param environment_dict: Dictionary with 'Temperature', 'VOC' and 'Humidity' entries, each a dictionary of {datetime: reading}.
+    """
+    # Plot soil moisture data
+    plot_soil_moisture(soil_dict, True)
+    plot_soil_moisture(soil_dict, False)
+
+    # Plot temperature data
+    plot_temperature(environment_dict['Temperature'], True)
+    plot_temperature(environment_dict['Temperature'], False)
+
+    # Plot environment sensor data
+    df = pd.DataFrame.from_dict(environment_dict, orient='columns')
+    df.reset_index(inplace=True)
+    boxplot_environment(df)
+
+def generate_plots_from_series(series):
+    """!
+    Generates the same plots as generate_plots, from the sensor history sent by the control engine
+    (see ControlEngine.send_plot_data) instead of parsing the readings back out of the log files.
+
+    @param series: Dictionary with 'moisture', 'temperature', 'gas' and 'humidity' entries, each a (timestamps, values) tuple.
+    """
+    environment_dict = dict()
+    environment_dict['Temperature'] = series_to_dict(*series['temperature'])
+    environment_dict['VOC'] = series_to_dict(*series['gas'])
+    environment_dict['Humidity'] = series_to_dict(*series['humidity'])
+    plot_all(series_to_dict(*series['moisture']), environment_dict)
+
+def generate_plots_from_sqlite(filename="./database/master.sqlite", soil_sensor="soil_moisture_sensor_1", environment_sensor="environment_sensor"):
+    """!
+    Generates the same plots as generate_plots, but queries the readings from the SQLite database
+    instead of parsing them back out of the log files.
+
+    @param filename: Path of the SQLite database.
+    @param soil_sensor: Name of the soil moisture sensor to plot.
+    @param environment_sensor: Name of the environment sensor to plot.
+    """
+    from src.utilities.sqlite_utilities import SQLiteStorage
+
+    def query(sensor_name, field):
+        rows = storage.query_history(sensor_name, field)
+        return {datetime.fromtimestamp(timestamp/1e9): value for timestamp, value in rows}
+
+    storage = SQLiteStorage(filename)
+    environment_dict = dict()
+    environment_dict['Temperature'] = query(environment_sensor, 'temperature')
+    environment_dict['VOC'] = query(environment_sensor, 'gas')
+    environment_dict['Humidity'] = query(environment_sensor, 'humidity')
+    soil_dict = query(soil_sensor, 'value')
+    storage.close()
+    plot_all(soil_dict, environment_dict)
+
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-r', '--root', type=str, default="", help='Root filepath of the log data')
-    parser.add_argument('-s', '--soil', type=str, default="soil_moisture_sensor_1.txt", help='Name of soil moisture sensor log file')
-    parser.add_argument('-e', '--environment', type=str, default="environment_sensor.txt", help='Name of the envrionment sensor log file')
+    parser.add_argument('-s', '--soil', type=str, default="soil_moisture_sensor_1.csv", help='Name of soil moisture sensor log file')
+    parser.add_argument('-e', '--environment', type=str, default="environment_sensor.csv", help='Name of the envrionment sensor log file')
+    parser.add_argument('-q', '--sqlite', type=str, default="", help='Path of an SQLite database to plot from, instead of the log files')
     args = parser.parse_args()
 
-    if args.root:
-        root_folder = "./logs/"+args.root+"/"
+    if args.sqlite:
+        generate_plots_from_sqlite(args.sqlite)
     else:
-        root_folder = "./logs/"
+        if args.root:
+            root_folder = "./logs/"+args.root+"/"
+        else:
+            root_folder = "./logs/"
 
-    generate_plots(root_folder, args.soil, args.environment)
+        generate_plots(root_folder, args.soil, args.environment)
 
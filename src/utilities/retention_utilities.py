@@ -0,0 +1,140 @@
+"""!
+Contains the retention policy that keeps the sensor history bounded.
+
+Raw readings are only kept for a limited window (e.g, 48 hours). Once readings fall out of
+that window, they are rolled up into 1-minute min/mean/max aggregates and the raw readings
+are discarded. Once the 1-minute aggregates fall out of their own window, they are rolled up
+again into 1-hour aggregates. This way, memory and disk usage stay bounded for the life of a
+grow, and long-range plots read a few pre-aggregated points instead of millions of readings.
+"""
+
+
+import math
+import time
+import numpy as np
+from src.utilities.timeseries_utilities import NANOSECONDS_PER_SECOND
+
+
+MINUTE = 60
+HOUR = 3600
+
+
+def aggregate(timestamps, minimum, mean, maximum, count, resolution):
+    """!
+    Aggregates time-ordered readings (or finer aggregates) into buckets of a coarser resolution.
+    Raw readings are passed in as aggregates of a single reading each: minimum = mean = maximum, count = 1.
+    Returns the (timestamps, minimum, mean, maximum, count) arrays of the buckets.
+
+    @param timestamps: Array of epoch timestamps (ns), sorted
+    @param minimum: Array of the lowest reading of each entry
+    @param mean: Array of the mean reading of each entry
+    @param maximum: Array of the highest reading of each entry
+    @param count: Array of the number of readings in each entry
+    @param resolution: Length of each bucket in seconds
+    """
+
+    width = resolution * NANOSECONDS_PER_SECOND
+    buckets = timestamps - (timestamps % width)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    bucket_count = np.add.reduceat(count, starts)
+    bucket_mean = np.add.reduceat(mean * count, starts) / bucket_count
+    return (buckets[starts], np.minimum.reduceat(minimum, starts), bucket_mean,
+            np.maximum.reduceat(maximum, starts), bucket_count)
+
+
+class RetentionPolicy:
+    """!
+    Rolls up the sensor history into coarser aggregates as it ages.
+    @param raw_window: Time (s) that raw readings are kept for before being rolled up into 1-minute aggregates.
+    @param minute_window: Time (s) that 1-minute aggregates are kept for before being rolled up into 1-hour aggregates.
+    """
+
+    raw_window: int = 48 * HOUR
+    minute_window: int = 30 * 24 * HOUR
+
+    def __init__(self, raw_window=48 * HOUR, minute_window=30 * 24 * HOUR):
+        """!
+        Standard initialization.
+        @param raw_window: Time (s) that raw readings are kept for.
+        @param minute_window: Time (s) that 1-minute aggregates are kept for.
+        """
+
+        self.raw_window = raw_window
+        self.minute_window = minute_window
+
+    def raw_capacity(self, polling_interval):
+        """!
+        Returns the number of raw readings of a sensor field that build up before they are rolled up:
+        the raw window, plus the hour between two roll-ups (and the minute the cutoff is rounded down by).
+        @param polling_interval: Shortest time (s) between two readings of the sensor field
+        """
+        return math.ceil((self.raw_window + HOUR + MINUTE) / polling_interval)
+
+    def cutoffs(self, now=None):
+        """!
+        Returns the (raw, minute) cutoff epoch timestamps (ns). Anything older than a cutoff is due to be rolled up.
+        Cutoffs are aligned to bucket boundaries, so a bucket is never split between two passes.
+        @param now: Epoch timestamp (ns) to apply the policy at. Defaults to now.
+        """
+
+        if now is None:
+            now = time.time_ns()
+        raw_cutoff = now - self.raw_window * NANOSECONDS_PER_SECOND
+        minute_cutoff = now - self.minute_window * NANOSECONDS_PER_SECOND
+        raw_cutoff -= raw_cutoff % (MINUTE * NANOSECONDS_PER_SECOND)
+        minute_cutoff -= minute_cutoff % (HOUR * NANOSECONDS_PER_SECOND)
+        return raw_cutoff, minute_cutoff
+
+    def apply(self, history, now=None):
+        """!
+        Rolls up everything in the history that has aged out of its window.
+        Returns the (raw, minute) cutoffs that were applied.
+
+        @param history: The sensor history (TimeSeriesStore)
+        @param now: Epoch timestamp (ns) to apply the policy at. Defaults to now.
+        """
+
+        raw_cutoff, minute_cutoff = self.cutoffs(now)
+        for sensor_name, fields in history.series.items():
+            for field, buffer in fields.items():
+                timestamps, values = buffer.between(np.iinfo(np.int64).min, raw_cutoff)
+                if len(timestamps):
+                    rollup = history.rollup(MINUTE, sensor_name, field)
+                    for bucket in zip(*aggregate(timestamps, values, values, values, np.ones(len(values), dtype=np.int64), MINUTE)):
+                        rollup.append(*bucket)
+                    buffer.discard_before(raw_cutoff)
+
+        for sensor_name, fields in history.rollups.get(MINUTE, {}).items():
+            for field, buffer in fields.items():
+                columns = buffer.aggregates_between(np.iinfo(np.int64).min, minute_cutoff)
+                if len(columns[0]):
+                    rollup = history.rollup(HOUR, sensor_name, field)
+                    for bucket in zip(*aggregate(*columns, HOUR)):
+                        rollup.append(*bucket)
+                    buffer.discard_before(minute_cutoff)
+        return raw_cutoff, minute_cutoff
+
+
+def unit_test():
+    from src.utilities.timeseries_utilities import TimeSeriesStore
+
+    start = 1599998400 * NANOSECONDS_PER_SECOND  # On the hour
+    history = TimeSeriesStore(capacity=10000)
+    for k in range(3 * HOUR // 10):  # A reading every 10 seconds for 3 hours
+        history.append("soil_moisture_sensor_1", start + k * 10 * NANOSECONDS_PER_SECOND, float(k % 6))
+
+    policy = RetentionPolicy(raw_window=HOUR, minute_window=2 * HOUR)
+    policy.apply(history, now=start + 3 * HOUR * NANOSECONDS_PER_SECOND)
+
+    raw = history.series["soil_moisture_sensor_1"]["value"]
+    minutes = history.rollups[MINUTE]["soil_moisture_sensor_1"]["value"]
+    hours = history.rollups[HOUR]["soil_moisture_sensor_1"]["value"]
+    assert len(raw) == HOUR // 10
+    assert len(minutes) == 60 and len(hours) == 1
+    assert [float(column[0]) for column in hours.aggregates_between(0, start + HOUR * NANOSECONDS_PER_SECOND)[1:]] == [0.0, 2.5, 5.0, 360]
+    assert len(history.combined("soil_moisture_sensor_1", "value")[0]) == 1 + 60 + HOUR // 10
+    assert RetentionPolicy(raw_window=48 * HOUR).raw_capacity(2) == 88230
+
+
+if __name__ == "__main__":
+    unit_test()
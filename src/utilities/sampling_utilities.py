@@ -0,0 +1,86 @@
+"""!
+Contains the functions used by sensors for reducing a burst of samples down to a single reading.
+
+Rather than relying on a single (noisy) sample, a sensor can take several samples in quick
+succession and report one robust aggregate of them, along with how spread out they were.
+A sensor scanning several probes in one cycle reports all of their readings as one record.
+"""
+
+
+import statistics
+
+
+def aggregate_samples(samples, method="median", trim=0.2):
+    """!
+    Reduces a burst of samples to (aggregate, spread).
+    - "median": The median, with the median absolute deviation as the spread.
+    - "trimmed_mean": The mean of the samples left after discarding the lowest and highest fraction (trim) of them,
+    with the standard deviation of those samples as the spread.
+    A single sample is its own aggregate, with a spread of 0.
+
+    @param samples: List of samples
+    @param method: Either "median" or "trimmed_mean"
+    @param trim: Fraction of the samples discarded from each end by "trimmed_mean"
+    """
+
+    if len(samples) == 1:
+        return samples[0], 0.0
+    if method == "median":
+        median = statistics.median(samples)
+        return median, statistics.median([abs(sample - median) for sample in samples])
+    if method == "trimmed_mean":
+        cut = int(len(samples) * trim)
+        kept = sorted(samples)[cut:len(samples) - cut]
+        return statistics.mean(kept), (statistics.pstdev(kept) if len(kept) > 1 else 0.0)
+    raise ValueError("Unknown aggregation method: " + str(method))
+
+
+def combine_probes(readings):
+    """!
+    Combines the readings of several probes taken in the same cycle into a single record.
+    Each probe's reading is stored as "value_<channel>" and "spread_<channel>". The record's own "value" and "spread"
+    are the mean and standard deviation across the probes, or the probe's own reading if there is only one.
+
+    @param readings: Dictionary mapping channel -> (value, spread)
+    """
+
+    if len(readings) == 1:
+        value, spread = list(readings.values())[0]
+        return {'value': value, 'spread': spread}
+    record = {}
+    for channel, (value, spread) in readings.items():
+        record['value_' + str(channel)] = value
+        record['spread_' + str(channel)] = spread
+    values = [value for value, _ in readings.values()]
+    record['value'] = round(statistics.mean(values), 2)
+    record['spread'] = round(statistics.pstdev(values), 3)
+    return record
+
+
+def probe_fields(channels):
+    """!
+    Returns the names of the fields of a record combining the readings of probes on the given channels.
+    @param channels: List of channels
+    """
+
+    if len(channels) == 1:
+        return ['value', 'spread']
+    return ['value', 'spread'] + [field + "_" + str(channel) for channel in channels for field in ['value', 'spread']]
+
+
+def unit_test():
+    samples = [1.0, 1.1, 0.9, 1.0, 5.0]  # One outlier
+    median, spread = aggregate_samples(samples)
+    assert median == 1.0 and abs(spread - 0.1) < 1e-9
+    mean, spread = aggregate_samples(samples, "trimmed_mean")
+    assert abs(mean - 1.0333333) < 1e-6 and spread < 0.1
+    assert aggregate_samples([2.5]) == (2.5, 0.0)
+
+    record = combine_probes({0: (40.0, 0.5), 2: (60.0, 1.5)})
+    assert record == {'value_0': 40.0, 'spread_0': 0.5, 'value_2': 60.0, 'spread_2': 1.5, 'value': 50.0, 'spread': 10.0}
+    assert sorted(probe_fields([0, 2])) == sorted(record)
+    assert combine_probes({1: (40.0, 0.5)}) == {'value': 40.0, 'spread': 0.5}
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,125 @@
+"""!
+Contains the sensor hub, which runs several sensors in a single worker process.
+
+Normally, every sensor runs in its own worker process (see Sensor.run). Each of those processes
+holds its own interpreter and its own copy of the I2C libraries, which adds up once a box has
+more than a couple of sensors. In hub mode, one process runs an asyncio event loop with one task per
+sensor instead. Each task keeps the sensor's own drift-free schedule (same deadlines and phase offsets
+as Sensor.run), and hands the blocking poll (I2C transactions, settling delays) to a small thread pool,
+so a slow sensor never holds up the others.
+
+Sensors report through their own queue exactly as they would in their own process,
+so main does not need to know which mode the sensors run in.
+
+When main boosts a sensor's adaptive policy, it sets the policy's wakeup event. A daemon thread per adaptive
+sensor waits on that event and passes it on to the sensor's task, so the task sleeps until either its next
+poll is due or it is boosted, and never wakes up just to check.
+"""
+
+
+import asyncio
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.utilities.logger_utilities import get_logger
+from src.utilities.sensor_template import exit_on_signal
+
+
+class SensorHub:
+    """!
+    Runs a group of sensors as tasks of one event loop, in one process.
+    @param sensors: List of Sensor instances to run.
+    @param max_workers: Number of threads available for running blocking polls.
+    """
+
+    sensors: list = None
+    max_workers: int = 2
+
+    def __init__(self, sensors, max_workers=2):
+        """!
+        Standard initialization.
+        @param sensors: List of Sensor instances to run.
+        @param max_workers: Number of threads available for running blocking polls.
+        """
+
+        self.sensors = sensors
+        self.max_workers = max_workers
+
+    def run(self):
+        """!
+        This is the main loop of the hub process. Runs until the process is terminated.
+        """
+
+        signal.signal(signal.SIGTERM, exit_on_signal)
+        try:
+            asyncio.run(self._run_all())
+        finally:
+            for sensor in self.sensors:
+                sensor.close_log()
+
+    async def _run_all(self):
+        """!
+        Starts one task per sensor, and waits on all of them.
+        """
+
+        self.logger = get_logger("sensor_hub")
+        self.logger.debug("Running " + str(len(self.sensors)) + " sensors in one process.")
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sensor_poll") as executor:
+            await asyncio.gather(*[self._run_sensor(sensor, executor) for sensor in self.sensors])
+
+    async def _run_sensor(self, sensor, executor):
+        """!
+        Polls a single sensor on its schedule, sleeping on the event loop until each poll is due,
+        and writing out its buffered log rows when they are due.
+        An exception raised by a poll is logged, and does not stop the other sensors.
+        @param sensor: The Sensor to poll
+        @param executor: Thread pool that runs the (blocking) polls
+        """
+
+        loop = asyncio.get_running_loop()
+        sensor.logger = get_logger(sensor.name)
+        if sensor.adaptive is not None:
+            boosted = asyncio.Event()
+            threading.Thread(target=self._forward_wakeups, args=(sensor, loop, boosted), name=sensor.name + "_wakeup",
+                             daemon=True).start()
+        deadline = sensor.next_deadline(time.monotonic())
+        while True:
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                flush_delay = sensor.flush_log_if_due()
+                if flush_delay is not None:
+                    delay = min(delay, flush_delay)
+                if sensor.adaptive is None:
+                    await asyncio.sleep(delay)
+                else:
+                    try:
+                        await asyncio.wait_for(boosted.wait(), delay)
+                    except asyncio.TimeoutError:
+                        continue
+                    # Boosted, so move up to the next deadline of the (now faster) interval
+                    boosted.clear()
+                    deadline = min(deadline, sensor.next_deadline(time.monotonic()))
+                continue
+            try:
+                await loop.run_in_executor(executor, sensor.timed_poll)
+            except Exception as err:
+                sensor.logger.error("Poll failed: " + str(err))
+            deadline = sensor.advance_deadline(deadline, time.monotonic())
+
+    def _forward_wakeups(self, sensor, loop, boosted):
+        """!
+        Passes every wakeup of a sensor's adaptive policy on to its task, as the asyncio event "boosted".
+        Runs in its own daemon thread, for as long as the event loop does.
+        @param sensor: The Sensor, with an adaptive policy
+        @param loop: The event loop running the sensor's task
+        @param boosted: asyncio.Event the task waits on
+        """
+
+        while True:
+            sensor.adaptive.wakeup.wait()
+            sensor.adaptive.wakeup.clear()
+            try:
+                loop.call_soon_threadsafe(boosted.set)
+            except RuntimeError:  # The event loop is closed
+                return
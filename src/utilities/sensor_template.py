@@ -7,13 +7,15 @@ until told to stop, it is a worker process.
 """
 
 import time
+import signal
+import sys
 from abc import ABC, abstractmethod
 from multiprocessing import Queue
-from datetime import datetime, timedelta
 from src.utilities.logger_utilities import get_logger
 from src.utilities.file_utilities import generate_unique_filename
+from src.utilities.log_writer_utilities import BufferedLogWriter
+from src.utilities.adaptive_utilities import AdaptivePolling
 import atexit
-import os
 
 class Sensor(ABC):
     """!
@@ -22,52 +24,215 @@ class Sensor(ABC):
     @param _previous_val: The previous value that the sensor read.
     @param _current_val: The current value that the sensor just read.
     @param queue: The queue between the main thread and the sensor process.
+    @param ring: Optional shared memory ring buffer that readings are relayed through instead of the queue.
+    @param sensor_id: Number identifying the sensor in the records of the ring buffer.
+    @param fields: Names of the fields the sensor reports, in the order they are stored in ring buffer records.
+    Sensors that report a single number use the field "value".
     @param polling_interval: The time between sensor measurements in seconds.
+    @param phase_offset: Time (s) by which the sensor's polls are shifted within the polling interval.
+    @param adaptive: Optional adaptive polling policy. If set, it picks the polling interval instead of polling_interval.
+    @param missed_deadlines: Number of polls that were skipped because a previous poll overran its deadline.
     @param log_file_name: The unique filename for logging the sensor's readings.
+    @param log_fields: Names of the fields that are logged for each reading. Defaults to the fields that are reported.
+    @param log_writer: Buffered writer of the sensor's log file. Opened by the first reading that is logged.
+    @param last_timestamp: Acquisition timestamp (epoch, ns) of the previous reading.
+    @param sequence: Sequence number of the next reading. Increases by one with every reading the sensor relays,
+    so main can tell if readings went missing or arrived twice.
     """
 
     name: str = "Default"
     _previous_val: int = None
     _current_val: int = None
     queue: Queue = None
+    ring = None
+    sensor_id: int = 0
+    fields: list = ['value']
     polling_interval: int = None
+    phase_offset: float = 0
+    adaptive: AdaptivePolling = None
+    missed_deadlines: int = 0
     log_file_name: str = None
+    log_fields: list = None
+    log_writer: BufferedLogWriter = None
+    last_timestamp: int = 0
+    sequence: int = 0
 
-    def __init__(self, name="default", queue=None, polling_interval=2):
+    def __init__(self, name="default", queue=None, polling_interval=2, phase_offset=0):
         """!
         Standard initialization.
         @param name: The name of the sensor. Must be unique.
         @param queue: The queue between the main thread and the sensor process.
         @param polling_interval: The time between sensor measurements in seconds.
+        @param phase_offset: Time (s) by which the sensor's polls are shifted within the polling interval.
         """
 
         self.name = name
         self.queue = queue
         self.polling_interval = polling_interval
+        self.phase_offset = phase_offset
+        self.missed_deadlines = 0
 
         # Generate unique log file name
-        self.log_file_name = generate_unique_filename(self.name, 'txt')
+        self.log_file_name = generate_unique_filename(self.name, 'csv')
+        self.log_writer = None
+
+        self.last_timestamp = 0
+        self.sequence = 0
+        self._poll_started = None
 
         # Register shutdown event
         atexit.register(self.shutdown)
+        atexit.register(self.close_log)
 
     def run(self):
         """!
         This is the main loop for any sensor.
         Based on the polling_interval, it will read data and report it by placing it into the queue.
+
+        Polls are due on absolute deadlines of the monotonic clock (every polling_interval, shifted by the phase_offset),
+        and the process sleeps until the next one is due. Since the next deadline does not depend on when the previous
+        poll finished, the polling period does not drift. If a poll overruns one or more deadlines, the missed polls
+        are reported and skipped, rather than run back to back.
+        With an adaptive policy, the interval changes with the readings, and main can wake the sensor up early.
+        The sleep also ends when buffered log rows are due to be written out (see flush_log_if_due).
         """
 
-        current_time = datetime.now()
-        next_poll_time = current_time + timedelta(seconds=self.polling_interval)
-        while True:
-            if datetime.now() > next_poll_time:
-                self.poll()
-                current_time = datetime.now()
-                next_poll_time = current_time + timedelta(seconds=self.polling_interval)
-                # print("Next poll scheduled for:", next_poll_time)
-            else:
-                time.sleep(0.1)  # Quick delay to eliminate run-away memory consumption
-                pass
+        self.logger = get_logger(self.name)
+        signal.signal(signal.SIGTERM, exit_on_signal)
+        deadline = self.next_deadline(time.monotonic())
+        try:
+            while True:
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    flush_delay = self.flush_log_if_due()
+                    if self.wait(delay if flush_delay is None else min(delay, flush_delay)):
+                        # Woken up to speed up, so move up to the next deadline of the (now faster) interval
+                        deadline = min(deadline, self.next_deadline(time.monotonic()))
+                    continue
+                self.timed_poll()
+                deadline = self.advance_deadline(deadline, time.monotonic())
+        finally:
+            self.close_log()
+
+    def timed_poll(self):
+        """!
+        Runs a poll, noting when it started so that its reading can carry how long the poll took.
+        """
+        self._poll_started = time.monotonic_ns()
+        self.poll()
+
+    def wait(self, delay):
+        """!
+        Sleeps for a delay, or until main boosts the adaptive policy. Returns True if woken up early.
+        @param delay: Time (s) to sleep for
+        """
+
+        if self.adaptive is None:
+            time.sleep(delay)
+            return False
+        woken = self.adaptive.wakeup.wait(delay)
+        if woken:
+            self.adaptive.wakeup.clear()
+        return woken
+
+    def interval(self):
+        """!
+        Returns the polling interval (s) that applies right now.
+        """
+        if self.adaptive is None:
+            return self.polling_interval
+        return self.adaptive.interval()
+
+    def advance_deadline(self, deadline, now):
+        """!
+        Returns the deadline of the next poll, once the poll that was due at a deadline has run.
+        Deadlines that have already passed by the time the poll finished are reported and skipped.
+        @param deadline: Monotonic time (s) the poll that just ran was due at
+        @param now: Monotonic time (s) the poll finished at
+        """
+
+        interval = self.interval()
+        deadline += interval
+        lateness = now - deadline
+        if lateness > 0:
+            missed = int(lateness // interval) + 1
+            self.missed_deadlines += missed
+            deadline += missed * interval
+            self.logger.warning("Poll overran, skipped " + str(missed) + " poll(s). "
+                                + str(self.missed_deadlines) + " missed in total.")
+        return deadline
+
+    def next_deadline(self, now):
+        """!
+        Returns the first poll deadline after a point in time, on the monotonic clock.
+        Deadlines fall on multiples of the polling interval, shifted by the phase_offset. Since the monotonic clock is
+        shared by all processes, sensors with different phase offsets never poll at the same time.
+        @param now: Monotonic time (s)
+        """
+        interval = self.interval()
+        return now + interval - ((now - self.phase_offset) % interval)
+
+    def report(self, timestamp, data):
+        """!
+        Relays a reading to the main thread: as a record in the shared memory ring buffer if the sensor has one
+        (which rings the ring buffer's doorbell if main is waiting for it), else as
+        (acquisition timestamp, sequence number, poll duration, data) through the queue.
+        The poll duration is the time (s) from the start of the poll to the reading being relayed.
+        @param timestamp: Acquisition timestamp of the reading (see timestamp)
+        @param data: Either a single number, or a dictionary mapping field name -> number
+        """
+
+        if self.adaptive is not None:
+            self.adaptive.observe(timestamp, data)
+        duration = (time.monotonic_ns() - self._poll_started) / 1e9 if self._poll_started is not None else 0.0
+        if self.ring is None:
+            self.queue.put((timestamp, self.sequence, duration, data))
+        else:
+            if not isinstance(data, dict):
+                data = {'value': data}
+            self.ring.put(timestamp, self.sensor_id, [data.get(field) for field in self.fields], self.sequence, duration)
+        self.sequence += 1
+
+    def log(self, timestamp, data):
+        """!
+        Logs a reading to the sensor's log file (buffered, see BufferedLogWriter).
+        @param timestamp: Acquisition timestamp of the reading (see timestamp)
+        @param data: Either a single number, or a dictionary mapping field name -> number
+        """
+
+        fields = self.log_fields or self.fields
+        if self.log_writer is None:
+            self.log_writer = BufferedLogWriter(self.log_file_name, ['timestamp'] + fields)
+        if not isinstance(data, dict):
+            data = {'value': data}
+        self.log_writer.write([timestamp] + [data.get(field) for field in fields])
+
+    def flush_log_if_due(self):
+        """!
+        Writes out the buffered readings if they have been held for long enough (see BufferedLogWriter.flush_if_due).
+        Returns the time (s) until they are next due, or None if nothing is buffered.
+        """
+        if self.log_writer is None:
+            return None
+        return self.log_writer.flush_if_due()
+
+    def close_log(self):
+        """!
+        Writes out any buffered readings, and closes the sensor's log file.
+        """
+        if self.log_writer is not None:
+            self.log_writer.close()
+
+    def timestamp(self):
+        """!
+        Returns the acquisition timestamp for a reading that was just taken: epoch time in nanoseconds.
+        Timestamps follow the wall clock, so they stay on the epoch when the system clock is stepped (e.g, by NTP),
+        but are strictly increasing, so no two readings of a sensor ever share a timestamp.
+        """
+
+        timestamp = max(time.time_ns(), self.last_timestamp + 1)
+        self.last_timestamp = timestamp
+        return timestamp
 
     @abstractmethod
     def shutdown(self):
@@ -76,7 +241,41 @@ class Sensor(ABC):
     @abstractmethod
     def poll(self):
         """!
-        This method captures sensor data.
+        This method captures sensor data, and relays it to the main thread (see report).
         Since it is an abstract method, it MUST be implemented by all derived classes.
         """
-        pass
\ No newline at end of file
+        pass
+
+
+def exit_on_signal(signum, frame):
+    """!
+    Signal handler that exits the sensor process cleanly (e.g, when main terminates it),
+    so that buffered readings are written out on the way.
+    """
+    sys.exit(0)
+
+
+def unit_test():
+    from unittest import mock
+
+    class FakeSensor(Sensor):
+        def shutdown(self):
+            pass
+
+        def poll(self):
+            pass
+
+    sensor = FakeSensor(name="test_sensor_template", queue=Queue())
+    wall = [1000]
+    with mock.patch('time.time_ns', lambda: wall[0]):
+        assert sensor.timestamp() == 1000
+        wall[0] = 5000  # Stepped forward (e.g, NTP syncing after boot): the stamps follow it
+        assert sensor.timestamp() == 5000
+        wall[0] = 2000  # Stepped back: the stamps still never go backwards
+        assert sensor.timestamp() == 5001
+        wall[0] = 6000
+        assert sensor.timestamp() == 6000
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,246 @@
+"""!
+Contains the shared memory ring buffer used for relaying sensor readings to the main process.
+
+Relaying a reading through a multiprocessing Queue means pickling it, handing it to a feeder thread,
+writing it to a pipe, and unpickling it on the other side. Instead, a sensor can write its readings as
+fixed-layout binary records straight into a ring buffer in shared memory, which main reads in place.
+
+Each ring buffer has exactly one producer (the sensor) and one consumer (main):
+- The producer writes a record into the slot at "head", and only then advances "head".
+- The consumer reads everything from "tail" up to "head", and only then advances "tail".
+Each side only ever writes its own counter, and the counters live on separate cache lines.
+If the buffer is full, the producer drops the record (and counts it) rather than overwrite unread records.
+The counters (and the doorbell's "armed" flag) are only ever written or read together under a lock, which is
+held for a few loads and stores. Taking and releasing it are full memory barriers, so neither the CPU (e.g, ARM,
+which reorders stores) nor the other side can see the counters out of step with the records they cover.
+
+So the consumer can sleep until there is something to read, the ring buffer has a doorbell: one end of a pipe
+that the consumer can wait on (see doorbell). Ringing it costs one byte written to the pipe, and it is only rung
+when the consumer is waiting for it: the consumer arms the doorbell each time it starts reading (see drain), and the
+producer only rings it (and disarms it) if it is armed, once the record is published. Arming and reading "head" happen
+under the same lock as publishing and checking "armed", so a record is either seen by that drain, or rings the doorbell.
+So however many records the producer writes in the meantime, the consumer is woken up once, and nothing is pickled
+along the way.
+
+Layout of the shared memory block:
+[head (uint64), dropped (uint64), padding][tail (uint64), armed (uint64), padding][record 0][record 1]...
+Each record is: [timestamp (int64, epoch ns)][sensor id (int64)][sequence number (int64)][poll duration (float64, s)]
+[value (float64) for each field]
+Fields that are missing from a reading are stored as NaN.
+"""
+
+
+import numpy as np
+from multiprocessing import shared_memory, Pipe, Lock
+
+
+HEADER_SIZE = 128
+CONSUMER_OFFSET = 64
+
+
+def record_dtype(field_count):
+    """!
+    Returns the NumPy dtype of a record holding a given number of fields.
+    @param field_count: Number of values in each record
+    """
+    return np.dtype([('timestamp', '<i8'), ('sensor_id', '<i8'), ('sequence', '<i8'), ('duration', '<f8'),
+                     ('values', '<f8', (field_count,))])
+
+
+class SharedRingBuffer:
+    """!
+    Single-producer/single-consumer ring buffer of fixed-layout records in shared memory.
+    Creating one allocates a new shared memory block. Passing it to another process
+    (e.g, as an attribute of a Sensor) attaches that process to the same block.
+    @param capacity: Number of records the buffer can hold.
+    @param field_count: Number of values in each record.
+    @param memory: The shared memory block.
+    @param records: Structured array of the records, mapped onto the shared memory block.
+    @param doorbell: Connection that becomes readable when the producer rings the doorbell. Wait on it (e.g, with
+    multiprocessing.connection.wait) to sleep until there are records to read.
+    """
+
+    capacity: int = None
+    field_count: int = None
+    memory: shared_memory.SharedMemory = None
+    records: np.ndarray = None
+    doorbell = None
+
+    def __init__(self, capacity=1024, field_count=1, name=None, doorbell=None, lock=None):
+        """!
+        Standard initialization.
+        @param capacity: Number of records the buffer can hold.
+        @param field_count: Number of values in each record.
+        @param name: Name of an existing shared memory block to attach to. None creates a new block.
+        @param doorbell: (reader, writer) Connections of the doorbell of the existing block. None creates a new doorbell.
+        @param lock: Lock guarding the counters of the existing block. None creates a new lock.
+        """
+
+        self.capacity = capacity
+        self.field_count = field_count
+        dtype = record_dtype(field_count)
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity * dtype.itemsize)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+
+        self._producer = np.ndarray(2, dtype=np.uint64, buffer=self.memory.buf, offset=0)
+        self._consumer = np.ndarray(2, dtype=np.uint64, buffer=self.memory.buf, offset=CONSUMER_OFFSET)
+        self.records = np.ndarray(capacity, dtype=dtype, buffer=self.memory.buf, offset=HEADER_SIZE)
+        self.doorbell, self._bell = Pipe(duplex=False) if doorbell is None else doorbell
+        self._lock = Lock() if lock is None else lock
+        self._tail = 0  # The consumer's tail as last seen by the producer (it only ever moves forward)
+        if name is None:
+            self._producer[:] = 0
+            self._consumer[:] = [0, 1]  # Armed, so the first record wakes the consumer up
+
+    def __getstate__(self):
+        return {'capacity': self.capacity, 'field_count': self.field_count, 'name': self.memory.name,
+                'doorbell': (self.doorbell, self._bell), 'lock': self._lock}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        with self._lock:
+            return int(self._producer[0]) - int(self._consumer[0])
+
+    @property
+    def dropped(self):
+        """!
+        Number of records the producer had to drop because the buffer was full.
+        """
+        return int(self._producer[1])
+
+    def put(self, timestamp, sensor_id, values, sequence=0, duration=0.0):
+        """!
+        Write a record. Only ever call this from the producer.
+        Returns False if the buffer is full, in which case the record is dropped.
+        @param timestamp: Epoch timestamp of the reading, in nanoseconds
+        @param sensor_id: Number identifying the sensor
+        @param values: Sequence of the field values. Anything that is not a number is stored as NaN.
+        @param sequence: Sequence number of the reading
+        @param duration: Time (s) the poll that took the reading lasted
+        """
+
+        head = int(self._producer[0])
+        if head - self._tail >= self.capacity:
+            with self._lock:
+                self._tail = int(self._consumer[0])
+            if head - self._tail >= self.capacity:
+                self._producer[1] += 1
+                return False
+        index = head % self.capacity
+        self.records['timestamp'][index] = timestamp
+        self.records['sensor_id'][index] = sensor_id
+        self.records['sequence'][index] = sequence
+        self.records['duration'][index] = duration
+        self.records['values'][index] = [value if isinstance(value, (int, float)) and not isinstance(value, bool)
+                                         else np.nan for value in values]
+        with self._lock:
+            self._producer[0] = head + 1  # Publish the record
+            self._tail = int(self._consumer[0])
+            ring = bool(self._consumer[1])  # The consumer is waiting for the doorbell
+            if ring:
+                self._consumer[1] = 0
+        if ring:
+            self._bell.send_bytes(b"\x01")
+        return True
+
+    def drain(self):
+        """!
+        Generator that yields every record available, as at most two arrays of records (oldest first).
+        The arrays are views into the shared memory, so nothing is copied. Only call this from the consumer.
+        The records are released back to the producer once the generator is exhausted, so don't hold on to
+        the arrays after that.
+        The doorbell is silenced and armed again before reading, and "head" is read after arming it (under the lock),
+        so any record that is not read here rings the doorbell.
+        """
+
+        while self.doorbell.poll():
+            self.doorbell.recv_bytes()
+        with self._lock:
+            self._consumer[1] = 1
+            tail = int(self._consumer[0])
+            head = int(self._producer[0])
+        first, last = tail % self.capacity, tail % self.capacity + head - tail
+        if last <= self.capacity:
+            segments = [(first, last)]
+        else:
+            segments = [(first, self.capacity), (0, last - self.capacity)]
+        for first, last in segments:
+            if last > first:
+                yield self.records[first:last]
+        with self._lock:
+            self._consumer[0] = head
+
+    def close(self):
+        """!
+        Detach from the shared memory block.
+        """
+
+        self._producer = self._consumer = self.records = None
+        self.memory.close()
+        self.doorbell.close()
+        self._bell.close()
+
+    def unlink(self):
+        """!
+        Free the shared memory block. Only call this once, from the process that created it.
+        """
+        self.memory.unlink()
+
+
+def unit_test():
+    from multiprocessing import Process
+
+    ring = SharedRingBuffer(capacity=4, field_count=2)
+    assert not ring.doorbell.poll()
+    for k in range(5):
+        ring.put(k, 7, [float(k), None])
+    assert len(ring) == 4 and ring.dropped == 1
+    # The doorbell was rung once, for the first record
+    assert ring.doorbell.recv_bytes() == b"\x01" and not ring.doorbell.poll()
+    assert [list(records['timestamp']) for records in ring.drain()] == [[0, 1, 2, 3]]
+    assert np.isnan(ring.records['values'][0][1])
+    ring.put(4, 7, [4.0, 4.0], 4, 0.25)
+    ring.put(5, 7, [5.0, 5.0], 5, 0.5)
+    assert ring.doorbell.poll(0)  # Armed again by the previous drain
+    assert [(list(records['sequence']), list(records['duration'])) for records in ring.drain()] == [([4, 5], [0.25, 0.5])]
+
+    # A producer in another process, wrapping around the end of the buffer
+    def produce(producer_ring):
+        for timestamp in range(10, 13):
+            producer_ring.put(timestamp, 7, [float(timestamp), 1.0])
+
+    process = Process(target=produce, args=(ring,))
+    process.start()
+    assert ring.doorbell.poll(5)
+    process.join()
+    segments = [(list(records['timestamp']), records['values'][:, 0].tolist()) for records in ring.drain()]
+    assert segments == [([10, 11], [10.0, 11.0]), ([12], [12.0])]
+    assert len(ring) == 0
+
+    # Many records racing the consumer: every one arrives intact, and the doorbell is never missed
+    def produce_many(producer_ring):
+        for timestamp in range(20, 20020):
+            while not producer_ring.put(timestamp, 7, [float(timestamp), -float(timestamp)], timestamp):
+                pass
+
+    process = Process(target=produce_many, args=(ring,))
+    process.start()
+    received = []
+    while len(received) < 20000:
+        assert ring.doorbell.poll(5)
+        for records in ring.drain():
+            assert (records['values'][:, 0] == records['timestamp']).all()
+            assert (records['values'][:, 1] == -records['timestamp']).all()
+            received.extend(records['sequence'].tolist())
+    process.join()
+    assert received == list(range(20, 20020))
+    ring.close()
+    ring.unlink()
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,209 @@
+"""!
+Contains the optional SQLite storage engine.
+
+When enabled, every sensor reading, control element status change and manual override
+is stored in a local SQLite database, where it can be queried by sensor and time range
+(e.g, for plotting) without having to parse the text logs.
+Like the in-memory history, the readings table is kept bounded by rolling old readings up
+into 1-minute and 1-hour min/mean/max aggregates (see retention_utilities).
+
+Writing to SQLite means waiting on the disk, so none of it should be done by the main loop.
+The storage engine is a sink for the background flusher (see flusher_utilities): it is handed
+batches of records from the flusher's thread, and inserts each batch in a single transaction.
+"""
+
+
+import sqlite3
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (sensor TEXT NOT NULL, field TEXT NOT NULL, timestamp INTEGER NOT NULL, value REAL);
+CREATE INDEX IF NOT EXISTS readings_sensor_timestamp ON readings (sensor, timestamp);
+CREATE TABLE IF NOT EXISTS actuations (device TEXT NOT NULL, timestamp INTEGER NOT NULL, state TEXT);
+CREATE INDEX IF NOT EXISTS actuations_device_timestamp ON actuations (device, timestamp);
+CREATE TABLE IF NOT EXISTS overrides (timestamp INTEGER NOT NULL, command TEXT);
+CREATE INDEX IF NOT EXISTS overrides_timestamp ON overrides (timestamp);
+CREATE TABLE IF NOT EXISTS rollups (sensor TEXT NOT NULL, field TEXT NOT NULL, resolution INTEGER NOT NULL, timestamp INTEGER NOT NULL,
+                                    minimum REAL, mean REAL, maximum REAL, count INTEGER);
+CREATE INDEX IF NOT EXISTS rollups_sensor_timestamp ON rollups (sensor, resolution, timestamp);
+"""
+
+ROLLUP_READINGS = """
+INSERT INTO rollups (sensor, field, resolution, timestamp, minimum, mean, maximum, count)
+SELECT sensor, field, 60, (timestamp / 60000000000) * 60000000000, MIN(value), AVG(value), MAX(value), COUNT(value)
+FROM readings WHERE timestamp < ? GROUP BY sensor, field, timestamp / 60000000000
+"""
+
+ROLLUP_MINUTES = """
+INSERT INTO rollups (sensor, field, resolution, timestamp, minimum, mean, maximum, count)
+SELECT sensor, field, 3600, (timestamp / 3600000000000) * 3600000000000, MIN(minimum), SUM(mean * count) / SUM(count), MAX(maximum), SUM(count)
+FROM rollups WHERE resolution = 60 AND timestamp < ? GROUP BY sensor, field, timestamp / 3600000000000
+"""
+
+INSERTS = {
+    'readings': "INSERT INTO readings (sensor, field, timestamp, value) VALUES (?, ?, ?, ?)",
+    'actuations': "INSERT INTO actuations (device, timestamp, state) VALUES (?, ?, ?)",
+    'overrides': "INSERT INTO overrides (timestamp, command) VALUES (?, ?)",
+}
+
+
+class SQLiteStorage:
+    """!
+    SQLite storage engine. All timestamps are epoch timestamps in nanoseconds.
+    @param filename: Path of the SQLite database file.
+    """
+
+    filename: str = None
+
+    def __init__(self, filename="./database/master.sqlite"):
+        """!
+        Standard initialization. Creates the tables if they don't exist yet.
+        @param filename: Path of the SQLite database file.
+        """
+
+        self.filename = filename
+        self._connection = None
+
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+
+    def connect(self):
+        """!
+        Open a new connection to the database.
+        The database runs in WAL journal mode, so readers (e.g, plotting) never block the writer.
+        """
+
+        connection = sqlite3.connect(self.filename, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def write_batch(self, records):
+        """!
+        Insert a batch of records in a single transaction.
+        Records that are not of interest to the database (e.g, checkpoints) are skipped.
+        The connection is opened by the first call, so it belongs to the thread doing the writing.
+        @param records: List of tuples, each being one of:
+        ("reading", sensor_name, timestamp, data),
+        ("actuation", status, value, timestamp),
+        ("override", command, timestamp),
+        ("retention", raw_cutoff, minute_cutoff)
+        """
+
+        rows = {table: [] for table in INSERTS}
+        retention = None
+        for record in records:
+            if record[0] == "reading":
+                _, sensor_name, timestamp, data = record[:4]
+                if not isinstance(data, dict):
+                    data = {'value': data}
+                for field, value in data.items():
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    rows['readings'].append((sensor_name, field, timestamp, value))
+            elif record[0] == "actuation":
+                rows['actuations'].append((record[1], record[3], str(record[2])))
+            elif record[0] == "override":
+                rows['overrides'].append((record[2], str(record[1])))
+            elif record[0] == "retention":
+                retention = record[1:3]
+
+        if self._connection is None:
+            self._connection = self.connect()
+        try:
+            with self._connection:
+                for table, table_rows in rows.items():
+                    if table_rows:
+                        self._connection.executemany(INSERTS[table], table_rows)
+                if retention is not None:
+                    self.apply_retention(*retention)
+        except sqlite3.Error as err:
+            print("Unable to write to", self.filename + ":", err)
+
+    def apply_retention(self, raw_cutoff, minute_cutoff):
+        """!
+        Rolls up readings older than raw_cutoff into 1-minute aggregates, and 1-minute aggregates older than
+        minute_cutoff into 1-hour aggregates, discarding what was rolled up.
+        Cutoffs must be aligned to bucket boundaries (see RetentionPolicy.cutoffs).
+        @param raw_cutoff: Epoch timestamp (ns) before which raw readings are rolled up
+        @param minute_cutoff: Epoch timestamp (ns) before which 1-minute aggregates are rolled up
+        """
+        self._connection.execute(ROLLUP_READINGS, (raw_cutoff,))
+        self._connection.execute("DELETE FROM readings WHERE timestamp < ?", (raw_cutoff,))
+        self._connection.execute(ROLLUP_MINUTES, (minute_cutoff,))
+        self._connection.execute("DELETE FROM rollups WHERE resolution = 60 AND timestamp < ?", (minute_cutoff,))
+
+    def close(self):
+        """!
+        Close the writing connection. Only call this once nothing is writing anymore.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def query_readings(self, sensor_name, field, start_time=0, end_time=None):
+        """!
+        Returns a list of (timestamp, value) for a sensor field, in time order.
+        @param sensor_name: Name of the sensor
+        @param field: Name of the field, e.g. "temperature". Single number sensors use "value".
+        @param start_time: Epoch timestamp (ns) of the start of the range
+        @param end_time: Epoch timestamp (ns) of the end of the range. Defaults to now.
+        """
+
+        if end_time is None:
+            end_time = time.time_ns()
+        connection = self.connect()
+        try:
+            return connection.execute("SELECT timestamp, value FROM readings "
+                                      "WHERE sensor = ? AND field = ? AND timestamp >= ? AND timestamp < ? "
+                                      "ORDER BY timestamp", (sensor_name, field, start_time, end_time)).fetchall()
+        finally:
+            connection.close()
+
+    def query_history(self, sensor_name, field, start_time=0, end_time=None):
+        """!
+        Returns a list of (timestamp, value) for a sensor field, in time order, including the periods that have
+        been rolled up. Rolled up periods are represented by the mean of each bucket.
+        @param sensor_name: Name of the sensor
+        @param field: Name of the field, e.g. "temperature". Single number sensors use "value".
+        @param start_time: Epoch timestamp (ns) of the start of the range
+        @param end_time: Epoch timestamp (ns) of the end of the range. Defaults to now.
+        """
+
+        if end_time is None:
+            end_time = time.time_ns()
+        connection = self.connect()
+        try:
+            return connection.execute("SELECT timestamp, mean FROM rollups "
+                                      "WHERE sensor = ? AND field = ? AND timestamp >= ? AND timestamp < ? "
+                                      "UNION ALL "
+                                      "SELECT timestamp, value FROM readings "
+                                      "WHERE sensor = ? AND field = ? AND timestamp >= ? AND timestamp < ? "
+                                      "ORDER BY timestamp", (sensor_name, field, start_time, end_time) * 2).fetchall()
+        finally:
+            connection.close()
+
+
+def unit_test():
+    import os
+
+    storage = SQLiteStorage("./database/test_master.sqlite")
+    now = time.time_ns()
+    records = [("reading", "environment_sensor", now + k, {'temperature': float(k), 'gas': k * 1000}) for k in range(10)]
+    records.append(("actuation", "Pump Status", "ON", now))
+    records.append(("override", "Pump OFF", now))
+    storage.write_batch(records)
+    assert [value for _, value in storage.query_readings("environment_sensor", "temperature", now)] == [float(k) for k in range(10)]
+    storage.write_batch([("retention", now + 10, now - 3600000000000)])
+    storage.close()
+    assert storage.query_readings("environment_sensor", "temperature", now) == []
+    assert len(storage.query_history("environment_sensor", "temperature")) in [1, 2]  # Depending on minute boundary
+    for extension in ["", "-wal", "-shm"]:
+        if os.path.exists("./database/test_master.sqlite" + extension):
+            os.remove("./database/test_master.sqlite" + extension)
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,167 @@
+"""!
+Contains the containers that hold the state of the system.
+
+The state is split in three, based on how each part is used:
+- Configuration: The environment parameters loaded from a configuration file. Immutable once loaded;
+a new configuration file means a new Configuration object.
+- LiveState: The small set of values that change as the system runs (control element statuses, manual overrides,
+watering timing, moisture filter window). Stored in fixed slots, so it is compact and cheap to copy.
+- The sensor history, which lives in a TimeSeriesStore (see timeseries_utilities).
+
+This way, the hot paths and the control processes only ever touch (or get a copy of) the pieces they need,
+rather than one dictionary holding everything.
+"""
+
+
+from typing import NamedTuple
+from src.utilities.json_utilities import load_from_json
+
+
+# Maps the keys of the configuration files onto the fields of the Configuration
+CONFIGURATION_KEYS = {
+    'Temperature_Low': 'temperature_low',
+    'Temperature_High': 'temperature_high',
+    'Moisture_Low': 'moisture_low',
+    'Moisture_High': 'moisture_high',
+    'Humidity_Low': 'humidity_low',
+    'Humidity_High': 'humidity_high',
+    'VOC_Low': 'voc_low',
+    'VOC_High': 'voc_high',
+    'Soak_Minutes': 'soak_minutes',
+    'RGB_data': 'rgb_data',
+    'UV_data': 'uv_data',
+    'Fan_data': 'fan_data',
+}
+
+# Maps the status names used by the GUI onto the fields of the LiveState
+STATUS_FIELDS = {
+    "Pump Status": "pump_status",
+    "Fan Status": "fan_status",
+    "RGB LED Status": "rgb_led_status",
+    "UV LED Status": "uv_led_status",
+}
+
+# Maps the control element names used for manual overrides onto the fields of the LiveState
+OVERRIDE_FIELDS = {
+    "Pump": "pump_override",
+    "Fan": "fan_override",
+    "RGB LED": "rgb_led_override",
+    "UV LED": "uv_led_override",
+}
+
+
+class Configuration(NamedTuple):
+    """!
+    The environment parameters of the system, as loaded from a configuration file.
+    Hourly schedules (rgb_data, uv_data, fan_data) map the hour (as a string) to its setting.
+    """
+
+    temperature_low: float = None
+    temperature_high: float = None
+    moisture_low: float = None
+    moisture_high: float = None
+    humidity_low: float = None
+    humidity_high: float = None
+    voc_low: float = None
+    voc_high: float = None
+    soak_minutes: float = 60
+    rgb_data: dict = None
+    uv_data: dict = None
+    fan_data: dict = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """!
+        Create a Configuration from the contents of a configuration file. Unknown keys are ignored.
+        @param data: Dictionary as stored in the configuration file
+        """
+        return cls(**{field: data[key] for key, field in CONFIGURATION_KEYS.items() if key in data})
+
+    @classmethod
+    def load(cls, name):
+        """!
+        Load a Configuration from a configuration file.
+        @param name: Name of the configuration file, e.g. "basil"
+        """
+        return cls.from_dict(load_from_json("./configuration_files/" + name))
+
+
+class LiveState:
+    """!
+    The values that change as the system runs.
+    @param pump_status: "ON" or "OFF"
+    @param fan_status: "ON" or "OFF"
+    @param rgb_led_status: [red, green, blue]
+    @param uv_led_status: "ON" or "OFF"
+    @param pump_override: Flag for if the pump is being manually overridden
+    @param fan_override: Flag for if the fan is being manually overridden
+    @param rgb_led_override: Flag for if the RGB LEDs are being manually overridden
+    @param uv_led_override: Flag for if the UV LEDs are being manually overridden
+    @param last_watering: Time (datetime) the pump last finished watering
+    @param soak_end_time: Time (datetime) until which the previous watering is left to soak in
+    @param water_list: List of the previous 10 calculated moisture levels
+    """
+
+    __slots__ = ("pump_status", "fan_status", "rgb_led_status", "uv_led_status",
+                 "pump_override", "fan_override", "rgb_led_override", "uv_led_override",
+                 "last_watering", "soak_end_time", "water_list")
+
+    def __init__(self):
+        """!
+        Standard initialization. Everything starts up OFF and without overrides.
+        """
+
+        self.pump_status = "OFF"
+        self.fan_status = "OFF"
+        self.rgb_led_status = [0, 0, 0]
+        self.uv_led_status = "OFF"
+        self.pump_override = False
+        self.fan_override = False
+        self.rgb_led_override = False
+        self.uv_led_override = False
+        self.last_watering = None
+        self.soak_end_time = None
+        self.water_list = [None] * 10
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    def status(self, name):
+        """!
+        Returns the status of a control element.
+        @param name: Name of the status, e.g. "Pump Status"
+        """
+        return getattr(self, STATUS_FIELDS[name])
+
+    def as_dict(self):
+        """!
+        Returns the state as a dictionary, e.g. for saving a human-readable copy.
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+def unit_test():
+    import copy
+    import pickle
+
+    config = Configuration.load("basil")
+    assert config.moisture_low is not None and config.fan_data is None
+    try:
+        config.moisture_low = 0
+        assert False
+    except AttributeError:
+        pass
+
+    state = LiveState()
+    state.pump_status = "ON"
+    state.water_list[0] = 50.0
+    restored = pickle.loads(pickle.dumps(copy.deepcopy(state)))
+    assert restored.as_dict() == state.as_dict() and restored.status("Pump Status") == "ON"
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,199 @@
+"""!
+Contains the timer heap, which keeps track of every timed event of the control engine in one place.
+
+Each event has a name, the time it is due (on the monotonic clock, so changes to the system clock do not
+shift it), and a callback. The main loop asks the timer heap how long it can sleep for (see next_delay), and
+runs whatever is due when it wakes up (see run_due), so nothing is checked on every iteration.
+Events tied to the time of day (e.g, the top of every hour) are scheduled with schedule_at, which converts
+the wall-clock time to a monotonic deadline. The wall clock can be stepped after that (e.g, by NTP, once a Pi
+without a real-time clock gets online), so these events are checked against the wall clock again:
+- An event whose monotonic deadline comes before its wall-clock time is not run, but scheduled again for that time.
+- An event whose wall-clock time has come before its monotonic deadline is run anyway (on the next run_due).
+Repeating events schedule their next occurrence from their callback.
+"""
+
+
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+
+
+class TimerHeap:
+    """!
+    Holds the pending events, ordered by the time they are due.
+    Scheduling an event under a name that is already pending replaces that event.
+    """
+
+    def __init__(self, clock=time.monotonic, wall_clock=datetime.now):
+        """!
+        Standard initialization.
+        @param clock: Monotonic clock (s) that the events are timed on
+        @param wall_clock: Wall clock (datetime) that the events scheduled with schedule_at are checked against
+        """
+
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._heap = []
+        self._events = {}
+        self._counter = itertools.count()
+
+    def schedule(self, name, delay, callback):
+        """!
+        Schedules an event to be due after a delay.
+        @param name: Name of the event
+        @param delay: Time (s) from now until the event is due
+        @param callback: Function (no arguments) called once the event is due
+        """
+
+        self._push(name, self._clock() + delay, callback, None)
+
+    def schedule_at(self, name, when, callback):
+        """!
+        Schedules an event to be due at a wall-clock time. A time in the past is due right away.
+        @param name: Name of the event
+        @param when: Time (datetime) at which the event is due
+        @param callback: Function (no arguments) called once the event is due
+        """
+
+        self._push(name, self._clock() + (when - self._wall_clock()).total_seconds(), callback, when)
+
+    def _push(self, name, deadline, callback, when):
+        """!
+        Adds an event to the heap, replacing any pending event of the same name.
+        @param name: Name of the event
+        @param deadline: Time (s, on the monotonic clock) at which the event is due
+        @param callback: Function (no arguments) called once the event is due
+        @param when: Wall-clock time (datetime) at which the event is due, or None if it is not tied to one
+        """
+
+        entry = (deadline, next(self._counter), name)
+        self._events[name] = (entry, callback, when)
+        heapq.heappush(self._heap, entry)
+
+    def cancel(self, name):
+        """!
+        Removes a pending event. Does nothing if there is no such event.
+        @param name: Name of the event
+        """
+
+        self._events.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._events
+
+    def __len__(self):
+        return len(self._events)
+
+    def remaining(self, name):
+        """!
+        Returns the time (s) until a pending event is due (0 if it is overdue), or None if there is no such event.
+        @param name: Name of the event
+        """
+
+        if name not in self._events:
+            return None
+        return max(self._events[name][0][0] - self._clock(), 0.0)
+
+    def next_delay(self):
+        """!
+        Returns the time (s) until the next event is due (0 if one is overdue), or None if nothing is pending.
+        """
+
+        self._discard_stale()
+        if not self._heap:
+            return None
+        return max(self._heap[0][0] - self._clock(), 0.0)
+
+    def run_due(self):
+        """!
+        Calls the callback of every event that is due, in the order they were due, and returns how many there were.
+        Events that a callback schedules are only run right away if they are already due.
+        Events scheduled with schedule_at are due once their wall-clock time has come, whatever their monotonic deadline.
+        """
+
+        ran = 0
+        now = self._clock()
+        wall = self._wall_clock()
+        for name, (entry, callback, when) in list(self._events.items()):
+            if when is not None and when <= wall and entry[0] > now:  # The wall clock was stepped forward
+                self._push(name, now, callback, when)
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            _, callback, when = self._events.pop(entry[2])
+            if when is not None and when > self._wall_clock():  # The wall clock was stepped back
+                self.schedule_at(entry[2], when, callback)
+            else:
+                callback()
+                ran += 1
+            self._discard_stale()
+        return ran
+
+    def _discard_stale(self):
+        """!
+        Drops the entries at the top of the heap that belong to events that were cancelled or replaced.
+        """
+
+        while self._heap and self._events.get(self._heap[0][2], (None,))[0] != self._heap[0]:
+            heapq.heappop(self._heap)
+
+
+def next_hour(now=None):
+    """!
+    Returns the time (datetime) of the next top of the hour.
+    @param now: The current time. Defaults to now.
+    """
+
+    now = datetime.now() if now is None else now
+    return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+
+def unit_test():
+    clock = [0.0]
+    timers = TimerHeap(clock=lambda: clock[0])
+    fired = []
+    assert timers.next_delay() is None
+
+    timers.schedule("soak", 30, lambda: fired.append("soak"))
+    timers.schedule("pump_stop", 5, lambda: fired.append("pump_stop"))
+    timers.schedule("lighting", 10, lambda: fired.append("lighting"))
+    timers.schedule("lighting", 20, lambda: fired.append("lighting"))  # Replaces the first one
+    assert timers.next_delay() == 5 and len(timers) == 3
+    timers.cancel("pump_stop")
+    assert "pump_stop" not in timers and timers.next_delay() == 20
+
+    clock[0] = 19.9
+    assert timers.run_due() == 0
+    clock[0] = 25
+    assert timers.run_due() == 1 and fired == ["lighting"]
+    assert timers.remaining("soak") == 5 and timers.remaining("lighting") is None
+
+    # A repeating event reschedules itself from its callback
+    def repeat():
+        fired.append("repeat")
+        timers.schedule("repeat", 10, repeat)
+    timers.schedule("repeat", 0, repeat)
+    clock[0] = 40
+    assert timers.run_due() == 2 and fired == ["lighting", "repeat", "soak"]
+    assert timers.next_delay() == 10
+
+    # Wall-clock events follow the wall clock when it is stepped, in either direction
+    wall = [datetime(2020, 5, 1, 13, 59)]
+    timers = TimerHeap(clock=lambda: clock[0], wall_clock=lambda: wall[0])
+    fired = []
+    timers.schedule_at("lighting", datetime(2020, 5, 1, 14), lambda: fired.append("lighting"))
+    assert timers.remaining("lighting") == 60
+    clock[0] += 60
+    wall[0] = datetime(2020, 5, 1, 13, 50)  # Stepped back 10 minutes: the event is early
+    assert timers.run_due() == 0 and fired == [] and timers.remaining("lighting") == 600
+    clock[0] += 10
+    wall[0] = datetime(2020, 5, 1, 14, 0, 5)  # Stepped forward past the event: it is late
+    assert timers.run_due() == 1 and fired == ["lighting"]
+
+    assert next_hour(datetime(2020, 5, 1, 13, 59, 59)) == datetime(2020, 5, 1, 14)
+    assert next_hour(datetime(2020, 5, 1, 23, 0, 0)) == datetime(2020, 5, 2, 0)
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,415 @@
+"""!
+Contains the time-series store that holds the sensor reading history.
+
+Every field of every sensor (e.g, the temperature of the environment sensor) is kept in
+its own fixed-capacity ring buffer: one NumPy array of int64 epoch timestamps (in nanoseconds)
+and one NumPy array of float64 values. Once a buffer is full, the oldest readings are overwritten
+(and counted, see RingBuffer.overwritten), so the capacity should cover the raw retention window
+(see RetentionPolicy.raw_capacity).
+Readings are stamped when they are acquired (see Sensor.timestamp), so two readings never share a key.
+The timestamps within a buffer are kept sorted (a reading that arrives out of order is inserted in
+place), so any time range can be found with a binary search (O(log n)) and returned as a slice.
+
+Older readings can also be held as rollups: min/mean/max aggregates over fixed-size time
+buckets (e.g, 1 minute), see retention_utilities.
+"""
+
+
+import time
+import numpy as np
+
+
+NANOSECONDS_PER_SECOND = 1000000000
+DEFAULT_CAPACITY = 100000
+
+
+class RingBuffer:
+    """!
+    Fixed-capacity ring buffer of (timestamp, value) pairs for a single field of a single sensor.
+    @param capacity: Maximum number of readings held. Beyond this, the oldest readings are overwritten.
+    @param timestamps: Array of int64 epoch timestamps, in nanoseconds.
+    @param values: Array of float64 readings.
+    @param start: Index of the oldest reading.
+    @param size: Number of readings currently held.
+    @param overwritten: Number of readings that were overwritten because the buffer was full.
+    """
+
+    capacity: int = None
+    timestamps: np.ndarray = None
+    values: np.ndarray = None
+    start: int = 0
+    size: int = 0
+    overwritten: int = 0
+    _columns = ['timestamps', 'values']
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """!
+        Standard initialization.
+        @param capacity: Maximum number of readings held.
+        """
+
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.start = 0
+        self.size = 0
+        self.overwritten = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getstate__(self):
+        """!
+        Only the readings held (not the unused capacity) are pickled/copied, oldest first.
+        """
+        state = self.__dict__.copy()
+        indices = (self.start + np.arange(self.size)) % self.capacity
+        for column in self._columns:
+            state[column] = getattr(self, column)[indices]
+        state['start'] = 0
+        return state
+
+    def __setstate__(self, state):
+        for column in self._columns:
+            held = state[column]
+            state[column] = np.zeros(state['capacity'], dtype=held.dtype)
+            state[column][:len(held)] = held
+        self.__dict__.update(state)
+
+    def reserve(self, capacity):
+        """!
+        Grows the buffer to hold at least a number of readings. Does nothing if it already does.
+        @param capacity: Minimum number of readings held
+        """
+        if capacity > self.capacity:
+            state = self.__getstate__()
+            state['capacity'] = capacity
+            self.__setstate__(state)
+
+    def append(self, timestamp, value):
+        """!
+        Add a reading to the buffer, overwriting the oldest reading if the buffer is full.
+        @param timestamp: Epoch timestamp of the reading, in nanoseconds
+        @param value: The reading
+        """
+        self._append_row((timestamp, value))
+
+    def _append_row(self, row):
+        """!
+        Add an entry to the buffer, keeping the timestamps sorted.
+        Entries normally arrive in time order and are simply written at the end. An entry that is older than
+        the newest one held is inserted in place, which means rewriting the buffer (rare, so that's fine).
+        @param row: Tuple holding the entry's value for each column, in the order of _columns
+        """
+
+        if self.size and row[0] < self.timestamps[(self.start + self.size - 1) % self.capacity]:
+            indices = (self.start + np.arange(self.size)) % self.capacity
+            position = np.searchsorted(self.timestamps[indices], row[0], side='right')
+            for column, value in zip(self._columns, row):
+                held = np.insert(getattr(self, column)[indices], position, value)[-self.capacity:]
+                getattr(self, column)[:len(held)] = held
+            self.start = 0
+            if self.size < self.capacity:
+                self.size += 1
+            else:
+                self.overwritten += 1
+            return
+
+        end = (self.start + self.size) % self.capacity
+        for column, value in zip(self._columns, row):
+            getattr(self, column)[end] = value
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+            self.overwritten += 1
+
+    def _segments(self):
+        """!
+        Returns the physical (start, stop) index ranges holding the readings, oldest first.
+        A buffer that has wrapped around is held in two segments.
+        """
+        end = self.start + self.size
+        if end <= self.capacity:
+            return [(self.start, end)]
+        return [(self.start, self.capacity), (0, end - self.capacity)]
+
+    def _ranges(self, start_time, end_time):
+        """!
+        Returns the physical (lower, upper) index ranges of all readings with start_time <= timestamp < end_time.
+        """
+        ranges = []
+        for first, last in self._segments():
+            segment = self.timestamps[first:last]
+            lower = first + np.searchsorted(segment, start_time, side='left')
+            upper = first + np.searchsorted(segment, end_time, side='left')
+            ranges.append((lower, upper))
+        return ranges
+
+    def between(self, start_time, end_time):
+        """!
+        Returns the (timestamps, values) arrays of all readings with start_time <= timestamp < end_time.
+        @param start_time: Epoch timestamp (ns) of the start of the range
+        @param end_time: Epoch timestamp (ns) of the end of the range
+        """
+
+        ranges = self._ranges(start_time, end_time)
+        return (np.concatenate([self.timestamps[lower:upper] for lower, upper in ranges]),
+                np.concatenate([self.values[lower:upper] for lower, upper in ranges]))
+
+    def discard_before(self, timestamp):
+        """!
+        Drop all readings older than a timestamp.
+        @param timestamp: Epoch timestamp (ns) of the oldest reading to keep
+        """
+
+        count = sum(upper - lower for lower, upper in self._ranges(np.iinfo(np.int64).min, timestamp))
+        self.start = (self.start + count) % self.capacity
+        self.size -= count
+
+    def last(self, count):
+        """!
+        Returns the (timestamps, values) arrays of the most recent readings.
+        @param count: Maximum number of readings to return
+        """
+
+        count = min(count, self.size)
+        indices = (self.start + self.size - count + np.arange(count)) % self.capacity
+        return self.timestamps[indices], self.values[indices]
+
+    def latest(self):
+        """!
+        Returns the (timestamp, value) of the most recent reading.
+        """
+
+        if not self.size:
+            raise IndexError("Ring buffer is empty")
+        index = (self.start + self.size - 1) % self.capacity
+        return int(self.timestamps[index]), float(self.values[index])
+
+
+class RollupBuffer(RingBuffer):
+    """!
+    Ring buffer of aggregated readings. Each entry covers one time bucket, and is stamped with the start of the bucket.
+    The mean of each bucket is held in "values", so a RollupBuffer can be read like any other RingBuffer.
+    @param resolution: Length of each bucket in seconds.
+    @param minimum: Array of the lowest reading of each bucket.
+    @param maximum: Array of the highest reading of each bucket.
+    @param count: Array of the number of readings in each bucket.
+    """
+
+    resolution: int = None
+    minimum: np.ndarray = None
+    maximum: np.ndarray = None
+    count: np.ndarray = None
+    _columns = ['timestamps', 'values', 'minimum', 'maximum', 'count']
+
+    def __init__(self, resolution, capacity=DEFAULT_CAPACITY):
+        """!
+        Standard initialization.
+        @param resolution: Length of each bucket in seconds.
+        @param capacity: Maximum number of buckets held.
+        """
+
+        super().__init__(capacity)
+        self.resolution = resolution
+        self.minimum = np.zeros(capacity, dtype=np.float64)
+        self.maximum = np.zeros(capacity, dtype=np.float64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+
+    def append(self, timestamp, minimum, mean, maximum, count):
+        """!
+        Add a bucket to the end of the buffer, overwriting the oldest bucket if the buffer is full.
+        @param timestamp: Epoch timestamp (ns) of the start of the bucket
+        @param minimum: Lowest reading in the bucket
+        @param mean: Mean of the readings in the bucket
+        @param maximum: Highest reading in the bucket
+        @param count: Number of readings in the bucket
+        """
+
+        self._append_row((timestamp, mean, minimum, maximum, count))
+
+    def aggregates_between(self, start_time, end_time):
+        """!
+        Returns the (timestamps, minimum, mean, maximum, count) arrays of all buckets with start_time <= timestamp < end_time.
+        @param start_time: Epoch timestamp (ns) of the start of the range
+        @param end_time: Epoch timestamp (ns) of the end of the range
+        """
+
+        ranges = self._ranges(start_time, end_time)
+        return tuple(np.concatenate([column[lower:upper] for lower, upper in ranges])
+                     for column in [self.timestamps, self.minimum, self.values, self.maximum, self.count])
+
+
+class TimeSeriesStore:
+    """!
+    Holds the reading history of all sensors, as one ring buffer per sensor field.
+    Sensors that report a single number (e.g, soil moisture) are stored under the field "value".
+    @param capacity: Capacity of each ring buffer of raw readings.
+    @param rollup_capacity: Capacity of each ring buffer of rollups.
+    @param series: Dictionary mapping sensor name -> field name -> RingBuffer.
+    @param rollups: Dictionary mapping resolution (s) -> sensor name -> field name -> RollupBuffer.
+    """
+
+    capacity: int = None
+    rollup_capacity: int = DEFAULT_CAPACITY
+    series: dict = None
+    rollups: dict = None
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, rollup_capacity=DEFAULT_CAPACITY):
+        """!
+        Standard initialization.
+        @param capacity: Capacity of each ring buffer of raw readings.
+        @param rollup_capacity: Capacity of each ring buffer of rollups.
+        """
+
+        self.capacity = capacity
+        self.rollup_capacity = rollup_capacity
+        self.series = {}
+        self.rollups = {}
+
+    def reserve(self, capacity):
+        """!
+        Grows every ring buffer of raw readings (and the ones created from now on) to hold at least a number of readings.
+        @param capacity: Minimum capacity of each ring buffer of raw readings
+        """
+
+        self.capacity = max(self.capacity, capacity)
+        for fields in self.series.values():
+            for buffer in fields.values():
+                buffer.reserve(self.capacity)
+
+    def overwritten(self):
+        """!
+        Returns the number of raw readings (of all sensor fields) that were overwritten before being rolled up.
+        """
+        return sum(buffer.overwritten for fields in self.series.values() for buffer in fields.values())
+
+    def append(self, sensor_name, timestamp, data):
+        """!
+        Store a sensor reading.
+        Non-numeric fields (e.g, None after a failed read) are skipped.
+        @param sensor_name: Name of the sensor that took the reading
+        @param timestamp: Epoch timestamp of the reading, in nanoseconds
+        @param data: Either a single number, or a dictionary mapping field name -> number
+        """
+
+        if not isinstance(data, dict):
+            data = {'value': data}
+        fields = self.series.setdefault(sensor_name, {})
+        for field, value in data.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if field not in fields:
+                fields[field] = RingBuffer(self.capacity)
+            fields[field].append(timestamp, value)
+
+    def fields(self, sensor_name):
+        """!
+        Returns the names of all fields recorded for a sensor.
+        @param sensor_name: Name of the sensor
+        """
+        return list(self.series.get(sensor_name, {}))
+
+    def latest(self, sensor_name):
+        """!
+        Returns the most recent reading of a sensor, in the same shape the sensor reported it.
+        Raises a KeyError if the sensor has not reported anything yet.
+        @param sensor_name: Name of the sensor
+        """
+
+        fields = {field: buffer.latest()[1] for field, buffer in self.series.get(sensor_name, {}).items() if len(buffer)}
+        if not fields:
+            raise KeyError(sensor_name)
+        if list(fields) == ['value']:
+            return fields['value']
+        return fields
+
+    def between(self, sensor_name, field, start_time, end_time):
+        """!
+        Returns the (timestamps, values) arrays of a sensor field between two epoch timestamps (ns).
+        @param sensor_name: Name of the sensor
+        @param field: Name of the field
+        @param start_time: Epoch timestamp (ns) of the start of the range
+        @param end_time: Epoch timestamp (ns) of the end of the range
+        """
+        return self.series[sensor_name][field].between(start_time, end_time)
+
+    def rollup(self, resolution, sensor_name, field):
+        """!
+        Returns the RollupBuffer of a sensor field at a given resolution, creating it if it doesn't exist yet.
+        @param resolution: Length of each bucket in seconds
+        @param sensor_name: Name of the sensor
+        @param field: Name of the field
+        """
+
+        fields = self.rollups.setdefault(resolution, {}).setdefault(sensor_name, {})
+        if field not in fields:
+            fields[field] = RollupBuffer(resolution, self.rollup_capacity)
+        return fields[field]
+
+    def combined(self, sensor_name, field):
+        """!
+        Returns the (timestamps, values) arrays of the entire history of a sensor field, oldest first.
+        Periods that have been rolled up are represented by the mean of each bucket, coarsest first.
+        @param sensor_name: Name of the sensor
+        @param field: Name of the field
+        """
+
+        buffers = [self.rollups[resolution][sensor_name][field] for resolution in sorted(self.rollups, reverse=True)
+                   if field in self.rollups[resolution].get(sensor_name, {})]
+        buffers.append(self.series[sensor_name][field])
+        columns = [buffer.last(len(buffer)) for buffer in buffers]
+        return np.concatenate([column[0] for column in columns]), np.concatenate([column[1] for column in columns])
+
+    def window(self, sensor_name, field, seconds):
+        """!
+        Returns the (timestamps, values) arrays of a sensor field over the last N seconds.
+        @param sensor_name: Name of the sensor
+        @param field: Name of the field
+        @param seconds: Length of the window in seconds
+        """
+        now = time.time_ns()
+        return self.between(sensor_name, field, now - int(seconds * NANOSECONDS_PER_SECOND), now + 1)
+
+
+def unit_test():
+    import pickle
+
+    buffer = RingBuffer(capacity=5)
+    for k in range(8):
+        buffer.append(k * NANOSECONDS_PER_SECOND, float(k))
+    assert len(buffer) == 5
+    assert buffer.latest() == (7 * NANOSECONDS_PER_SECOND, 7.0)
+    timestamps, values = buffer.between(4 * NANOSECONDS_PER_SECOND, 7 * NANOSECONDS_PER_SECOND)
+    assert list(values) == [4.0, 5.0, 6.0]
+    assert list(buffer.last(3)[1]) == [5.0, 6.0, 7.0]
+    buffer.discard_before(6 * NANOSECONDS_PER_SECOND)
+    assert list(buffer.last(5)[1]) == [6.0, 7.0]
+    copied = pickle.loads(pickle.dumps(buffer))
+    assert copied.capacity == 5 and list(copied.last(5)[1]) == [6.0, 7.0]
+    assert buffer.overwritten == 3
+
+    # Out of order and identical timestamps are kept, in order
+    for timestamp, value in [(9, 9.0), (8, 8.0), (8, 8.5), (6, 6.5)]:
+        buffer.append(timestamp * NANOSECONDS_PER_SECOND, value)
+    assert list(buffer.last(5)[1]) == [6.5, 7.0, 8.0, 8.5, 9.0]
+
+    store = TimeSeriesStore(capacity=10)
+    store.append("soil_moisture_sensor_1", time.time_ns(), 55.5)
+    store.append("environment_sensor", time.time_ns(), {'temperature': 21.0, 'gas': 1000})
+    assert store.latest("soil_moisture_sensor_1") == 55.5
+    assert store.latest("environment_sensor") == {'temperature': 21.0, 'gas': 1000.0}
+    assert list(store.window("environment_sensor", "temperature", 60)[1]) == [21.0]
+
+    # Readings that do not fit are counted, and growing the buffers keeps the readings held
+    for k in range(12):
+        store.append("soil_moisture_sensor_1", time.time_ns(), float(k))
+    assert store.overwritten() == 3
+    store.reserve(20)
+    assert store.series["soil_moisture_sensor_1"]["value"].capacity == 20
+    assert list(store.series["soil_moisture_sensor_1"]["value"].last(3)[1]) == [9.0, 10.0, 11.0]
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,189 @@
+"""!
+Contains the write-ahead log (WAL) used for persisting the system state.
+
+Rather than re-serializing the entire system state every time a new reading
+arrives, each change is appended to the end of a log file as a small framed record.
+Every so often a checkpoint is taken: a full snapshot of the system state is written,
+and the log is started over. This way, the cost of saving a reading does not depend
+on how much history the system already holds.
+
+Each record in the log is framed as:
+[payload length (4 bytes)][CRC32 of payload (4 bytes)][payload (pickled (sequence number, record tuple))]
+
+Every record gets the next sequence number, and every snapshot remembers the sequence number
+of the last record it contains. On start up, the state is restored by loading the latest snapshot
+and replaying only the records of the log that come after it.
+
+A record is a tuple whose first element names the kind of change, e.g:
+("set", field, value) for a live state field, or ("reading", sensor_name, timestamp, data) for a sensor reading.
+"""
+
+
+import os
+import mmap
+import pickle
+import struct
+import zlib
+from src.utilities.pickle_utilities import export_object
+
+
+FRAME_HEADER = struct.Struct("<II")
+
+
+def read_records(filename):
+    """!
+    Generator that yields the (sequence number, record) of every valid record of a log file, in the order they were written.
+    Reading stops at the first incomplete or corrupt frame (e.g, the power was cut mid-write).
+    @param filename: Path of the log file
+    """
+
+    if not os.path.exists(filename):
+        return
+    with open(filename, 'rb') as f:
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            length, checksum = FRAME_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                print("Discarding corrupt tail of", filename)
+                return
+            yield pickle.loads(payload)
+
+
+class WriteAheadLog:
+    """!
+    Append-only log of changes made to the system state, with periodic snapshot checkpoints.
+    @param filename: Path of the snapshot. The log is stored next to it with a ".wal" extension.
+    @param log_file_name: Path of the log file.
+    @param checkpoint_interval: Number of records appended before a checkpoint is due.
+    @param record_count: Number of records appended since the last checkpoint.
+    @param sequence: Sequence number of the last record appended.
+    """
+
+    filename: str = None
+    log_file_name: str = None
+    checkpoint_interval: int = 1000
+    record_count: int = 0
+    sequence: int = 0
+
+    def __init__(self, filename="./database/master", checkpoint_interval=1000):
+        """!
+        Standard initialization.
+        @param filename: Path of the snapshot. The log is stored next to it with a ".wal" extension.
+        @param checkpoint_interval: Number of records appended before a checkpoint is due.
+        """
+
+        self.filename = filename
+        self.log_file_name = filename + ".wal"
+        self.checkpoint_interval = checkpoint_interval
+        self.record_count = 0
+        self.sequence = 0
+        self._log_file = open(self.log_file_name, 'ab')
+
+    def write_batch(self, records):
+        """!
+        Append a batch of changes to the end of the log with a single write.
+        A ("checkpoint", snapshot) record within the batch takes a checkpoint. Since everything
+        before the latest checkpoint is already part of its snapshot, only the records after it are logged.
+        @param records: List of tuples describing the changes
+        """
+
+        for index in range(len(records) - 1, -1, -1):
+            if records[index][0] == "checkpoint":
+                self.sequence += index
+                self.checkpoint(records[index][1])
+                records = records[index + 1:]
+                break
+        if not records:
+            return
+
+        frames = []
+        for record in records:
+            self.sequence += 1
+            payload = pickle.dumps((self.sequence, record), protocol=pickle.HIGHEST_PROTOCOL)
+            frames.append(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)))
+            frames.append(payload)
+        self._log_file.write(b"".join(frames))
+        self._log_file.flush()
+        self.record_count += len(records)
+
+    def checkpoint(self, snapshot):
+        """!
+        Write a full snapshot of the system state, then start the log over.
+        The snapshot is written to a temporary file first and then moved into place,
+        so a crash mid-checkpoint never leaves a half-written snapshot behind.
+        @param snapshot: The (picklable) object to snapshot
+        """
+
+        temporary_name = self.filename + ".tmp"
+        if export_object(temporary_name, {'sequence': self.sequence, 'snapshot': snapshot}):
+            return 1
+        with open(temporary_name, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temporary_name, self.filename)
+
+        # Anything in the log is now part of the snapshot
+        self._log_file.close()
+        self._log_file = open(self.log_file_name, 'wb')
+        self.record_count = 0
+        return 0
+
+    def restore(self):
+        """!
+        Returns (snapshot, records): the latest snapshot (None if there isn't one), and the list of records
+        that were logged after it, in order. Continues the sequence numbering from where it left off.
+        The snapshot is memory-mapped rather than read into an intermediate buffer.
+        """
+
+        snapshot, sequence = None, 0
+        if os.path.exists(self.filename) and os.path.getsize(self.filename):
+            try:
+                with open(self.filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    stored = pickle.loads(mapped)
+                snapshot, sequence = stored['snapshot'], stored['sequence']
+            except Exception as e:
+                print("Unable to restore snapshot", self.filename + ":", e)
+
+        records = []
+        self.sequence = sequence
+        for record_sequence, record in read_records(self.log_file_name):
+            if record_sequence > sequence:
+                records.append(record)
+            self.sequence = max(self.sequence, record_sequence)
+        self.record_count = len(records)
+        return snapshot, records
+
+    def close(self):
+        """!
+        Close the log file.
+        """
+        if not self._log_file.closed:
+            self._log_file.close()
+
+
+def unit_test():
+    state = {}
+    wal = WriteAheadLog("./database/test_master", checkpoint_interval=10)
+    for k in range(0, 25, 5):
+        batch = [("set", str(index), float(index)) for index in range(k, k + 5)]
+        state.update({record[1]: record[2] for record in batch})
+        if k + 5 in (10, 20):  # Like the engine, the checkpoint goes in the batch that makes one due
+            batch.append(("checkpoint", dict(state)))
+        wal.write_batch(batch)
+    wal.close()
+
+    wal = WriteAheadLog("./database/test_master", checkpoint_interval=10)
+    restored, records = wal.restore()
+    assert len(records) == 5 and wal.sequence == 25
+    for _, field, value in records:
+        restored[field] = value
+    assert restored == state
+    wal.close()
+    for extension in ["", ".wal"]:
+        os.remove("./database/test_master" + extension)
+
+
+if __name__ == "__main__":
+    unit_test()